@@ -1,41 +1,86 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
 from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import ValidationError
 from pynamodb.exceptions import DoesNotExist
+from typing import Iterator, Optional
+import json
 
 from app.models import schemas
-from app.service.idgenerator import randomID
+from app.service.idgenerator import randomID, range_allocator
 from app.models.database import Urls, Users
-from app.auth.auth import get_current_user
+from app.auth.auth import get_current_claims, set_token_version
+from app.service import url_cache, access_tracker, user_cache, url_ownership, code_pool, pwhashing, codec
+from app.service.bloom_filter import shortcode_filter
+from app.service.redis_client import redis_client, redis_breaker, pool_stats
+from app.service.cache_keys import migrate_legacy_keys
+from app.service.single_flight import url_fetches
+from app.service.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, decode_cursor
 
 
 router = APIRouter()
 
+def _url_pair_row(url_pair: Urls) -> dict:
+    return {"short_url": url_pair.short_url, "long_url": url_pair.long_url, "creator_email": url_pair.creator_email}
+
+
+def _stream_url_pairs(last_evaluated_key: Optional[dict], page_size: int) -> Iterator[str]:
+    # the scan fetches the next page only when the previous one is written out, so memory use stays flat
+    for url_pair in Urls.scan(last_evaluated_key=last_evaluated_key, page_size=page_size):
+        yield json.dumps(_url_pair_row(url_pair)) + "\n"
+
+
 # grab all url pairs
 @router.get("/list_urls")
-def get_all_urls(current_user: Users = Depends(get_current_user)):
+def get_all_urls(
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    current_user: schemas.Claims = Depends(get_current_claims)
+):
     """
-    Get request to retrieve all short url to long url pairs
+    Get request to retrieve short url to long url pairs, one page at a time
     
     Only users with admin privileges can access this endpoint.
 
+    Args:
+        limit (int, optional): Maximum number of pairs per page, or per scan request when streaming. Defaults to DEFAULT_PAGE_SIZE.
+        cursor (str, optional): next_cursor of the previous page. Defaults to None for the first page.
+        stream (bool, optional): Stream every pair from the cursor on as newline-delimited JSON instead of returning one page. Defaults to False.
+        current_user (schemas.Claims): Claims of the current logged-in user obtained from JWT token.
+
+    Raises:
+        HTTPException: The limit is out of range or the cursor is invalid.
+
     Returns:
-        dict: All short url to long url pairs
+        dict: The page of url pairs and the cursor of the next page, None on the last page
     """
     
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    url_pairs = {(urlpair.short_url, urlpair.long_url, urlpair.creator_email) for urlpair in Urls.scan()}
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {MAX_PAGE_SIZE}.")
+    try:
+        # checked up front, a stream can't turn into an error once it has started
+        last_evaluated_key = decode_cursor(cursor, ["short_url"])
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    
+    if stream:
+        return StreamingResponse(_stream_url_pairs(last_evaluated_key, limit), media_type="application/x-ndjson")
     
-    return url_pairs
+    results = Urls.scan(limit=limit, last_evaluated_key=last_evaluated_key)
+    url_pairs = [_url_pair_row(url_pair) for url_pair in results]
+    
+    return {"urls": url_pairs, "next_cursor": encode_cursor(results.last_evaluated_key)}
 
 
 @router.patch("/update_url_limit")
 def update_url_limit(
     user_email: schemas.Email,
     new_limit: int,
-    current_user: Users = Depends(get_current_user)
+    current_user: schemas.Claims = Depends(get_current_claims)
 ):
     """
     Update the URL limit for a user. This endpoint is admin protected.
@@ -45,7 +90,7 @@ def update_url_limit(
     Args:
         user_email (str): Email of the user to update the URL limit.
         new_limit (int): New URL limit for the user.
-        current_user (Users): Current logged-in user obtained from JWT token.
+        current_user (schemas.Claims): Claims of the current logged-in user obtained from JWT token.
 
     Returns:
         dict: Message indicating success or failure.
@@ -64,11 +109,117 @@ def update_url_limit(
         raise HTTPException(status_code=404, detail=f"User with email {user_email} not found.")
 
     # Check if the new limit is less than the existing URL count for the user
-    if new_limit < len(user.urls):
+    if new_limit < url_ownership.count_user_urls(user.email):
         raise HTTPException(status_code=400, detail="New limit cannot be less than the existing URL count.")
 
-    # Update the URL limit for the user
-    user.url_limit = new_limit
-    user.save()
+    # Update the URL limit for the user, and outdate their access tokens so the new limit
+    # reaches them on their next refresh. One atomic update, so concurrent changes can't undo each other
+    user.update(actions=[Users.url_limit.set(new_limit), Users.token_version.add(1)], condition=Users.email.exists())
+    user_cache.invalidate_user(user.email)
+    set_token_version(user.email, user.token_version)
+
+    return {"message": f"URL limit updated successfully for user {user_email}." }
+
+
+@router.post("/rebuild_shortcode_filter")
+def rebuild_shortcode_filter(
+    background_tasks: BackgroundTasks,
+    current_user: schemas.Claims = Depends(get_current_claims)
+):
+    """
+    Rebuild the filter of allocated short codes from a scan of the URL table. This endpoint is admin protected.
+    The rebuild runs in the background and swaps the new filter in when the scan finishes.
+
+    Args:
+        background_tasks (BackgroundTasks): Runs the rebuild after the response is sent.
+        current_user (schemas.Claims): Claims of the current logged-in user obtained from JWT token.
+
+    Returns:
+        dict: Message indicating the rebuild has started.
+    """
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin users can rebuild the short code filter.")
+
+    # the approximate item count is enough to size the new filter
+    expected_items = Urls.describe_table().get("ItemCount", 0)
+    short_urls = (url_pair.short_url for url_pair in Urls.scan(attributes_to_get=["short_url"]))
+    background_tasks.add_task(shortcode_filter.rebuild, short_urls, expected_items)
+
+    return {"message": "Short code filter rebuild started."}
+
+
+@router.post("/migrate_url_ownership")
+def migrate_url_ownership(
+    background_tasks: BackgroundTasks,
+    current_user: schemas.Claims = Depends(get_current_claims)
+):
+    """
+    Move URL ownership from the legacy URL lists on user records to the creator index. This endpoint is admin protected.
+    The migration runs in the background and can be started again if it was interrupted.
+
+    Args:
+        background_tasks (BackgroundTasks): Runs the migration after the response is sent.
+        current_user (schemas.Claims): Claims of the current logged-in user obtained from JWT token.
+
+    Returns:
+        dict: Message indicating the migration has started.
+    """
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin users can migrate URL ownership.")
+
+    background_tasks.add_task(url_ownership.migrate_user_urls)
+
+    return {"message": "URL ownership migration started."}
+
+
+@router.post("/migrate_cache_keys")
+def migrate_cache_keys(
+    background_tasks: BackgroundTasks,
+    current_user: schemas.Claims = Depends(get_current_claims)
+):
+    """
+    Move Redis keys written before the typed key schema to their new names. This endpoint is admin protected.
+    The migration runs in the background and can be started again if it was interrupted.
+
+    Args:
+        background_tasks (BackgroundTasks): Runs the migration after the response is sent.
+        current_user (schemas.Claims): Claims of the current logged-in user obtained from JWT token.
+
+    Returns:
+        dict: Message indicating the migration has started.
+    """
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only admin users can migrate cache keys.")
+
+    background_tasks.add_task(migrate_legacy_keys, redis_client)
+
+    return {"message": "Cache key migration started."}
+
+
+@router.get("/metrics")
+def get_metrics(current_user: schemas.Claims = Depends(get_current_claims)):
+    """
+    Get request to retrieve in-process cache metrics for the worker serving the request.
+
+    Only users with admin privileges can access this endpoint.
+
+    Returns:
+        dict: Metrics grouped by component
+    """
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Forbidden")
 
-    return {"message": f"URL limit updated successfully for user {user_email}." }
\ No newline at end of file
+    return {
+        "url_l1_cache": url_cache.url_l1_cache.stats(),
+        "url_negative_cache": url_cache.url_negative_cache.stats(),
+        "shortcode_filter": shortcode_filter.stats(),
+        "access_tracker": access_tracker.stats(),
+        "url_fetches": url_fetches.stats(),
+        "user_cache": user_cache.stats(),
+        "id_allocator": range_allocator.stats(),
+        "code_pool": code_pool.stats(),
+        "password_hashing": pwhashing.stats(),
+        "redis_breaker": redis_breaker.stats(),
+        "redis_pools": pool_stats(),
+        "cache_codec": codec.stats(),
+    }
@@ -1,4 +1,5 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from apitally.fastapi import ApitallyMiddleware
 import os
 from dotenv import load_dotenv
@@ -8,7 +9,8 @@ from app.api.url_handlers import router as url_router
 from app.api.user_handlers import router as user_router
 from app.api.admin_handlers import router as admin_router
 from app.service.redis_client import redis_client
-from app.service.cache_population import populate_cache_from_database
+from app.service.cache_population import start_background_warmup, warmup_status
+from app.service import invalidation, access_tracker, code_pool, pwhashing, cache_keys, url_cache
 from app.models.database import Urls
 
 
@@ -22,7 +24,47 @@ app.add_middleware(
     env="prod" if os.getenv("PRODUCTION") else "dev"
 )
 
-populate_cache_from_database(redis_client=redis_client, Urls=Urls)
+@app.on_event("startup")
+def start_background_services():
+    # carry the ID counter, code pool and short code filter over from the old key names
+    try:
+        cache_keys.migrate_legacy_state(redis_client)
+    except Exception as e:
+        print(f"Moving legacy Redis state failed: {e}")
+    # cache buckets expire field by field where Redis supports it
+    url_cache.detect_bucket_field_ttl()
+    # listen for cache invalidations published by other workers
+    invalidation.start_listener()
+    # buffer access counts in process and write them to Redis in batches
+    access_tracker.start_flusher()
+    # warm the cache in the background, lookups read through to the database meanwhile
+    start_background_warmup(redis_client=redis_client, Urls=Urls)
+    # keep the pool of verified unused short codes filled, only with ID_ALLOCATOR=pool
+    code_pool.start_refiller()
+
+
+@app.on_event("shutdown")
+def stop_background_services():
+    invalidation.stop_listener()
+    access_tracker.stop_flusher()
+    code_pool.stop_refiller()
+
+
+@app.exception_handler(pwhashing.PasswordHashingBusy)
+async def password_hashing_busy(request: Request, exc: pwhashing.PasswordHashingBusy):
+    """An overloaded hashing pool turns into a 503 the client can retry."""
+    return JSONResponse(status_code=503, content={"detail": "Too many password requests, please try again shortly."}, headers={"Retry-After": "1"})
+
+
+@app.get("/ready")
+def readiness():
+    """Report readiness together with the progress of the cache warm-up.
+
+    Workers serve right away and read through to the database on misses, so the
+    warm-up is only reported here and never holds a worker out of rotation.
+    """
+    return {"ready": True, "cache_warmup": warmup_status(redis_client)}
+
 
 # Mount routers
 app.include_router(url_router, tags=["urls"])
@@ -1,17 +1,28 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import RedirectResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi import HTTPException
-from typing import Optional
-from pynamodb.exceptions import DoesNotExist
+from typing import List, Optional
+from dotenv import load_dotenv
+from pynamodb.exceptions import DoesNotExist, PutError
 
 
 
 from app.models import schemas
-from app.service.idgenerator import randomID
-from app.models.database import Urls, Users
-from app.auth.auth import get_current_user
-from app.service.redis_client import redis_client
-from app.service.cache_population import expiration_time
+from app.service.idgenerator import newID, ids_are_unique
+from app.models.database import Urls, BATCH_GET_SIZE
+from app.auth.auth import get_current_claims
+from app.service import url_cache, access_tracker, url_ownership, code_pool, idgenerator
+from app.service.bloom_filter import shortcode_filter
+from app.service.single_flight import url_fetches
+load_dotenv()
+
+# largest batch accepted by the bulk endpoints
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", 1000))
+# concurrent conditional writes in a bulk shorten
+BULK_WRITE_CONCURRENCY = int(os.getenv("BULK_WRITE_CONCURRENCY", 8))
 
 
 router = APIRouter()
@@ -26,7 +37,7 @@ def test():
 @router.post("/shorten_url")
 def to_shorten(
     long_url: schemas.longURL,
-    current_user: Users = Depends(get_current_user),
+    current_user: schemas.Claims = Depends(get_current_claims),
     short_url: Optional[schemas.shortURL] = None
 ) -> dict:
     """
@@ -35,7 +46,7 @@ def to_shorten(
 
     Args:
         long_url (schemas.LongURL): Long URL to be shortened.
-        current_user (Users): Current logged-in user obtained from JWT token.
+        current_user (schemas.Claims): Claims of the current logged-in user obtained from JWT token.
         short_url (Optional[schemas.ShortURL], optional): User-specified short URL. Defaults to None.
 
     Raises:
@@ -50,49 +61,173 @@ def to_shorten(
     
 
     # Check if the user has reached the URL limit
-    if len(current_user.urls) >= current_user.url_limit:
+    if url_ownership.count_user_urls(current_user.email) >= current_user.url_limit:
         raise HTTPException(status_code=400, detail=f"User has reached the maximum URL limit of {current_user.url_limit} short urls.")
     
-    # Check if the short URL already exists in the cache
-    if short_url and redis_client.exists(short_url.short_Url):
+    # A custom short URL only needs a database check if the filter says it might be taken
+    if short_url and shortcode_filter.might_contain(short_url.short_Url) and any(Urls.query(short_url.short_Url)):
         raise HTTPException(status_code=400, detail=f"Short URL {short_url.short_Url} already exists, please try another one.")
     
-    # When no short URL is given, generate one
-    if short_url is None:
-        short_url = randomID()
-        while redis_client.exists(short_url):  # Check if the generated short URL already exists in the cache
-            short_url = randomID()
-        short_url = schemas.shortURL(short_Url=short_url)
+    # When no short URL is given, generate one that is not taken
+    generated = short_url is None
+    if generated:
+        short_url = schemas.shortURL(short_Url=_new_short_url())
     
-    # If short URL is in the database, raise an error
-    if any(Urls.query(short_url.short_Url)):
-        raise HTTPException(status_code=400, detail=f"Short URL {short_url.short_Url} already exists, please try another one.")
+    # Create URL pair and save it to the database, associating it with the current user.
+    # The condition catches codes the filter has not seen, e.g. ones created before its first rebuild
+    while not _save_new_url(short_url.short_Url, str(long_url.url), current_user.email):
+        if not generated:
+            raise HTTPException(status_code=400, detail=f"Short URL {short_url.short_Url} already exists, please try another one.")
+        # someone picked the generated code as their custom short URL
+        short_url = schemas.shortURL(short_Url=_new_short_url())
+    shortcode_filter.add(short_url.short_Url)
+
+    # Ownership lives on the URL pair itself, only the user's cached count and list go stale
+    url_ownership.adjust_user_urls(current_user.email, 1)
+    
+    # Cache the short URL and drop any stale copy held by other workers
+    url_cache.set_long_url(short_url.short_Url, str(long_url.url))
+    
+    return { "short_url": short_url.short_Url, "long_url": str(long_url.url) }
     
-    # Create URL pair and save it to the database, associating it with the current user
-    url_pair = Urls(short_url=short_url.short_Url, long_url=str(long_url.url), creator_email=current_user.email)
-    url_pair.save()
 
-    # Append the new URL to the list of URLs for the current user
-    current_user.urls.append([short_url.short_Url, str(long_url.url)])
-    current_user.save()
+@router.post("/shorten_urls")
+def shorten_urls(
+    items: List[schemas.shortenItem],
+    current_user: schemas.Claims = Depends(get_current_claims)
+) -> dict:
+    """
+    Bulk version of /shorten_url. Shorten every long URL in the request, with an optional short URL each.
+    The quota is checked once, the new URL pairs are written concurrently and cached in batches.
+
+    Args:
+        items (List[schemas.shortenItem]): Long URLs to be shortened, each with an optional user-specified short URL.
+        current_user (schemas.Claims): Claims of the current logged-in user obtained from JWT token.
+
+    Raises:
+        HTTPException: The request has too many items or would take the user over their URL limit.
+
+    Returns:
+        dict: One result per item in request order, with the short URL and an error message for items that were not created.
+    """
+    if current_user is None:
+        raise HTTPException(status_code=401, detail="Authentication required to access this endpoint.")
     
-    # Cache the short URL with an expiration time
-    redis_client.setex(short_url.short_Url, expiration_time, str(long_url.url))
+    if len(items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_ITEMS} URLs can be shortened per request.")
     
-    return { "short_url": short_url.short_Url, "long_url": str(long_url.url) }
+    # Check the quota once for the whole batch
+    if url_ownership.count_user_urls(current_user.email) + len(items) > current_user.url_limit:
+        raise HTTPException(status_code=400, detail=f"Creating {len(items)} short urls would exceed the maximum URL limit of {current_user.url_limit} short urls.")
+    
+    results = [{"short_url": item.short_url.short_Url if item.short_url else None, "long_url": str(item.long_url.url), "error": None} for item in items]
+    
+    # Custom short URLs must be unique within the request and unused in the database
+    custom, requested = [], set()
+    for result in results:
+        if result["short_url"] is None:
+            continue
+        if result["short_url"] in requested:
+            result["error"] = f"Short URL {result['short_url']} is requested more than once."
+        else:
+            requested.add(result["short_url"])
+            custom.append(result)
+    taken = _existing_short_urls([result["short_url"] for result in custom])
+    for result in custom:
+        if result["short_url"] in taken:
+            result["error"] = f"Short URL {result['short_url']} already exists, please try another one."
+    custom = [result for result in custom if result["error"] is None]
+    
+    # Generate the missing short URLs in bulk
+    generated = [result for result in results if result["short_url"] is None]
+    for result, short_url in zip(generated, _unseen_short_urls(len(generated))):
+        result["short_url"] = short_url
+    
+    # Every pair is written with a conditional put, which batch writes can't express. The filter misses
+    # codes it was never told about or lost with Redis, and a plain write would overwrite their pairs
+    with ThreadPoolExecutor(max_workers=BULK_WRITE_CONCURRENCY) as pool:
+        saved = list(pool.map(lambda result: _save_new_url(result["short_url"], result["long_url"], current_user.email), custom))
+        generated_urls = list(pool.map(lambda result: _save_generated_url(result["short_url"], result["long_url"], current_user.email), generated))
+    for result, short_url in zip(generated, generated_urls):
+        result["short_url"] = short_url
+    for result, ok in zip(custom, saved):
+        if not ok:
+            result["error"] = f"Short URL {result['short_url']} already exists, please try another one."
+    
+    created = {result["short_url"]: result["long_url"] for result in results if result["error"] is None}
+    if created:
+        shortcode_filter.add_many(list(created))
+        url_ownership.adjust_user_urls(current_user.email, len(created))
+        url_cache.set_long_urls(created)
+    
+    return {"results": results}
+
+
+def _existing_short_urls(short_urls: List[str]) -> set:
+    """The short URLs that are already in the database, read in batches."""
+    # only codes the filter might have seen need a database read
+    possible = [short_url for short_url, seen in zip(short_urls, shortcode_filter.might_contain_many(short_urls)) if seen] if short_urls else []
+    existing = set()
+    for start in range(0, len(possible), BATCH_GET_SIZE):
+        existing |= {url_pair.short_url for url_pair in Urls.batch_get(possible[start:start + BATCH_GET_SIZE], attributes_to_get=["short_url"])}
+    return existing
+
+
+def _new_short_url() -> str:
+    """Generate a short URL nobody has taken yet."""
+    # pooled codes were verified unused by the refiller, an empty pool falls back to generating one here
+    if idgenerator.ID_ALLOCATOR == "pool":
+        short_url = code_pool.take()
+        if short_url is not None:
+            return short_url
+    short_url = newID()
+    # leased IDs are unique by construction, random ones need the filter's word they are unused
+    while not ids_are_unique() and shortcode_filter.might_contain(short_url):
+        short_url = newID()
+    return short_url
+
+
+def _unseen_short_urls(count: int) -> List[str]:
+    """Generate count short URLs the filter has definitely never seen."""
+    # checked even when IDs are unique, a custom short URL may have taken one
+    short_urls = []
+    while len(short_urls) < count:
+        needed = count - len(short_urls)
+        candidates = code_pool.take_many(needed) if idgenerator.ID_ALLOCATOR == "pool" else []
+        candidates += [newID() for _ in range(needed - len(candidates))]
+        short_urls += [short_url for short_url, seen in zip(candidates, shortcode_filter.might_contain_many(candidates)) if not seen]
+    return short_urls
+
+
+def _save_new_url(short_url: str, long_url: str, creator_email: str) -> bool:
+    """Save a URL pair unless the short URL exists already, False if it does."""
+    try:
+        Urls(short_url=short_url, long_url=long_url, creator_email=creator_email).save(condition=Urls.short_url.does_not_exist())
+    except PutError as e:
+        if e.cause_response_code != "ConditionalCheckFailedException":
+            raise
+        return False
+    return True
+
+
+def _save_generated_url(short_url: str, long_url: str, creator_email: str) -> str:
+    """Save a URL pair under a generated short URL, generating another one while it is taken. Returns the one saved."""
+    while not _save_new_url(short_url, long_url, creator_email):
+        short_url = _new_short_url()
+    return short_url
     
 
 @router.delete("/delete_url")
 def delete_url(
     short_url: schemas.shortURL,
-    current_user: Users = Depends(get_current_user)
+    current_user: schemas.Claims = Depends(get_current_claims)
 ) -> dict:
     """
     Delete a URL pair associated with the provided short URL.
 
     Args:
         short_url (str): Short URL to be deleted.
-        current_user (Users): Current logged-in user obtained from JWT token.
+        current_user (schemas.Claims): Claims of the current logged-in user obtained from JWT token.
 
     Raises:
         HTTPException: If the provided short URL does not exist or does not belong to the current user.
@@ -113,17 +248,95 @@ def delete_url(
     
     # Delete the URL pair from the database
     url_pair.delete()
+    url_cache.evict_long_url(short_url.short_Url)
 
-    # Filter out the dictionary with key
-    current_user.urls = [[shortUrl, LongUrl] for shortUrl, LongUrl in current_user.urls if shortUrl != short_url.short_Url]
-    current_user.save()
+    url_ownership.adjust_user_urls(current_user.email, -1)
 
     return { "message": f"Short URL '{short_url.short_Url}' deleted successfully." }
 
 
+@router.delete("/delete_urls")
+def delete_urls(
+    short_urls: List[schemas.shortURL],
+    current_user: schemas.Claims = Depends(get_current_claims)
+) -> dict:
+    """
+    Bulk version of /delete_url. Delete every URL pair in the request that belongs to the current user.
+    Ownership is checked with batched reads and the pairs are removed with batch writes.
+
+    Args:
+        short_urls (List[schemas.shortURL]): Short URLs to be deleted.
+        current_user (schemas.Claims): Claims of the current logged-in user obtained from JWT token.
+
+    Raises:
+        HTTPException: The request has too many short URLs.
+
+    Returns:
+        dict: One result per distinct short URL in request order, with an error message for the ones that were not deleted.
+    """
+    if current_user is None:
+        raise HTTPException(status_code=401, detail="Authentication required to access this endpoint.")
+    
+    if len(short_urls) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_ITEMS} URLs can be deleted per request.")
+    requested = list(dict.fromkeys(short_url.short_Url for short_url in short_urls))
+    
+    # Check ownership of every short URL with batched reads
+    owned = set()
+    for start in range(0, len(requested), BATCH_GET_SIZE):
+        batch = requested[start:start + BATCH_GET_SIZE]
+        owned |= {url_pair.short_url for url_pair in Urls.batch_get(batch, attributes_to_get=["short_url", "creator_email"]) if url_pair.creator_email == current_user.email}
+    
+    # Delete the owned URL pairs, then clear them from every cache in one go
+    if owned:
+        with Urls.batch_write() as batch:
+            for short_url in owned:
+                batch.delete(Urls(short_url=short_url))
+        url_cache.evict_long_urls(list(owned))
+        url_ownership.adjust_user_urls(current_user.email, -len(owned))
+    
+    results = [
+        {"short_url": short_url, "error": None if short_url in owned else f"Short URL '{short_url}' not found or does not belong to the current user."}
+        for short_url in requested
+    ]
+    return {"results": results}
+
+
+@router.get("/url_clicks")
+def get_url_clicks(
+    short_url: str,
+    current_user: schemas.Claims = Depends(get_current_claims)
+) -> dict:
+    """
+    Get the click count of a short URL. Only its creator or an admin can read it.
+
+    Args:
+        short_url (str): Short URL to get the click count for.
+        current_user (schemas.Claims): Claims of the current logged-in user obtained from JWT token.
+
+    Raises:
+        HTTPException: If the short URL does not exist or does not belong to the current user.
+
+    Returns:
+        dict: Dictionary containing the short URL and its click count.
+    """
+    if current_user is None:
+        raise HTTPException(status_code=401, detail="Authentication required to access this endpoint.")
+
+    try:
+        url_pair = Urls.get(short_url)
+    except DoesNotExist:
+        url_pair = None
+    if not url_pair or (url_pair.creator_email != current_user.email and not current_user.is_admin):
+        raise HTTPException(status_code=404, detail=f"Short URL '{short_url}' not found or does not belong to the current user.")
+
+    # Include the clicks this worker has counted but not flushed yet
+    return { "short_url": short_url, "clicks": int(url_pair.clicks) + access_tracker.pending_hits(short_url) }
+
+
 # url parems for redirect to long URL
 @router.get("/redirect/{shorturl}")
-def getLongUrl(shorturl: str):
+async def getLongUrl(shorturl: str):
     """Using the shorturl parems, find short url in database then redirect to long url if found.
 
     Args:
@@ -135,33 +348,25 @@ def getLongUrl(shorturl: str):
     Returns:
         _type_: redirects to long url if url short is valid
     """
-    # Check if the short URL is cached in Redis
-    long_url = redis_client.get(shorturl)
-    
-    if long_url:
-        # If the short URL is cached, redirect to the corresponding long URL
-        return RedirectResponse(long_url.decode("utf-8"))
+    # Codes that can't exist never reach the caches or the database
+    if not schemas.is_short_url(shorturl):
+        raise HTTPException(status_code=404, detail=f"Short URL of {shorturl} doesn't exist.")
     
-    # If the short URL is not cached, retrieve it from the database
-    result = list(Urls.query(shorturl))
+    # Find the long URL in the cache, falling back to the database
+    long_url = await resolve_long_url(shorturl)
     
-    if not any(result):
+    if long_url is None:
         # If the short URL doesn't exist in the database, raise an HTTPException
         raise HTTPException(status_code=400, detail=f"Short URL of {shorturl} doesn't exist.")
     
-    # Extract the long URL from the database result
-    long_url = result[0].long_url
-    
-    # Cache the short URL to long URL mapping in Redis
-    redis_client.setex(shorturl, expiration_time, long_url)
-    
     # Redirect to the long URL
+    access_tracker.record_hit(shorturl)
     return RedirectResponse(long_url)
 
 
 
 @router.get("/lookupURL")
-def lookupLongUrl(shorturl: str):
+async def lookupLongUrl(shorturl: str):
     """Find short url in database then return long url if found.
 
     Args:
@@ -174,24 +379,104 @@ def lookupLongUrl(shorturl: str):
         _type_: long url
     """
     
-    # Check if the short URL exists in the Redis cache
-    cached_long_url = redis_client.get(shorturl)
-    if cached_long_url:
-        # If the long URL is cached, return it
-        return {"long_url": cached_long_url.decode('utf-8')}
+    # Codes that can't exist never reach the caches or the database
+    if not schemas.is_short_url(shorturl):
+        raise HTTPException(status_code=404, detail=f"Short URL '{shorturl}' doesn't exist.")
     
-    # Retrieve short URL pair from the database
-    result = list(Urls.query(shorturl))
+    # Find the long URL in the cache, falling back to the database
+    long_url = await resolve_long_url(shorturl)
     
     # Check if the short URL exists in the database
-    if not any(result):
+    if long_url is None:
         raise HTTPException(status_code=400, detail=f"Short URL '{shorturl}' doesn't exist.")
     
-    # Get the long URL from the database result
-    long_url = result[0].long_url
+    # Return the long URL, only redirects count as clicks
+    return {"long_url": long_url}
+
+
+@router.post("/lookup_urls")
+async def lookup_long_urls(short_urls: List[str]) -> dict:
+    """Bulk version of /lookupURL. Find the long URLs of many short URLs with a fixed number of round trips.
+
+    Like single lookups, bulk lookups serve backfills and integrations, so only redirects count as clicks.
+
+    Args:
+        short_urls (List[str]): short urls to look up
+
+    Raises:
+        HTTPException: too many short urls in one request
+
+    Returns:
+        dict: every short url mapped to its long url, or to None if it doesn't exist
+    """
+    if len(short_urls) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_ITEMS} URLs can be looked up per request.")
+    short_urls = list(dict.fromkeys(short_urls))
+    
+    # Codes that can't exist map to None without a read, one oversized key would fail the whole BatchGetItem
+    valid = [short_url for short_url in short_urls if schemas.is_short_url(short_url)]
     
-    # Cache the long URL in Redis
-    redis_client.setex(shorturl, expiration_time, long_url)
+    # One MGET for everything not cached in process
+    long_urls = await url_cache.aget_long_urls(valid) if valid else {}
     
-    # Return the long URL
-    return {"long_url": long_url}
+    # Batch reads for the rest, skipping short URLs the database recently reported as missing
+    misses = [short_url for short_url in valid if short_url not in long_urls and not url_cache.is_known_missing(short_url)]
+    if misses:
+        loaded = await run_in_threadpool(query_long_urls, misses)
+        for short_url in misses:
+            if short_url not in loaded:
+                url_cache.mark_missing(short_url)
+        if loaded:
+            await url_cache.acache_long_urls(loaded)
+        long_urls.update(loaded)
+    
+    return {"long_urls": {short_url: long_urls.get(short_url) for short_url in short_urls}}
+
+
+async def resolve_long_url(shorturl: str) -> Optional[str]:
+    """Find the long URL for a short URL in the process or Redis cache, then in the database.
+
+    Returns None if the short URL doesn't exist.
+    """
+    # Concurrent misses and refreshes for the same short URL share a single database read
+    def fetch():
+        return url_fetches.do(shorturl, lambda: load_long_url(shorturl), peek=lambda: url_cache.aget_long_url(shorturl))
+    
+    # Check if the short URL is cached in process or in Redis, reloading it early if it is about to expire
+    long_url = await url_cache.aget_long_url(shorturl, refresh=fetch)
+    if long_url:
+        return long_url
+    
+    # Reject short URLs the database recently reported as missing without another read
+    if url_cache.is_known_missing(shorturl):
+        return None
+    
+    return await fetch()
+
+
+async def load_long_url(shorturl: str) -> Optional[str]:
+    """Read a short URL from the database without blocking the event loop and cache the result."""
+    long_url = await run_in_threadpool(query_long_url, shorturl)
+    if long_url is None:
+        # remember the miss so repeated lookups skip the database
+        url_cache.mark_missing(shorturl)
+        return None
+    await url_cache.acache_long_url(shorturl, long_url)
+    return long_url
+
+
+def query_long_url(shorturl: str) -> Optional[str]:
+    """Blocking DynamoDB lookup of a short URL, returns None if it doesn't exist."""
+    result = list(Urls.query(shorturl))
+    if not any(result):
+        return None
+    return result[0].long_url
+
+
+def query_long_urls(short_urls: List[str]) -> dict:
+    """Blocking DynamoDB lookup of many short URLs in BatchGetItem requests, missing ones are left out."""
+    long_urls = {}
+    for start in range(0, len(short_urls), BATCH_GET_SIZE):
+        batch = short_urls[start:start + BATCH_GET_SIZE]
+        long_urls.update({url_pair.short_url: url_pair.long_url for url_pair in Urls.batch_get(batch, attributes_to_get=["short_url", "long_url"])})
+    return long_urls
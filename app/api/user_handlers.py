@@ -1,19 +1,23 @@
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import OAuth2PasswordRequestForm
+from starlette.concurrency import run_in_threadpool
 from pydantic import ValidationError
-import json
+from pynamodb.exceptions import QueryError
+from typing import Optional
 
 from app.models import schemas
-from app.service.pwhashing import hash_password
+from app.service.pwhashing import ahash_password
 from app.models.database import Users
-from app.auth.auth import authenticate_user, create_access_token, get_current_user
+from app.auth.auth import authenticate_user, create_user_access_token, create_refresh_token, rotate_refresh_token, revoke_refresh_tokens, set_token_version, get_current_user, get_current_claims
 from app.service.redis_client import redis_client
-from app.service.cache_population import expiration_time
+from app.service.url_cache import cache_ttl
+from app.service import user_cache, url_ownership, codec
+from app.service.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, decode_cursor
 
 router = APIRouter()
 
 @router.post('/create_user')
-def create_user(user_email: schemas.Email, user_password: schemas.Password) -> dict:
+async def create_user(user_email: schemas.Email, user_password: schemas.Password) -> dict:
     """New User enters email and password to create an account, sends post request to server to add user to database
 
     Args:
@@ -28,21 +32,21 @@ def create_user(user_email: schemas.Email, user_password: schemas.Password) -> d
     """
 
     # check to see email already exists
-    if any(Users.query(user_email.email)):
+    if await run_in_threadpool(lambda: any(Users.query(user_email.email))):
         raise HTTPException(status_code=400, detail=f"Email of {user_email.email} already exist, try another one.")
     
-    # hash pass with bcrypt
-    hashedPW = hash_password(password=user_password.password)
+    # hash pass with bcrypt on the hashing pool
+    hashedPW = await ahash_password(password=user_password.password)
     
     # create new account and save to database
     new_user = Users(email=user_email.email, password_hash=hashedPW)
-    new_user.save()
+    await run_in_threadpool(new_user.save)
     
     return {"message": f"Account of {user_email.email} created successfully."}
 
 
 @router.post("/login")
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     """
     Authenticate a user with provided credentials and generate an access token.
 
@@ -53,50 +57,102 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
         HTTPException: If the provided credentials are incorrect.
 
     Returns:
-        dict: A dictionary containing the access token and its type.
+        dict: A dictionary containing the access token, a refresh token and the token type.
     """
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=401,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = create_access_token(data={"sub": user.email})
-    return {"access_token": access_token, "token_type": "bearer"}
+    access_token = create_user_access_token(user)
+    refresh_token = await run_in_threadpool(create_refresh_token, user.email)
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+
+@router.post("/token/refresh")
+def refresh_access_token(token: schemas.refreshToken):
+    """
+    Trade a refresh token for a new access token without logging in again.
+
+    Args:
+        token (schemas.refreshToken): The refresh token from /login or the previous refresh.
+
+    Raises:
+        HTTPException: If the refresh token is invalid, expired, revoked or already used.
+
+    Returns:
+        dict: A dictionary containing the new access token, the new refresh token and the token type.
+    """
+    tokens = rotate_refresh_token(token.refresh_token)
+    if not tokens:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return tokens
 
 
 @router.get("/list_my_urls")
-def list_my_urls(current_user: Users = Depends(get_current_user)):
+def list_my_urls(
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    current_user: schemas.Claims = Depends(get_current_claims)
+):
     """
-    Endpoint to list URLs associated with the current authenticated user.
+    Endpoint to list URLs associated with the current authenticated user, one page at a time.
 
     Args:
-        current_user (Users, optional): The current authenticated user. Defaults to Depends(get_current_user).
+        limit (int, optional): Maximum number of URLs to return. Defaults to DEFAULT_PAGE_SIZE.
+        cursor (str, optional): next_cursor of the previous page. Defaults to None for the first page.
+        current_user (schemas.Claims, optional): Claims of the current authenticated user. Defaults to Depends(get_current_claims).
+
+    Raises:
+        HTTPException: The limit is out of range or the cursor is invalid.
 
     Returns:
-        List[dict]: A list of dictionaries containing the short URL and original URL for each URL associated with the user.
+        dict: The page of URLs, each with its short URL and original URL, and the cursor of the next page, None on the last page.
     """
     # Check if the user is authenticated
     if current_user is None:
         raise HTTPException(status_code=401, detail="Authentication required to access this endpoint.")
     
-    # Check if the user's URLs are cached in Redis
-    cached_urls = redis_client.get(current_user.email)
-    if cached_urls:
-        # If cached data exists, return it
-        return json.loads(cached_urls)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {MAX_PAGE_SIZE}.")
+    try:
+        # a creator index cursor, and only one of this user's pages
+        last_evaluated_key = decode_cursor(cursor, ["creator_email", "short_url"])
+        if last_evaluated_key and last_evaluated_key["creator_email"]["S"] != current_user.email:
+            raise ValueError("Invalid cursor")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    
+    # Only the default first page is cached, that's what most requests ask for
+    first_page = cursor is None and limit == DEFAULT_PAGE_SIZE
+    if first_page:
+        cached_urls = redis_client.get(url_ownership.list_cache_key(current_user.email))
+        if cached_urls:
+            return codec.decode_object(cached_urls)
     
-    # If not cached, fetch the URLs from the database
-    user_urls = [{ "short_url": shortUrl, "long_url": longUrl } for shortUrl, longUrl in current_user.urls]
+    # Query the page from the creator index
+    try:
+        user_urls, last_evaluated_key = url_ownership.list_user_urls(current_user.email, limit, last_evaluated_key)
+    except QueryError as e:
+        # DynamoDB rejected the start key after all
+        if e.cause_response_code != "ValidationException":
+            raise
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    page = {"urls": user_urls, "next_cursor": encode_cursor(last_evaluated_key)}
     
-    # Cache the user's URLs in Redis
-    redis_client.setex(current_user.email, expiration_time, json.dumps(user_urls))
+    if first_page:
+        redis_client.setex(url_ownership.list_cache_key(current_user.email), cache_ttl(), codec.encode_object(page))
     
-    return user_urls
+    return page
 
 @router.patch("/change_password")
-def change_password(password: schemas.Password, current_user: Users = Depends(get_current_user)):
+async def change_password(password: schemas.Password, current_user: Users = Depends(get_current_user)):
     """
     Change the password for the current user.
 
@@ -113,7 +169,16 @@ def change_password(password: schemas.Password, current_user: Users = Depends(ge
     
     
     # Update the user's password in the database
-    hashed_password = hash_password(password.password)
-    current_user.password_hash = hashed_password
-    current_user.save()
+    hashed_password = await ahash_password(password.password)
+    # access tokens issued before the change stop working too. Only the changed attributes are written,
+    # current_user may be a cached copy and saving it whole could undo a concurrent change
+    await run_in_threadpool(
+        current_user.update,
+        actions=[Users.password_hash.set(hashed_password), Users.token_version.add(1)],
+        condition=Users.email.exists(),
+    )
+    await run_in_threadpool(user_cache.invalidate_user, current_user.email)
+    await run_in_threadpool(set_token_version, current_user.email, current_user.token_version)
+    # sessions started with the old password have to log in again
+    await run_in_threadpool(revoke_refresh_tokens, current_user.email)
     return {"message": "Password changed successfully"}
\ No newline at end of file
@@ -1,4 +1,5 @@
 import os
+import uuid
 from dotenv import load_dotenv
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
@@ -7,9 +8,14 @@ from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from typing import Optional
 from pynamodb.exceptions import DoesNotExist
+from redis.exceptions import WatchError
+from starlette.concurrency import run_in_threadpool
 
 from app.models.database import Users
 from app.service import pwhashing
+from app.service import user_cache, cache_keys
+from app.service.redis_client import redis_client, async_redis_client
+from app.models import schemas
 
 load_dotenv()
 
@@ -17,6 +23,12 @@ load_dotenv()
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 HASH_ALGORITHM = os.getenv("HASH_ALGORITHM")
+# refresh tokens outlive access tokens, and every one of them can be used exactly once
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 30))
+# put is_admin, url_limit and the user's token version into access tokens,
+# so endpoints that only authorize a request don't need to read the user
+TOKEN_CLAIMS = os.getenv("TOKEN_CLAIMS", "false").lower() == "true"
+TOKEN_VERSION_CACHE_TTL = int(os.getenv("TOKEN_VERSION_CACHE_TTL", 3600))
 
 # Initialize password context for password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -33,14 +45,130 @@ def create_access_token(data: dict) -> str:
     return encoded_jwt
 
 
-# User authentication function
-def authenticate_user(email: str, password: str) -> Optional[Users]:
-    """Authenticate user by email and password."""
+def create_user_access_token(user: Users) -> str:
+    """Generate an access token for a user, carrying their authorization claims in claims mode."""
+    if not TOKEN_CLAIMS:
+        return create_access_token(data={"sub": user.email})
+    return create_access_token(data={
+        "sub": user.email,
+        "is_admin": bool(user.is_admin),
+        "url_limit": int(user.url_limit),
+        "ver": int(user.token_version),
+    })
+
+
+def set_token_version(email: str, version: int) -> None:
+    """Publish a user's new token version after it was saved, outdating every access token with an older one.
+
+    The published version only ever goes up, so concurrent changes can publish theirs in any order.
+    """
+    key = cache_keys.token_version_key(email)
+    with redis_client.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(key)
+                current = pipe.get(key)
+                if current is not None and int(current) >= version:
+                    pipe.unwatch()
+                    return
+                pipe.multi()
+                pipe.setex(key, TOKEN_VERSION_CACHE_TTL, version)
+                pipe.execute()
+                return
+            except WatchError:
+                # another version was published meanwhile, compare against that one
+                continue
+
+
+async def get_token_version(email: str) -> Optional[int]:
+    """A user's current token version from Redis or the database, None if there is no such user."""
+    key = cache_keys.token_version_key(email)
+    cached = await async_redis_client.get(key)
+    if cached is not None:
+        return int(cached)
+    # a consistent read, the user cache may still hold the record from before a change
+    user = await run_in_threadpool(get_user_record, email)
+    if not user:
+        return None
+    # NX: a version published since the read is newer than ours and must not be overwritten
+    if not await async_redis_client.set(key, int(user.token_version), ex=TOKEN_VERSION_CACHE_TTL, nx=True):
+        cached = await async_redis_client.get(key)
+        if cached is not None:
+            return int(cached)
+    return int(user.token_version)
+
+
+def create_refresh_token(email: str) -> str:
+    """Generate a JWT refresh token and record its ID in Redis, where it can be revoked."""
+    jti = uuid.uuid4().hex
+    lifetime = timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    to_encode = {"sub": email, "type": "refresh", "jti": jti, "exp": datetime.utcnow() + lifetime}
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.setex(cache_keys.refresh_token_key(email, jti), lifetime, email)
+    # the user's token IDs, so all of them can be revoked at once
+    pipe.sadd(cache_keys.refresh_tokens_key(email), jti)
+    pipe.expire(cache_keys.refresh_tokens_key(email), lifetime)
+    pipe.execute()
+    return jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=HASH_ALGORITHM)
+
+
+def rotate_refresh_token(token: str) -> Optional[dict]:
+    """Trade a refresh token for a new access token and refresh token, None if it is invalid.
+
+    Only the signature and one Redis delete are checked, no password hash. The old
+    token is consumed, so a stolen token stops working as soon as either side uses it.
+    """
     try:
-        user = Users.get(email)
+        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[HASH_ALGORITHM])
+    except JWTError:
+        return None
+    email, jti = payload.get("sub"), payload.get("jti")
+    if payload.get("type") != "refresh" or email is None or jti is None:
+        return None
+    if not redis_client.delete(cache_keys.refresh_token_key(email, jti)):
+        # expired, revoked or already used
+        return None
+    redis_client.srem(cache_keys.refresh_tokens_key(email), jti)
+    if TOKEN_CLAIMS:
+        # claims are read fresh on every refresh, that's how updated limits reach the token
+        user = user_cache.get_user(email)
+        if not user:
+            return None
+        access_token = create_user_access_token(user)
+    else:
+        access_token = create_access_token(data={"sub": email})
+    return {
+        "access_token": access_token,
+        "refresh_token": create_refresh_token(email),
+        "token_type": "bearer",
+    }
+
+
+def revoke_refresh_tokens(email: str) -> None:
+    """Revoke every refresh token of a user, e.g. after a password change."""
+    jtis = redis_client.smembers(cache_keys.refresh_tokens_key(email))
+    # the set and the tokens share the user's hash tag, so this is one DEL even in a cluster
+    keys = [cache_keys.refresh_token_key(email, jti.decode("utf-8")) for jti in jtis]
+    redis_client.delete(cache_keys.refresh_tokens_key(email), *keys)
+
+
+def get_user_record(email: str) -> Optional[Users]:
+    """Read a user straight from the database, None if there is no such user."""
+    try:
+        return Users.get(email, consistent_read=True)
     except DoesNotExist:
-        user = None
-    if not user or not pwhashing.verify_password(password, user.password_hash):
+        return None
+
+
+# User authentication function
+async def authenticate_user(email: str, password: str) -> Optional[Users]:
+    """Authenticate user by email and password.
+
+    The database read runs in the threadpool and bcrypt on the hashing pool, so
+    a burst of logins never blocks the event loop or the other handlers.
+    """
+    user = await run_in_threadpool(get_user_record, email)
+    if not user or not await pwhashing.averify_password(password, user.password_hash):
         return None
     return user
 
@@ -54,16 +182,42 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> Users:
     try:
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[HASH_ALGORITHM])
         email: str = payload.get("sub")
-        if email is None:
+        # refresh tokens only work at /token/refresh
+        if email is None or payload.get("type") == "refresh":
             raise credentials_exception
         
-        # Query the user directly by email
-        try:
-            user = Users.get(email)
-        except DoesNotExist:
-            user = None
-        if not user:
+        # Look the user up through the user cache, off the event loop
+        user = await run_in_threadpool(user_cache.get_user, email)
+        if not user or payload.get("ver", user.token_version) != user.token_version:
             raise credentials_exception
         return user
     except (JWTError, IndexError):
-        raise credentials_exception
\ No newline at end of file
+        raise credentials_exception
+
+
+async def get_current_claims(token: str = Depends(oauth2_scheme)) -> schemas.Claims:
+    """Get the authorization claims of the current user from the JWT token.
+
+    Tokens with claims are checked against the user's token version in Redis and
+    never read the user. Tokens without claims fall back to get_current_user.
+    """
+    credentials_exception = HTTPException(
+        status_code=401,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[HASH_ALGORITHM])
+    except JWTError:
+        raise credentials_exception
+    if "ver" not in payload:
+        user = await get_current_user(token)
+        return schemas.Claims(email=user.email, is_admin=user.is_admin, url_limit=user.url_limit)
+
+    email = payload.get("sub")
+    if email is None or payload.get("type") == "refresh":
+        raise credentials_exception
+    # an older version means the limit, admin flag or password changed since the token was issued
+    if payload["ver"] != await get_token_version(email):
+        raise credentials_exception
+    return schemas.Claims(email=email, is_admin=payload["is_admin"], url_limit=payload["url_limit"])
\ No newline at end of file
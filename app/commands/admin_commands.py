@@ -1,4 +1,5 @@
 import os
+import json
 import typer
 import requests
 from pydantic import ValidationError
@@ -23,13 +24,15 @@ def list_all_urls(token: str):
     """
     url = f"{SERVER_URL}/list_urls"
     headers = {"Authorization": f"Bearer {token}"}
-    response = requests.get(url, headers=headers)
+    # Stream the pairs so neither side holds the whole table in memory
+    response = requests.get(url, headers=headers, params={"stream": "true"}, stream=True)
     
     if response.status_code == 200:
         typer.echo("Here are all the URLs:")
-        url_pairs = response.json()
-        for pair in url_pairs:
-            typer.echo(pair)
+        for line in response.iter_lines():
+            if line:
+                pair = json.loads(line)
+                typer.echo((pair["short_url"], pair["long_url"], pair["creator_email"]))
     else:
         typer.echo(f"Error: {response.text}")
         
@@ -61,7 +64,82 @@ def update_url_limit(user_email: str, new_limit: int, token: str):
         typer.echo("URL limit updated successfully.")
     else:
         typer.echo(f"Error: {response.text}")
+
+
+@admin_app.command()
+def rebuild_shortcode_filter(token: str):
+    """
+    Rebuild the filter of allocated short codes from the URL table.
+
+    Args:
+        token (str): Access token for authentication.
+    """
+    url = f"{SERVER_URL}/rebuild_shortcode_filter"
+    headers = {"Authorization": f"Bearer {token}"}
+    response = requests.post(url, headers=headers)
+
+    if response.status_code == 200:
+        typer.echo("Short code filter rebuild started.")
+    else:
+        typer.echo(f"Error: {response.text}")
+
+
+@admin_app.command()
+def migrate_url_ownership(token: str):
+    """
+    Move URL ownership from the legacy URL lists on user records to the creator index.
+
+    Args:
+        token (str): Access token for authentication.
+    """
+    url = f"{SERVER_URL}/migrate_url_ownership"
+    headers = {"Authorization": f"Bearer {token}"}
+    response = requests.post(url, headers=headers)
+
+    if response.status_code == 200:
+        typer.echo("URL ownership migration started.")
+    else:
+        typer.echo(f"Error: {response.text}")
         
 
+@admin_app.command()
+def migrate_cache_keys(token: str):
+    """
+    Move Redis keys written before the typed key schema to their new names.
+
+    Args:
+        token (str): Access token for authentication.
+    """
+    url = f"{SERVER_URL}/migrate_cache_keys"
+    headers = {"Authorization": f"Bearer {token}"}
+    response = requests.post(url, headers=headers)
+
+    if response.status_code == 200:
+        typer.echo("Cache key migration started.")
+    else:
+        typer.echo(f"Error: {response.text}")
+        
+
+@admin_app.command()
+def export_urls(output_dir: str, segments: int = 8):
+    """
+    Export the URL table to compressed JSONL shards. Runs locally against DynamoDB.
+
+    Args:
+        output_dir (str): Directory for the shards and the manifest. Rerun with the same directory to resume.
+        segments (int): Number of parallel scan segments and shards.
+    """
+    # imported here so the other commands don't need database credentials
+    from app.models.database import Urls
+    from app.service.export import export_urls as run_export
+
+    try:
+        manifest = run_export(Urls, output_dir, segments=segments)
+    except ValueError as e:
+        typer.echo(f"Error: {str(e)}")
+        return
+    typer.echo(f"Exported {manifest['rows']} URLs to {len(manifest['shards'])} shards in {output_dir}.")
+
+
 if __name__ == "__main__":
     admin_app()
\ No newline at end of file
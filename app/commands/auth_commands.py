@@ -36,6 +36,27 @@ def login(username: str, password: str):
     if response.status_code == 200:
         token = response.json()["access_token"]
         typer.echo(f"Access token: {token}")
+        refresh_token = response.json().get("refresh_token")
+        if refresh_token:
+            typer.echo(f"Refresh token: {refresh_token}")
+    else:
+        typer.echo(f"Error: {response.text}")
+
+
+@auth_app.command()
+def refresh(refresh_token: str):
+    """
+    Trade a refresh token for a new access token and refresh token, without logging in again.
+
+    Args:
+        refresh_token (str): Refresh token from login or the previous refresh.
+    """
+    url = f"{SERVER_URL}/token/refresh"
+    response = requests.post(url, json={"refresh_token": refresh_token})
+    if response.status_code == 200:
+        tokens = response.json()
+        typer.echo(f"Access token: {tokens['access_token']}")
+        typer.echo(f"Refresh token: {tokens['refresh_token']}")
     else:
         typer.echo(f"Error: {response.text}")
     
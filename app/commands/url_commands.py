@@ -1,6 +1,7 @@
 import os
 import typer
 import requests
+from typing import List
 from pydantic import ValidationError
 from app.models import schemas
 from dotenv import load_dotenv
@@ -34,5 +35,23 @@ def lookup_url(short_url: str):
         # Print error message if request failed
         typer.echo(f"Error: {response.text}")
 
+
+@url_app.command()
+def lookup_urls(short_urls: List[str]):
+    """Lookup the long URLs associated with many short URLs in one request."""
+    
+    url = f"{SERVER_URL}/lookup_urls"
+    response = requests.post(url, json=short_urls)
+    
+    if response.status_code == 200:
+        for short_url, long_url in response.json()["long_urls"].items():
+            if long_url is None:
+                typer.echo(f"Short URL '{short_url}' doesn't exist.")
+            else:
+                typer.echo(f"Long URL for {short_url}: {long_url}")
+    else:
+        typer.echo(f"Error: {response.text}")
+
+
 if __name__ == "__main__":
     url_app()
\ No newline at end of file
@@ -9,6 +9,8 @@ load_dotenv()
 
 # Load environment variables
 SERVER_URL = os.getenv("SERVER_URL_PROD") if os.getenv("PRODUCTION") else os.getenv("SERVER_URL_DEV", "localhost")
+# URLs per request of the bulk commands, at most the server's BULK_MAX_ITEMS
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", 1000))
 
 # Create a Typer instance for user-related commands
 user_app = typer.Typer()
@@ -57,17 +59,25 @@ def list_my_urls(token: str):
     """
     url = f"{SERVER_URL}/list_my_urls"
     headers = {"Authorization": f"Bearer {token}"}
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        urls = response.json()
-        if not urls:
-            typer.echo("Currently you have no URLs.")
-        else:
+    params = {}
+    shown = 0
+    # Follow the cursor until the last page
+    while True:
+        response = requests.get(url, headers=headers, params=params)
+        if response.status_code != 200:
+            typer.echo(f"Error: {response.text}")
+            return
+        page = response.json()
+        if page["urls"] and not shown:
             typer.echo("Here is your URL list:")
-            for each_url in urls:
-                typer.echo(each_url)
-    else:
-        typer.echo(f"Error: {response.text}")
+        for each_url in page["urls"]:
+            typer.echo(each_url)
+        shown += len(page["urls"])
+        if not page["next_cursor"]:
+            break
+        params = {"cursor": page["next_cursor"]}
+    if not shown:
+        typer.echo("Currently you have no URLs.")
         
 
 @user_app.command()
@@ -175,5 +185,112 @@ def delete_url(short_url: str, token: str):
 
 
 
+@user_app.command()
+def url_clicks(short_url: str, token: str):
+    """
+    Show how many times a short URL has been used.
+
+    Args:
+        short_url (str): Short URL to get the click count for.
+        token (str): Access token for authentication.
+    """
+    # Validate short URL
+    try:
+        schemas.shortURL(short_Url=short_url)
+    except ValidationError as e:
+        typer.echo(f"Error: {str(e)}")
+        return
+
+    url = f"{SERVER_URL}/url_clicks"
+    headers = {"Authorization": f"Bearer {token}"}
+    response = requests.get(url, headers=headers, params={"short_url": short_url})
+
+    if response.status_code == 200:
+        typer.echo(f"Clicks for {short_url}: {response.json()['clicks']}")
+    else:
+        typer.echo(f"Error: {response.text}")
+
+
+@user_app.command()
+def shorten_urls(file: str, token: str):
+    """
+    Shorten every long URL listed in a file.
+
+    Args:
+        file (str): File with one long URL per line, optionally followed by a custom short URL.
+        token (str): Access token for authentication.
+    """
+    # Validate every line before sending anything
+    items = []
+    with open(file) as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            try:
+                schemas.longURL(url=fields[0])
+                item = {"long_url": {"url": fields[0]}}
+                if len(fields) > 1:
+                    schemas.shortURL(short_Url=fields[1])
+                    item["short_url"] = {"short_Url": fields[1]}
+            except ValidationError as e:
+                typer.echo(f"Error: {str(e)}")
+                return
+            items.append(item)
+    
+    url = f"{SERVER_URL}/shorten_urls"
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    # Send the URLs in batches the server accepts
+    for start in range(0, len(items), BULK_BATCH_SIZE):
+        response = requests.post(url, headers=headers, json=items[start:start + BULK_BATCH_SIZE])
+        if response.status_code != 200:
+            typer.echo(f"Error: {response.text}")
+            return
+        for result in response.json()["results"]:
+            if result["error"]:
+                typer.echo(f"Error for {result['long_url']}: {result['error']}")
+            else:
+                typer.echo(f"{result['long_url']} -> {result['short_url']}")
+
+
+@user_app.command()
+def delete_urls(file: str, token: str):
+    """
+    Delete every short URL listed in a file.
+
+    Args:
+        file (str): File with one short URL per line.
+        token (str): Access token for authentication.
+    """
+    # Validate every short URL before sending anything
+    short_urls = []
+    with open(file) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                schemas.shortURL(short_Url=line.strip())
+            except ValidationError as e:
+                typer.echo(f"Error: {str(e)}")
+                return
+            short_urls.append({"short_Url": line.strip()})
+    
+    url = f"{SERVER_URL}/delete_urls"
+    headers = {"Authorization": f"Bearer {token}"}
+    
+    # Send the short URLs in batches the server accepts
+    for start in range(0, len(short_urls), BULK_BATCH_SIZE):
+        response = requests.delete(url, headers=headers, json=short_urls[start:start + BULK_BATCH_SIZE])
+        if response.status_code != 200:
+            typer.echo(f"Error: {response.text}")
+            return
+        for result in response.json()["results"]:
+            if result["error"]:
+                typer.echo(f"Error: {result['error']}")
+            else:
+                typer.echo(f"Short URL '{result['short_url']}' deleted successfully.")
+
+
 if __name__ == "__main__":
     user_app()
\ No newline at end of file
@@ -2,6 +2,7 @@ import os
 from dotenv import load_dotenv
 from pynamodb.models import Model
 from pynamodb.attributes import UnicodeAttribute, BooleanAttribute, ListAttribute, NumberAttribute
+from pynamodb.indexes import GlobalSecondaryIndex, AllProjection
 
 # load environment variables from .env
 load_dotenv()
@@ -15,6 +16,18 @@ aws_region = os.getenv("AWS_REGION", "us-east-1")
 os.environ["AWS_ACCESS_KEY_ID"] = aws_access_key_id
 os.environ["AWS_SECRET_ACCESS_KEY"] = aws_secret_access_key
 
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_SIZE = 100
+
+
+class CreatorEmailIndex(GlobalSecondaryIndex):
+    """Look up the URL pairs created by a user."""
+    class Meta:
+        index_name = "creator_email-index"
+        projection = AllProjection()
+
+    creator_email = UnicodeAttribute(hash_key=True)
+
 
 class Urls(Model):
     class Meta:
@@ -23,7 +36,10 @@ class Urls(Model):
         
     short_url = UnicodeAttribute(hash_key=True)
     long_url = UnicodeAttribute()
-    creator_email = UnicodeAttribute(default='')
+    # index keys can't be empty strings, pairs without a creator are simply left out of the index
+    creator_email = UnicodeAttribute(null=True)
+    clicks = NumberAttribute(default=0)  # redirects, flushed in batches by the access tracker
+    creator_index = CreatorEmailIndex()
 
 
 class Users(Model):
@@ -35,4 +51,5 @@ class Users(Model):
     password_hash = UnicodeAttribute()
     is_admin = BooleanAttribute(default=False)
     url_limit = NumberAttribute(default=20)
-    urls = ListAttribute(default=list)  # Store the short urls created by user
\ No newline at end of file
+    token_version = NumberAttribute(default=0)  # bumped to outdate access tokens carrying claims
+    urls = ListAttribute(null=True)  # Legacy list of created short urls, moved to Urls.creator_index by the ownership migration
\ No newline at end of file
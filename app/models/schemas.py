@@ -1,4 +1,5 @@
 from pydantic import BaseModel, HttpUrl, EmailStr, field_validator, ValidationError, Field
+from typing import Optional
 import re
 
 class longURL(BaseModel):
@@ -18,7 +19,30 @@ class shortURL(BaseModel):
             # only A-Z or a-z or 0-9 or - or _
             raise ValueError(f"shortUrl must only contains letters, nummbers, underscores and dashes.")
         return s
+
+
+def is_short_url(s: str) -> bool:
+    """True if s follows the shortURL rules, for checking path and query parameters without raising."""
+    return re.fullmatch("[A-Za-z0-9_-]{10,15}", s) is not None
+
+
+class shortenItem(BaseModel):
+    # one entry of a bulk shorten request, the short url is generated when missing
+    long_url: longURL
+    short_url: Optional[shortURL] = None
+
     
+class refreshToken(BaseModel):
+    refresh_token: str
+
+
+class Claims(BaseModel):
+    # the authorization facts most endpoints need, read from the access token
+    email: str
+    is_admin: bool = False
+    url_limit: int = 20
+
+
 class Email(BaseModel):
     # email must be a valid email
     email: EmailStr
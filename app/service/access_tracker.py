@@ -0,0 +1,149 @@
+import os
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+from dotenv import load_dotenv
+from pynamodb.exceptions import UpdateError
+
+from app.service.redis_client import redis_client
+from app.service.cache_keys import POPULARITY_KEY_PREFIX
+from app.models.database import Urls
+load_dotenv()
+
+# hits are buffered in process and written out every interval or once this many codes are pending
+ACCESS_FLUSH_INTERVAL = float(os.getenv("ACCESS_FLUSH_INTERVAL", 10))
+ACCESS_FLUSH_THRESHOLD = int(os.getenv("ACCESS_FLUSH_THRESHOLD", 5000))
+# concurrent DynamoDB updates per flush
+CLICK_FLUSH_CONCURRENCY = int(os.getenv("CLICK_FLUSH_CONCURRENCY", 8))
+# number of daily counters that make up "recent" popularity
+POPULARITY_WINDOW_DAYS = int(os.getenv("POPULARITY_WINDOW_DAYS", 7))
+
+_pending: Dict[str, int] = {}
+_lock = threading.Lock()
+_flush_requested = threading.Event()
+_stopped = threading.Event()
+_flusher = None
+
+
+def record_hit(short_url: str) -> None:
+    """Count one access to short_url. Only touches an in-process dict."""
+    with _lock:
+        _pending[short_url] = _pending.get(short_url, 0) + 1
+        if len(_pending) >= ACCESS_FLUSH_THRESHOLD:
+            _flush_requested.set()
+
+
+def _popularity_key(day: datetime) -> str:
+    return f"{POPULARITY_KEY_PREFIX}:{day.strftime('%Y%m%d')}"
+
+
+def flush() -> int:
+    """Write the buffered hit counts out. Returns the number of codes written.
+
+    Click counts are added to the durable `clicks` attribute of each URL pair, and
+    codes whose update failed stay buffered for the next flush. Popularity counts
+    feed the cache warm-up only, so they are written to Redis on a best-effort basis.
+    """
+    global _pending
+    with _lock:
+        counts, _pending = _pending, {}
+    if not counts:
+        return 0
+
+    try:
+        _write_popularity(counts)
+    except Exception as e:
+        print(f"Popularity flush failed: {e}")
+
+    with ThreadPoolExecutor(max_workers=CLICK_FLUSH_CONCURRENCY) as pool:
+        written = list(pool.map(_write_clicks, counts.items()))
+    failed = {short_url: hits for (short_url, hits), ok in zip(counts.items(), written) if not ok}
+    # keep failed counts buffered so the next flush retries them
+    _merge(failed)
+    return len(counts) - len(failed)
+
+
+def _write_popularity(counts: Dict[str, int]) -> None:
+    key = _popularity_key(datetime.utcnow())
+    pipe = redis_client.pipeline(transaction=False)
+    for short_url, hits in counts.items():
+        pipe.zincrby(key, hits, short_url)
+    pipe.expire(key, timedelta(days=POPULARITY_WINDOW_DAYS + 1))
+    pipe.execute()
+
+
+def _write_clicks(item: Tuple[str, int]) -> bool:
+    """Atomically add hits to a URL pair's click count, False if it should be retried."""
+    short_url, hits = item
+    try:
+        # the condition keeps a click on a just-deleted short URL from recreating it
+        Urls(short_url=short_url).update(actions=[Urls.clicks.add(hits)], condition=Urls.short_url.exists())
+    except UpdateError as e:
+        return e.cause_response_code == "ConditionalCheckFailedException"
+    return True
+
+
+def _merge(counts: Dict[str, int]) -> None:
+    with _lock:
+        for short_url, hits in counts.items():
+            _pending[short_url] = _pending.get(short_url, 0) + hits
+
+
+def top_short_urls(limit: int) -> List[Tuple[str, float]]:
+    """Most accessed short URLs over the popularity window, most popular first."""
+    today = datetime.utcnow()
+    keys = [_popularity_key(today - timedelta(days=day)) for day in range(POPULARITY_WINDOW_DAYS)]
+    # every caller unions into its own scratch key, so concurrent callers need no transaction,
+    # which Redis Cluster clients don't support
+    union_key = f"{POPULARITY_KEY_PREFIX}:window:{uuid.uuid4().hex}"
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zunionstore(union_key, keys)
+    pipe.zrevrange(union_key, 0, limit - 1, withscores=True)
+    pipe.delete(union_key)
+    ranked = pipe.execute()[1]
+    return [(short_url.decode("utf-8"), score) for short_url, score in ranked]
+
+
+def _run_flusher() -> None:
+    while not _stopped.is_set():
+        _flush_requested.wait(ACCESS_FLUSH_INTERVAL)
+        _flush_requested.clear()
+        try:
+            flush()
+        except Exception as e:
+            # counts are best effort, never let a Redis hiccup kill the flusher
+            print(f"Access count flush failed: {e}")
+
+
+def start_flusher() -> None:
+    """Flush buffered hits from a background thread."""
+    global _flusher
+    if _flusher is not None:
+        return
+    _stopped.clear()
+    _flusher = threading.Thread(target=_run_flusher, name="access-flusher", daemon=True)
+    _flusher.start()
+
+
+def stop_flusher() -> None:
+    """Stop the background thread and write whatever is still buffered."""
+    global _flusher
+    if _flusher is not None:
+        _stopped.set()
+        _flush_requested.set()
+        _flusher.join()
+        _flusher = None
+    flush()
+
+
+def pending_hits(short_url: str) -> int:
+    """Hits on short_url recorded by this worker that are not flushed yet."""
+    with _lock:
+        return _pending.get(short_url, 0)
+
+
+def stats() -> dict:
+    with _lock:
+        return {"pending_codes": len(_pending), "pending_hits": sum(_pending.values())}
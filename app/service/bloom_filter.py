@@ -0,0 +1,247 @@
+import os
+import math
+import hashlib
+from itertools import islice
+from typing import Iterable, List
+from dotenv import load_dotenv
+
+from app.service.redis_client import redis_client, REDIS_CLUSTER
+from app.service.cache_keys import SHORTCODE_FILTER_NAME
+load_dotenv()
+
+# expected number of short codes and the overall false-positive rate of the filter
+SHORTCODE_FILTER_CAPACITY = int(os.getenv("SHORTCODE_FILTER_CAPACITY", 1000000))
+SHORTCODE_FILTER_ERROR_RATE = float(os.getenv("SHORTCODE_FILTER_ERROR_RATE", 0.001))
+
+
+class ScalableBloomFilter:
+    """Bloom filter stored in Redis bitmaps that grows by adding layers.
+
+    Layer i holds `capacity * growth**i` items at a false-positive rate of
+    `error_rate * (1 - ratio) * ratio**i`. The layer rates form a geometric series,
+    so the compound false-positive rate stays below `error_rate` no matter how many
+    layers get added. A membership check for any number of items is one pipelined
+    round trip. Its cost depends on the number of layers, not on the number of
+    items added.
+
+    The filter only answers "definitely absent" or "possibly present". Items
+    cannot be removed, so deleted short codes stay as false positives until the
+    next rebuild.
+
+    While a rebuild scans the table, adds also go to a log that is replayed into
+    the rebuilt filter, so items added during the scan survive the swap.
+    """
+
+    # seconds a rebuild may go without progress before adds stop logging for it
+    rebuild_timeout = 300
+
+    def __init__(self, client, name: str, capacity: int, error_rate: float, growth: int = 2, ratio: float = 0.5):
+        self.client = client
+        self.name = name
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.ratio = ratio
+        self.meta_key = f"{name}:meta"
+        self.rebuild_key = f"{name}:rebuild:active"
+        self.rebuild_log_key = f"{name}:rebuild:log"
+        # layer-0 capacity and item count last seen in Redis
+        self._capacity = capacity
+        self._count = 0
+
+    def _layer_key(self, layer: int) -> str:
+        return f"{self.name}:{layer}"
+
+    def _layer_size(self, capacity: int, layer: int):
+        """Number of bits and hash functions for a layer."""
+        items = capacity * self.growth ** layer
+        error_rate = self.error_rate * (1 - self.ratio) * self.ratio ** layer
+        bits = math.ceil(-items * math.log(error_rate) / math.log(2) ** 2)
+        hashes = max(1, round(bits / items * math.log(2)))
+        return bits, hashes
+
+    def _layer_of(self, capacity: int, position: int) -> int:
+        """Layer that holds the position-th item added (1-based)."""
+        layer, total = 0, capacity
+        while position > total:
+            layer += 1
+            total += capacity * self.growth ** layer
+        return layer
+
+    def _positions(self, item: str, bits: int, hashes: int) -> List[int]:
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % bits for i in range(hashes)]
+
+    def _bitfield(self, pipe, layer: int, capacity: int, item: str, op: str) -> None:
+        bits, hashes = self._layer_size(capacity, layer)
+        args = []
+        for position in self._positions(item, bits, hashes):
+            args += [op, "u1", position] + ([1] if op == "SET" else [])
+        pipe.execute_command("BITFIELD", self._layer_key(layer), *args)
+
+    def _read_meta(self, capacity, count) -> bool:
+        """Store the meta read from Redis, True if it matches what the caller assumed."""
+        capacity = int(capacity) if capacity is not None else self.capacity
+        count = int(count) if count is not None else 0
+        layers = self._layer_of(self._capacity, max(self._count, 1))
+        stale = capacity != self._capacity or self._layer_of(capacity, max(count, 1)) > layers
+        self._capacity, self._count = capacity, count
+        return not stale
+
+    def might_contain_many(self, items: List[str]) -> List[bool]:
+        """For each item, False if it was definitely never added."""
+        capacity = self._capacity
+        layers = self._layer_of(capacity, max(self._count, 1)) + 1
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hmget(self.meta_key, "capacity", "count")
+        for item in items:
+            for layer in range(layers):
+                self._bitfield(pipe, layer, capacity, item, "GET")
+        results = pipe.execute()
+
+        if not self._read_meta(*results[0]):
+            # the filter grew or was rebuilt since we last looked, check again with the new layout
+            return self.might_contain_many(items)
+
+        answers, replies = [], iter(results[1:])
+        for item in items:
+            layer_bits = [next(replies) for _ in range(layers)]
+            answers.append(any(all(bits) for bits in layer_bits))
+        return answers
+
+    def might_contain(self, item: str) -> bool:
+        return self.might_contain_many([item])[0]
+
+    def add_many(self, items: List[str]) -> None:
+        """Add items to the layer their position falls in, growing the filter if needed."""
+        if not items:
+            return
+        if not self._add_many(items, check_rebuild=True):
+            return
+        # a rebuild is scanning the table and may have missed these, log them for its swap
+        pipe = self.client.pipeline(transaction=False)
+        pipe.rpush(self.rebuild_log_key, *items)
+        pipe.expire(self.rebuild_log_key, self.rebuild_timeout)
+        pipe.exists(self.rebuild_key)
+        if not pipe.execute()[2]:
+            # the rebuild swapped and replayed its log in the meantime, add them to the new layers
+            self._add_many(items)
+
+    def _add_many(self, items: List[str], check_rebuild: bool = False) -> bool:
+        """Write items into the current layers. With check_rebuild, True if a rebuild was running
+        when the writes started: they may then land in layers the rebuild is about to replace."""
+        capacity, start = self._capacity, self._count
+        pipe = self.client.pipeline(transaction=False)
+        # read before the writes: a rebuild that starts later finds the items in its scan,
+        # and one that has just finished swapped before these writes
+        if check_rebuild:
+            pipe.exists(self.rebuild_key)
+        pipe.hsetnx(self.meta_key, "capacity", capacity)
+        pipe.hincrby(self.meta_key, "count", len(items))
+        pipe.hget(self.meta_key, "capacity")
+        for offset, item in enumerate(items):
+            self._bitfield(pipe, self._layer_of(capacity, start + offset + 1), capacity, item, "SET")
+        results = pipe.execute()
+        rebuilding = bool(results.pop(0)) if check_rebuild else False
+
+        count, real_capacity = int(results[1]), int(results[2])
+        real_start = count - len(items)
+        self._capacity, self._count = real_capacity, count
+        # other workers added items or the filter was rebuilt meanwhile, so write into the right layers too
+        misplaced = [
+            (real_start + offset + 1, item) for offset, item in enumerate(items)
+            if real_capacity != capacity
+            or self._layer_of(real_capacity, real_start + offset + 1) != self._layer_of(capacity, start + offset + 1)
+        ]
+        if misplaced:
+            pipe = self.client.pipeline(transaction=False)
+            for position, item in misplaced:
+                self._bitfield(pipe, self._layer_of(real_capacity, position), real_capacity, item, "SET")
+            pipe.execute()
+        return rebuilding
+
+    def add(self, item: str) -> None:
+        self.add_many([item])
+
+    def clear(self) -> None:
+        layers = self._layer_of(self._capacity, max(self._count, 1)) + 1
+        capacity, count = self.client.hmget(self.meta_key, "capacity", "count")
+        if capacity is not None:
+            layers = max(layers, self._layer_of(int(capacity), max(int(count or 0), 1)) + 1)
+        self.client.delete(self.meta_key, *[self._layer_key(layer) for layer in range(layers)])
+        self._capacity, self._count = self.capacity, 0
+
+    def _replay_log(self, target: "ScalableBloomFilter", batch_size: int) -> None:
+        """Move the items logged by adds during a rebuild into target."""
+        while True:
+            logged = self.client.lpop(self.rebuild_log_key, batch_size)
+            if not logged:
+                return
+            target._add_many([item.decode("utf-8") for item in logged])
+
+    def rebuild(self, items: Iterable[str], expected_items: int = 0, batch_size: int = 1000) -> int:
+        """Rebuild the filter from scratch off to the side, then swap it in. Returns the item count."""
+        # size the first layer for the whole table so a rebuilt filter has a single layer
+        capacity = max(self.capacity, int(expected_items * 1.25))
+        staging = ScalableBloomFilter(self.client, f"{self.name}:rebuild", capacity, self.error_rate, self.growth, self.ratio)
+        staging.clear()
+        self.client.delete(self.rebuild_log_key)
+        # from here on adds are logged, anything saved before this is in the scan
+        self.client.set(self.rebuild_key, 1, ex=self.rebuild_timeout)
+        try:
+            return self._rebuild(staging, capacity, iter(items), batch_size)
+        finally:
+            self.client.delete(self.rebuild_key, self.rebuild_log_key)
+
+    def _rebuild(self, staging: "ScalableBloomFilter", capacity: int, items, batch_size: int) -> int:
+        while True:
+            batch = list(islice(items, batch_size))
+            if not batch:
+                break
+            staging._add_many(batch)
+            self.client.expire(self.rebuild_key, self.rebuild_timeout)
+        self._replay_log(staging, batch_size)
+
+        old_capacity, old_count = self.client.hmget(self.meta_key, "capacity", "count")
+        old_layers = self._layer_of(int(old_capacity or self.capacity), max(int(old_count or 0), 1)) + 1
+        new_layers = self._layer_of(capacity, staging._count) + 1 if staging._count else 0
+
+        # cluster clients can't run transactions, there the swap is briefly visible half done,
+        # which only costs database checks the conditional writes make anyway
+        pipe = self.client.pipeline(transaction=not REDIS_CLUSTER)
+        for layer in range(new_layers):
+            pipe.rename(staging._layer_key(layer), self._layer_key(layer))
+        for layer in range(new_layers, old_layers):
+            pipe.delete(self._layer_key(layer))
+        pipe.delete(self.meta_key)
+        pipe.hset(self.meta_key, mapping={"capacity": capacity, "count": staging._count})
+        pipe.delete(staging.meta_key)
+        # adds that see the flag gone write into the new layers, the rest are in the log
+        pipe.delete(self.rebuild_key)
+        pipe.execute()
+        self._capacity, self._count = capacity, staging._count
+        self._replay_log(self, batch_size)
+        return staging._count
+
+    def stats(self) -> dict:
+        capacity, count = self.client.hmget(self.meta_key, "capacity", "count")
+        self._read_meta(capacity, count)
+        layers = self._layer_of(self._capacity, max(self._count, 1)) + 1
+        return {
+            "items": self._count,
+            "layers": layers,
+            "capacity": sum(self._capacity * self.growth ** layer for layer in range(layers)),
+            "error_rate": self.error_rate,
+            "memory_bytes": sum(self._layer_size(self._capacity, layer)[0] for layer in range(layers)) // 8,
+        }
+
+
+# every short code ever allocated, used to skip database reads on collision checks
+shortcode_filter = ScalableBloomFilter(
+    redis_client,
+    SHORTCODE_FILTER_NAME,
+    capacity=SHORTCODE_FILTER_CAPACITY,
+    error_rate=SHORTCODE_FILTER_ERROR_RATE,
+)
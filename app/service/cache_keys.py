@@ -0,0 +1,213 @@
+import re
+from typing import Optional
+from redis.exceptions import ResponseError
+
+# Every Redis key starts with its type, so each type can be found, sized and evicted on its own.
+# The part in braces is the hash tag: Redis Cluster only hashes that part, so keys that are
+# used together in one multi-key command, transaction or rename share a slot.
+
+# singletons. Keys with the same tag share a slot, so all the {shortcode} keys live on one node
+ID_COUNTER_KEY = "id:{shortcode}:counter"
+CODE_POOL_KEY = "pool:{shortcode}"
+CODE_POOL_LOCK_KEY = "pool:{shortcode}:lock"
+# the filter's layers, meta and rebuild staging keys are renamed into each other, so they share a tag
+SHORTCODE_FILTER_NAME = "filter:{shortcode}"
+WARMUP_PROGRESS_KEY = "warmup:{cache}:progress"
+WARMUP_LOCK_KEY = "warmup:{cache}:lock"
+# the daily counters are unioned in one ZUNIONSTORE
+POPULARITY_KEY_PREFIX = "popularity:{hits}"
+
+
+def url_key(short_url: str) -> str:
+    """Cached long URL of a short URL."""
+    return f"url:{{{short_url}}}"
+
+
+def url_bucket_key(bucket: int, generation: Optional[int] = None) -> str:
+    """Hash of cached long URLs in the "buckets" layout, one field per short URL.
+    Buckets that can't expire their fields one by one get a hash per generation."""
+    if generation is None:
+        return f"urls:{{{bucket}}}"
+    return f"urls:{{{bucket}}}:{generation}"
+
+
+def user_key(email: str) -> str:
+    """Cached user record. Every per-user key below shares its tag."""
+    return f"user:{{{email}}}"
+
+
+def url_count_key(email: str) -> str:
+    return f"{user_key(email)}:url-count"
+
+
+def url_list_key(email: str) -> str:
+    return f"{user_key(email)}:url-list"
+
+
+def token_version_key(email: str) -> str:
+    return f"{user_key(email)}:token-version"
+
+
+def refresh_tokens_key(email: str) -> str:
+    return f"{user_key(email)}:refresh-tokens"
+
+
+def refresh_token_key(email: str, jti: str) -> str:
+    return f"{user_key(email)}:refresh-token:{jti}"
+
+
+def lock_key(name: str, key: str) -> str:
+    return f"lock:{name}:{{{key}}}"
+
+
+# IDs left between the legacy counter and the new one. During a rolling deploy old workers
+# keep leasing from the legacy counter, this keeps their IDs below every ID of new workers
+LEGACY_COUNTER_HEADROOM = 10 ** 9
+
+# keys written before the schema above
+_LEGACY_SHORT_URL = re.compile(r"^[A-Za-z0-9_-]{10,15}$")
+_LEGACY_RENAMES = [
+    (re.compile(r"^shortcode-counter$"), lambda m: ID_COUNTER_KEY),
+    (re.compile(r"^shortcode-pool$"), lambda m: CODE_POOL_KEY),
+    (re.compile(r"^shortcode-filter:(meta|\d+)$"), lambda m: f"{SHORTCODE_FILTER_NAME}:{m.group(1)}"),
+    (re.compile(r"^cache-warmup:progress$"), lambda m: WARMUP_PROGRESS_KEY),
+    (re.compile(r"^url-popularity:(\d{8})$"), lambda m: f"{POPULARITY_KEY_PREFIX}:{m.group(1)}"),
+    (re.compile(r"^user:([^{].*)$"), lambda m: user_key(m.group(1))),
+    (re.compile(r"^url-count:(.+)$"), lambda m: url_count_key(m.group(1))),
+    (re.compile(r"^url-list:(.+)$"), lambda m: url_list_key(m.group(1))),
+    (re.compile(r"^token-version:(.+)$"), lambda m: token_version_key(m.group(1))),
+    (re.compile(r"^refresh-tokens:(.+)$"), lambda m: refresh_tokens_key(m.group(1))),
+]
+# locks, rebuild leftovers and scratch keys are only worth dropping
+_LEGACY_DROPS = re.compile(r"^(shortcode-pool:lock|cache-warmup:lock|url-popularity:window|shortcode-filter:rebuild:.*|[^:]+-lock:.*)$")
+
+
+def legacy_key_target(redis_client, key: str) -> Optional[str]:
+    """New name of a key written before the schema above, "" if it should just be dropped,
+    None if it is not a legacy key."""
+    for pattern, target in _LEGACY_RENAMES:
+        match = pattern.match(key)
+        if match:
+            return target(match)
+    if _LEGACY_DROPS.match(key):
+        return ""
+    if key.startswith("refresh-token:"):
+        # the old key held the owner's email, the new one is filed under it
+        email = redis_client.get(key)
+        return refresh_token_key(email.decode("utf-8"), key.split(":", 1)[1]) if email else ""
+    if "@" in key and ":" not in key:
+        # list_my_urls used to cache pages under the raw email
+        return ""
+    if _LEGACY_SHORT_URL.match(key):
+        return url_key(key)
+    return None
+
+
+def _advance_counter(redis_client, key: str) -> bool:
+    """Keep the ID counter LEGACY_COUNTER_HEADROOM ahead of the legacy counter at key, which
+    stays in place for old workers. True if it had to move. Only INCRBY, never SET, so leases
+    taken meanwhile are never handed out again."""
+    legacy = redis_client.get(key)
+    if legacy is None:
+        return False
+    behind = int(legacy) + LEGACY_COUNTER_HEADROOM - int(redis_client.get(ID_COUNTER_KEY) or 0)
+    if behind <= 0:
+        return False
+    redis_client.incrby(ID_COUNTER_KEY, behind)
+    return True
+
+
+def _merge_key(redis_client, target: str, dumped: bytes) -> bool:
+    """Merge a dumped legacy key into the existing target, False for keys that aren't merged.
+
+    The dump is restored next to the target first, into the target's slot, since the
+    legacy key may live in another one.
+    """
+    if target == CODE_POOL_KEY:
+        merge = lambda scratch: redis_client.sunionstore(target, [target, scratch])
+    elif target == f"{SHORTCODE_FILTER_NAME}:meta":
+        merge = lambda scratch: redis_client.hincrby(target, "count", int(redis_client.hget(scratch, "count") or 0))
+    elif target.startswith(f"{SHORTCODE_FILTER_NAME}:"):
+        # both filters sized their layers from the same settings, so their bits line up
+        merge = lambda scratch: redis_client.bitop("OR", target, target, scratch)
+    else:
+        return False
+    scratch = f"{target}:legacy"
+    redis_client.delete(scratch)
+    redis_client.restore(scratch, 0, dumped)
+    try:
+        merge(scratch)
+    finally:
+        redis_client.delete(scratch)
+    return True
+
+
+def _move_key(redis_client, key: str, target: str) -> str:
+    """Move one key to its new name with DUMP and RESTORE, which keep its type and remaining TTL.
+
+    A key that already exists under the new name is merged with it if it is state (the
+    code pool and the filter), otherwise the new key wins. The ID counter is advanced
+    past the legacy one instead. Returns what was done.
+    """
+    if target == ID_COUNTER_KEY:
+        outcome = "merged" if _advance_counter(redis_client, key) else "skipped"
+        redis_client.delete(key)
+        return outcome
+    dumped, ttl = redis_client.dump(key), redis_client.pttl(key)
+    if dumped is None:
+        # expired or moved by another worker in the meantime
+        return "gone"
+    if redis_client.exists(target):
+        outcome = "merged" if _merge_key(redis_client, target, dumped) else "skipped"
+    else:
+        try:
+            redis_client.restore(target, max(ttl, 0), dumped)
+            outcome = "moved"
+        except ResponseError:
+            # BUSYKEY, the app wrote the new key since the check
+            outcome = "merged" if _merge_key(redis_client, target, dumped) else "skipped"
+    redis_client.delete(key)
+    return outcome
+
+
+def migrate_legacy_state(redis_client) -> int:
+    """Move the few legacy keys that are state rather than cache: the ID counter, the code pool
+    and the short code filter. Returns the number of keys moved or merged.
+
+    Losing them would make the range allocator hand out used IDs again and the filter
+    miss allocated codes, so every worker runs this at startup. It costs a handful of
+    commands and does nothing once the keys are moved. The legacy counter is left in place
+    for workers still running the old version, migrate_legacy_keys removes it.
+    """
+    moved = 1 if _advance_counter(redis_client, "shortcode-counter") else 0
+    keys = {"shortcode-pool": CODE_POOL_KEY, "shortcode-filter:meta": f"{SHORTCODE_FILTER_NAME}:meta"}
+    # filter layers are numbered from 0 without gaps
+    layer = 0
+    while redis_client.exists(f"shortcode-filter:{layer}"):
+        keys[f"shortcode-filter:{layer}"] = f"{SHORTCODE_FILTER_NAME}:{layer}"
+        layer += 1
+    return moved + sum(1 for key, target in keys.items() if redis_client.exists(key) and _move_key(redis_client, key, target) != "gone")
+
+
+def migrate_legacy_keys(redis_client, batch_size: int = 1000) -> dict:
+    """Move every key written before the typed schema to its new name. Returns counts of what was done.
+
+    Cached entries that aren't moved are only misses, so this can run while the app is
+    serving, but only once every worker runs the typed schema: it removes the legacy ID
+    counter old workers lease from. It is safe to repeat, and in cluster mode the scan
+    visits every primary.
+    """
+    counts = {"moved": 0, "merged": 0, "skipped": 0, "dropped": 0}
+    for raw_key in redis_client.scan_iter(count=batch_size):
+        key = raw_key.decode("utf-8")
+        target = legacy_key_target(redis_client, key)
+        if target is None:
+            continue
+        if target == "":
+            redis_client.delete(key)
+            counts["dropped"] += 1
+            continue
+        outcome = _move_key(redis_client, key, target)
+        if outcome in counts:
+            counts[outcome] += 1
+    return counts
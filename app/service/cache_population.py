@@ -1,10 +1,181 @@
 import os
+import json
+import uuid
+import threading
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from redis.exceptions import WatchError
+
+from app.service import url_cache, access_tracker, codec
+from app.service.cache_keys import WARMUP_PROGRESS_KEY, WARMUP_LOCK_KEY
+from app.models.database import BATCH_GET_SIZE
 load_dotenv()
 
-expiration_time = os.getenv("CACHE_EXPIRE_TIME")
+# "full" loads the whole table, "popular" only the most accessed links, "off" skips the warm-up
+CACHE_WARMUP_MODE = os.getenv("CACHE_WARMUP_MODE", "full")
+# number of parallel DynamoDB scan segments and mappings written per Redis pipeline
+CACHE_WARMUP_SEGMENTS = int(os.getenv("CACHE_WARMUP_SEGMENTS", 8))
+CACHE_WARMUP_BATCH_SIZE = int(os.getenv("CACHE_WARMUP_BATCH_SIZE", 500))
+# a worker holding the lock must checkpoint at least this often or another worker may take over
+CACHE_WARMUP_LOCK_TIMEOUT = int(os.getenv("CACHE_WARMUP_LOCK_TIMEOUT", 120))
+
+# limits for the "popular" mode, the warm-up stops at whichever is reached first. The budget counts
+# the short URLs and encoded long URLs written, Redis adds its per-entry overhead on top (see tests/bench_codec.py)
+CACHE_WARMUP_TOP_N = int(os.getenv("CACHE_WARMUP_TOP_N", 10000))
+CACHE_WARMUP_MEMORY_BUDGET = int(os.getenv("CACHE_WARMUP_MEMORY_BUDGET", 64 * 1024 * 1024))
+
+
+def _acquire_lock(redis_client) -> Optional[str]:
+    """Take the warm-up lock, returns the token that releases it or None if another worker holds it."""
+    token = uuid.uuid4().hex
+    return token if redis_client.set(WARMUP_LOCK_KEY, token, nx=True, ex=CACHE_WARMUP_LOCK_TIMEOUT) else None
+
+
+def _release_lock(redis_client, token: str) -> None:
+    """Delete the warm-up lock if it is still ours. A run that outlived the lock timeout
+    must not delete the lock of the worker that took over."""
+    with redis_client.pipeline() as pipe:
+        try:
+            pipe.watch(WARMUP_LOCK_KEY)
+            if pipe.get(WARMUP_LOCK_KEY) == token.encode("utf-8"):
+                pipe.multi()
+                pipe.delete(WARMUP_LOCK_KEY)
+                pipe.execute()
+        except WatchError:
+            # the lock expired and was taken over between the check and the delete
+            pass
+
+
+def populate_cache_from_database(redis_client, Urls, segments: int = CACHE_WARMUP_SEGMENTS, batch_size: int = CACHE_WARMUP_BATCH_SIZE) -> bool:
+    """Populate the cache with existing short URLs from the database.
+
+    The table is scanned in parallel segments and every batch is written with one
+    Redis pipeline. Each segment checkpoints its scan position in Redis, so a warm-up
+    interrupted by a restart resumes where it stopped instead of starting over.
+    Returns False if another worker is already running the warm-up.
+    """
+    token = _acquire_lock(redis_client)
+    if token is None:
+        return False
+    try:
+        state = redis_client.hget(WARMUP_PROGRESS_KEY, "state")
+        if state == b"complete":
+            # the cache is still warm from an earlier run
+            return True
+
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hset(WARMUP_PROGRESS_KEY, mapping={"state": "running", "segments": segments})
+        if state is None:
+            # checkpoints are only useful while the entries they loaded are still cached
+            pipe.expire(WARMUP_PROGRESS_KEY, url_cache.expiration_time)
+        pipe.execute()
+
+        with ThreadPoolExecutor(max_workers=segments) as pool:
+            list(pool.map(lambda segment: _populate_segment(redis_client, Urls, segment, segments, batch_size), range(segments)))
+
+        redis_client.hset(WARMUP_PROGRESS_KEY, "state", "complete")
+        return True
+    except Exception:
+        redis_client.hset(WARMUP_PROGRESS_KEY, "state", "failed")
+        raise
+    finally:
+        _release_lock(redis_client, token)
+
+
+def _populate_segment(redis_client, Urls, segment: int, total_segments: int, batch_size: int) -> None:
+    """Load one scan segment into the cache, resuming from its last checkpoint."""
+    field = f"segment:{segment}/{total_segments}"
+    checkpoint = redis_client.hget(WARMUP_PROGRESS_KEY, field)
+    if checkpoint == b"done":
+        return
+
+    results = Urls.scan(
+        segment=segment,
+        total_segments=total_segments,
+        last_evaluated_key=json.loads(checkpoint) if checkpoint else None,
+        page_size=batch_size,
+    )
+    pipe = redis_client.pipeline(transaction=False)
+    pending = 0
+    for url_pair in results:
+        url_cache.queue_long_url(pipe, url_pair.short_url, url_pair.long_url)
+        pending += 1
+        if pending >= batch_size:
+            # last_evaluated_key points at the last item handed out, so resuming skips exactly what was written
+            _flush(pipe, field, json.dumps(results.last_evaluated_key), pending)
+            pending = 0
+    _flush(pipe, field, "done", pending)
+
+
+def _flush(pipe, field: str, checkpoint: str, loaded: int) -> None:
+    """Write the queued mappings together with the checkpoint that covers them."""
+    pipe.hset(WARMUP_PROGRESS_KEY, field, checkpoint)
+    pipe.hincrby(WARMUP_PROGRESS_KEY, "items_loaded", loaded)
+    pipe.expire(WARMUP_LOCK_KEY, CACHE_WARMUP_LOCK_TIMEOUT)
+    pipe.execute()
+
+
+def populate_cache_from_popular_urls(redis_client, Urls, top_n: int = CACHE_WARMUP_TOP_N, memory_budget: int = CACHE_WARMUP_MEMORY_BUDGET) -> int:
+    """Populate the cache with only the most accessed short URLs.
+
+    Candidates come from the access counters kept by the redirect handler.
+    They are loaded most popular first until top_n links or memory_budget bytes of
+    short and encoded long URLs are written. Everything else is cached lazily on a miss.
+    Returns the number of links loaded.
+    """
+    token = _acquire_lock(redis_client)
+    if token is None:
+        return 0
+    try:
+        ranked = [short_url for short_url, _ in access_tracker.top_short_urls(top_n)]
+        redis_client.delete(WARMUP_PROGRESS_KEY)
+        redis_client.hset(WARMUP_PROGRESS_KEY, mapping={"state": "running", "segments": 0})
+        loaded, used = 0, 0
+        for start in range(0, len(ranked), BATCH_GET_SIZE):
+            batch = ranked[start:start + BATCH_GET_SIZE]
+            found = {url_pair.short_url: url_pair.long_url for url_pair in Urls.batch_get(batch)}
+            pipe = redis_client.pipeline(transaction=False)
+            for short_url in batch:
+                if short_url not in found:
+                    continue
+                used += len(short_url) + len(codec.encode_long_url(found[short_url]))
+                if used > memory_budget:
+                    break
+                url_cache.queue_long_url(pipe, short_url, found[short_url])
+                loaded += 1
+            pipe.hset(WARMUP_PROGRESS_KEY, "items_loaded", loaded)
+            pipe.expire(WARMUP_LOCK_KEY, CACHE_WARMUP_LOCK_TIMEOUT)
+            pipe.execute()
+            if used > memory_budget:
+                break
+
+        redis_client.hset(WARMUP_PROGRESS_KEY, "state", "complete")
+        return loaded
+    except Exception:
+        redis_client.hset(WARMUP_PROGRESS_KEY, "state", "failed")
+        raise
+    finally:
+        _release_lock(redis_client, token)
+
+
+def start_background_warmup(redis_client, Urls) -> Optional[threading.Thread]:
+    """Run the cache warm-up in a daemon thread so the app can serve requests right away."""
+    if CACHE_WARMUP_MODE == "off":
+        return None
+    target = populate_cache_from_popular_urls if CACHE_WARMUP_MODE == "popular" else populate_cache_from_database
+    thread = threading.Thread(target=target, args=(redis_client, Urls), name="cache-warmup", daemon=True)
+    thread.start()
+    return thread
+
 
-def populate_cache_from_database(redis_client, Urls):
-    """Populate the cache with existing short URLs from the database."""
-    for url_pair in Urls.scan():
-        redis_client.setex(url_pair.short_url, expiration_time, url_pair.long_url)
+def warmup_status(redis_client) -> dict:
+    """Progress of the current or last warm-up, shared by all workers."""
+    progress = {key.decode("utf-8"): value.decode("utf-8") for key, value in redis_client.hgetall(WARMUP_PROGRESS_KEY).items()}
+    segments = int(progress.get("segments", 0))
+    return {
+        "state": progress.get("state", "not_started"),
+        "segments": segments,
+        "segments_done": sum(1 for key, value in progress.items() if key.endswith(f"/{segments}") and value == "done"),
+        "items_loaded": int(progress.get("items_loaded", 0)),
+    }
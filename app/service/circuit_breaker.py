@@ -0,0 +1,69 @@
+import time
+import threading
+
+
+class CircuitBreaker:
+    """Stop calling a dependency that keeps failing, and probe it again after a pause.
+
+    The breaker is closed while calls succeed. After failure_threshold consecutive
+    failures it opens and allow() turns calls away for reset_timeout seconds. Then it
+    goes half open and lets a single probe through: a success closes it again, a
+    failure opens it for another reset_timeout.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 10):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """True if the next call should go to the dependency."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def release(self) -> None:
+        """End a call that neither succeeded nor failed against the dependency, e.g. a cancelled one.
+
+        Frees the probe slot of a half-open breaker without closing or opening it.
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened += 1
+                self._opened_at = time.monotonic()
+                print(f"Circuit breaker {self.name} opened after {self.failures} failures")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "opened": self.opened, "rejected": self.rejected}
@@ -0,0 +1,150 @@
+import os
+import uuid
+import threading
+from typing import List, Optional
+from dotenv import load_dotenv
+from redis.exceptions import WatchError
+
+from app.service.redis_client import redis_client
+from app.service.cache_keys import CODE_POOL_KEY, CODE_POOL_LOCK_KEY
+from app.service import idgenerator
+from app.models.database import Urls, BATCH_GET_SIZE
+load_dotenv()
+
+# the refiller tops the pool up to the high watermark once it drops below the low one
+CODE_POOL_LOW_WATERMARK = int(os.getenv("CODE_POOL_LOW_WATERMARK", 1000))
+CODE_POOL_HIGH_WATERMARK = int(os.getenv("CODE_POOL_HIGH_WATERMARK", 10000))
+CODE_POOL_CHECK_INTERVAL = float(os.getenv("CODE_POOL_CHECK_INTERVAL", 5))
+CODE_POOL_LOCK_TIMEOUT = int(os.getenv("CODE_POOL_LOCK_TIMEOUT", 60))
+
+_stats = {"taken": 0, "ran_dry": 0, "generated": 0, "collisions": 0}
+_stats_lock = threading.Lock()
+_refill_requested = threading.Event()
+_stopped = threading.Event()
+_refiller = None
+
+
+def _count(name: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def take_many(count: int) -> List[str]:
+    """Take up to count codes out of the pool, fewer if it runs dry."""
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.spop(CODE_POOL_KEY, count)
+    pipe.scard(CODE_POOL_KEY)
+    codes, remaining = pipe.execute()
+    codes = [code.decode("utf-8") for code in codes or []]
+    _count("taken", len(codes))
+    if len(codes) < count:
+        _count("ran_dry")
+    if remaining < CODE_POOL_LOW_WATERMARK:
+        _refill_requested.set()
+    return codes
+
+
+def take() -> Optional[str]:
+    """Take one code out of the pool, None if it is empty."""
+    codes = take_many(1)
+    return codes[0] if codes else None
+
+
+def _acquire_lock() -> Optional[str]:
+    """Take the refill lock, returns the token that releases it or None if another worker holds it."""
+    token = uuid.uuid4().hex
+    return token if redis_client.set(CODE_POOL_LOCK_KEY, token, nx=True, ex=CODE_POOL_LOCK_TIMEOUT) else None
+
+
+def _release_lock(token: str) -> None:
+    """Delete the refill lock if it is still ours. A refill that outlived the lock timeout
+    must not delete the lock of the worker that took over."""
+    with redis_client.pipeline() as pipe:
+        try:
+            pipe.watch(CODE_POOL_LOCK_KEY)
+            if pipe.get(CODE_POOL_LOCK_KEY) == token.encode("utf-8"):
+                pipe.multi()
+                pipe.delete(CODE_POOL_LOCK_KEY)
+                pipe.execute()
+        except WatchError:
+            # the lock expired and was taken over between the check and the delete
+            pass
+
+
+def refill(force: bool = False) -> int:
+    """Top the pool up to the high watermark with codes verified unused. Returns the number added.
+
+    Nothing happens while the pool is above the low watermark, unless forced, or
+    while another worker holds the refill lock.
+    """
+    if not force and redis_client.scard(CODE_POOL_KEY) >= CODE_POOL_LOW_WATERMARK:
+        return 0
+    token = _acquire_lock()
+    if token is None:
+        return 0
+    try:
+        added = 0
+        while True:
+            missing = CODE_POOL_HIGH_WATERMARK - redis_client.scard(CODE_POOL_KEY)
+            if missing <= 0:
+                return added
+            candidates = list({idgenerator.randomID() for _ in range(min(missing, BATCH_GET_SIZE))})
+            taken = {url_pair.short_url for url_pair in Urls.batch_get(candidates, attributes_to_get=["short_url"])}
+            free = [code for code in candidates if code not in taken]
+            _count("generated", len(candidates))
+            _count("collisions", len(taken))
+
+            pipe = redis_client.pipeline(transaction=False)
+            if free:
+                pipe.sadd(CODE_POOL_KEY, *free)
+            pipe.get(CODE_POOL_LOCK_KEY)
+            pipe.expire(CODE_POOL_LOCK_KEY, CODE_POOL_LOCK_TIMEOUT)
+            holder = pipe.execute()[-2]
+            added += len(free)
+            if holder != token.encode("utf-8"):
+                # the lock timed out and another worker is refilling now
+                return added
+    finally:
+        _release_lock(token)
+
+
+def _run_refiller() -> None:
+    while not _stopped.is_set():
+        _refill_requested.wait(CODE_POOL_CHECK_INTERVAL)
+        _refill_requested.clear()
+        try:
+            refill()
+        except Exception as e:
+            # requests fall back to inline generation, never let a hiccup kill the refiller
+            print(f"Short code pool refill failed: {e}")
+
+
+def start_refiller() -> None:
+    """Keep the pool filled from a background thread when the pool allocator is configured."""
+    global _refiller
+    if idgenerator.ID_ALLOCATOR != "pool" or _refiller is not None:
+        return
+    _stopped.clear()
+    _refill_requested.set()
+    _refiller = threading.Thread(target=_run_refiller, name="code-pool-refiller", daemon=True)
+    _refiller.start()
+
+
+def stop_refiller() -> None:
+    global _refiller
+    if _refiller is not None:
+        _stopped.set()
+        _refill_requested.set()
+        _refiller.join()
+        _refiller = None
+
+
+def stats() -> dict:
+    with _stats_lock:
+        counters = dict(_stats)
+    return {
+        **counters,
+        "size": redis_client.scard(CODE_POOL_KEY),
+        "low_watermark": CODE_POOL_LOW_WATERMARK,
+        "high_watermark": CODE_POOL_HIGH_WATERMARK,
+    }
@@ -0,0 +1,93 @@
+import os
+import json
+import zlib
+from typing import Any, Optional, Union
+import msgpack
+from dotenv import load_dotenv
+load_dotenv()
+
+# "plain" writes values the way older versions did, "compact" writes the encoded formats below.
+# Readers understand both, so roll out with "plain" first and switch once every worker runs this version.
+CACHE_VALUE_FORMAT = os.getenv("CACHE_VALUE_FORMAT", "plain")
+# long URLs shorter than this are stored uncompressed, zlib doesn't pay off for them
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", 64))
+CACHE_COMPRESS_LEVEL = int(os.getenv("CACHE_COMPRESS_LEVEL", 6))
+
+# Encoded values start with a header byte naming their format. Plain values never do,
+# since long URLs start with "http" and JSON with "{" or "[".
+ZLIB_URL_DICT_V1 = 0x01
+MSGPACK = 0x02
+
+# Preset dictionary for long URLs: the parts most links share. zlib can refer back into it
+# from the first byte, which is what makes compressing short strings worthwhile. The most
+# common strings go last, where back references are shortest. Changing it needs a new header
+# byte, or values written with the old one can't be read.
+URL_DICTIONARY_V1 = (
+    b"utm_content=utm_term=ref=share&ref_src=twsrc%5Etfw&s=20&t=&si=&feature=share&lang=en"
+    b"&sort=&page=&q=&search?q=&p=&hl=en&gl=US&v=&list=&index=watch?v=youtube.com/"
+    b"amazon.com/dp/product/item/article/news/blog/2024/2025/2026/index.html.php.aspx"
+    b"&mc_cid=&mc_eid=&_hsenc=&_hsmi=&igshid=&fbclid=&gclid=&msclkid=&dclid="
+    b"?utm_source=newsletter&utm_medium=email&utm_source=facebook&utm_medium=social"
+    b"&utm_source=twitter&utm_source=linkedin&utm_medium=cpc&utm_campaign="
+    b"http://www.https://www.com/org/net/io/?utm_source="
+)
+
+_stats = {"encoded": 0, "compressed": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def _compress(data: bytes) -> bytes:
+    compressor = zlib.compressobj(CACHE_COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=URL_DICTIONARY_V1)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _decompress(data: bytes) -> bytes:
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=URL_DICTIONARY_V1)
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+def encode_long_url(long_url: str, value_format: Optional[str] = None) -> Union[str, bytes]:
+    """Value to cache for a long URL."""
+    if (value_format or CACHE_VALUE_FORMAT) != "compact":
+        return long_url
+    data = long_url.encode("utf-8")
+    # short URLs stay plain, which is also what a value that doesn't compress falls back to
+    encoded = data
+    if len(data) >= CACHE_COMPRESS_MIN_BYTES:
+        # raw deflate without zlib's header and checksum, the header byte already names the format
+        compressed = bytes([ZLIB_URL_DICT_V1]) + _compress(data)
+        if len(compressed) < len(encoded):
+            encoded = compressed
+            _stats["compressed"] += 1
+    _stats["encoded"] += 1
+    _stats["bytes_in"] += len(data)
+    _stats["bytes_out"] += len(encoded)
+    return encoded
+
+
+def decode_long_url(value: bytes) -> str:
+    """Long URL from a cached value in any format."""
+    if value[0] == ZLIB_URL_DICT_V1:
+        return _decompress(value[1:]).decode("utf-8")
+    return value.decode("utf-8")
+
+
+def encode_object(value: Any, value_format: Optional[str] = None) -> Union[str, bytes]:
+    """Value to cache for a JSON-compatible object, such as a user record or a page of URLs."""
+    if (value_format or CACHE_VALUE_FORMAT) != "compact":
+        return json.dumps(value)
+    return bytes([MSGPACK]) + msgpack.packb(value)
+
+
+def decode_object(value: bytes) -> Any:
+    """Object from a cached value in any format."""
+    if value[0] == MSGPACK:
+        return msgpack.unpackb(value[1:])
+    return json.loads(value)
+
+
+def stats() -> dict:
+    return {
+        "format": CACHE_VALUE_FORMAT,
+        **_stats,
+        "compression_ratio": _stats["bytes_out"] / _stats["bytes_in"] if _stats["bytes_in"] else 1.0,
+    }
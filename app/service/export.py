@@ -0,0 +1,115 @@
+import os
+import json
+import gzip
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+load_dotenv()
+
+# number of parallel DynamoDB scan segments, each written to its own shard
+EXPORT_SEGMENTS = int(os.getenv("EXPORT_SEGMENTS", 8))
+# rows per scan page, every page is written and checkpointed as one unit
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", 1000))
+
+MANIFEST_NAME = "manifest.json"
+
+
+def export_urls(Urls, output_dir: str, segments: int = EXPORT_SEGMENTS, page_size: int = EXPORT_PAGE_SIZE) -> dict:
+    """Export the URL table to gzip-compressed JSONL shards in output_dir. Returns the manifest.
+
+    The table is read with a parallel scan, one thread and one shard per segment, so the
+    export gets faster with more segments until the table's read capacity runs out.
+    Every page is appended to its shard as a separate gzip member, and the manifest
+    records the scan position and shard size after each page. Running the export again
+    on the same directory resumes every unfinished segment from its last checkpoint.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = _load_manifest(output_dir)
+    if manifest is None:
+        manifest = {
+            "table": Urls.Meta.table_name,
+            "format": "jsonl.gz",
+            "segments": segments,
+            "started_at": datetime.utcnow().isoformat(),
+            "state": "running",
+            "shards": [
+                {"file": f"urls-{segment:05d}-of-{segments:05d}.jsonl.gz", "rows": 0, "bytes": 0, "last_evaluated_key": None, "done": False}
+                for segment in range(segments)
+            ],
+        }
+    elif manifest["segments"] != segments:
+        raise ValueError(f"{output_dir} holds an export with {manifest['segments']} segments, not {segments}")
+
+    if manifest["state"] != "complete":
+        manifest["state"] = "running"
+        lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=segments) as pool:
+            list(pool.map(lambda segment: _export_segment(Urls, output_dir, manifest, lock, segment, page_size), range(segments)))
+        manifest["state"] = "complete"
+        manifest["finished_at"] = datetime.utcnow().isoformat()
+        manifest["rows"] = sum(shard["rows"] for shard in manifest["shards"])
+        _save_manifest(output_dir, manifest)
+    return manifest
+
+
+def _export_segment(Urls, output_dir: str, manifest: dict, lock: threading.Lock, segment: int, page_size: int) -> None:
+    """Write one scan segment to its shard, resuming from its last checkpoint."""
+    shard = manifest["shards"][segment]
+    if shard["done"]:
+        return
+
+    results = Urls.scan(
+        segment=segment,
+        total_segments=manifest["segments"],
+        last_evaluated_key=shard["last_evaluated_key"],
+        page_size=page_size,
+    )
+    path = os.path.join(output_dir, shard["file"])
+    with open(path, "r+b" if os.path.exists(path) else "wb") as raw:
+        # drop whatever was written after the last checkpoint
+        raw.truncate(shard["bytes"])
+        raw.seek(shard["bytes"])
+        lines = []
+        for url_pair in results:
+            lines.append(json.dumps({
+                "short_url": url_pair.short_url,
+                "long_url": url_pair.long_url,
+                "creator_email": url_pair.creator_email,
+                "clicks": int(url_pair.clicks),
+            }))
+            if len(lines) >= page_size:
+                _write_page(raw, lines, shard, results.last_evaluated_key, output_dir, manifest, lock)
+                lines = []
+        _write_page(raw, lines, shard, None, output_dir, manifest, lock, done=True)
+
+
+def _write_page(raw, lines, shard: dict, last_evaluated_key, output_dir: str, manifest: dict, lock: threading.Lock, done: bool = False) -> None:
+    """Append lines as one gzip member, then checkpoint the shard."""
+    if lines:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as member:
+            member.write(("\n".join(lines) + "\n").encode("utf-8"))
+    raw.flush()
+    os.fsync(raw.fileno())
+    with lock:
+        shard["rows"] += len(lines)
+        shard["bytes"] = raw.tell()
+        shard["last_evaluated_key"] = last_evaluated_key
+        shard["done"] = done
+        _save_manifest(output_dir, manifest)
+
+
+def _load_manifest(output_dir: str):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(output_dir: str, manifest: dict) -> None:
+    # write to a temporary file first so a crash never leaves a half-written manifest
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
@@ -1,7 +1,103 @@
+import os
+import math
+import threading
 from nanoid import generate
+from dotenv import load_dotenv
+
+from app.service.redis_client import redis_client
+from app.service.cache_keys import ID_COUNTER_KEY
+load_dotenv()
+
+# "nanoid" generates random IDs, "range" hands out IDs from blocks leased off a shared counter,
+# "pool" takes random IDs verified unused in the background (see code_pool)
+ID_ALLOCATOR = os.getenv("ID_ALLOCATOR", "nanoid")
+# IDs leased per counter round trip, a worker that stops loses what is left of its block
+ID_LEASE_SIZE = int(os.getenv("ID_LEASE_SIZE", 1000))
+# spread consecutive IDs over the code space so codes don't reveal how many links exist
+ID_SCRAMBLE = os.getenv("ID_SCRAMBLE", "true").lower() == "true"
+ID_SCRAMBLE_MULTIPLIER = int(os.getenv("ID_SCRAMBLE_MULTIPLIER", 52495732188953679))
+ID_SCRAMBLE_OFFSET = int(os.getenv("ID_SCRAMBLE_OFFSET", 361870285713957))
+
+BASE62 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+# the shortest length schemas.shortURL accepts, random IDs are 15 long so the two never overlap
+RANGE_ID_LENGTH = 10
 
 
 # generate a random short URL of size 15
 def randomID() -> str:
     randID = generate(size=15)
-    return randID
\ No newline at end of file
+    return randID
+
+
+class RangeAllocator:
+    """Hand out unique IDs from blocks leased off an atomic Redis counter.
+
+    Leasing a block is one INCRBY, every ID after that is allocated in process. IDs
+    are unique across workers by construction, so they need no collision check.
+    Each ID is run through the bijection `(id * multiplier + offset) mod 62**length`
+    and written as a fixed-width base62 code.
+    """
+
+    def __init__(self, client, key: str, lease_size: int, length: int = RANGE_ID_LENGTH, scramble: bool = True, multiplier: int = 1, offset: int = 0):
+        self.space = len(BASE62) ** length
+        if scramble and math.gcd(multiplier, self.space) != 1:
+            raise ValueError(f"multiplier must be coprime with 62, got {multiplier}")
+        self.client = client
+        self.key = key
+        self.lease_size = lease_size
+        self.length = length
+        self.multiplier = multiplier if scramble else 1
+        self.offset = offset if scramble else 0
+        self.leases = 0
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        with self._lock:
+            if self._next >= self._end:
+                self._end = self.client.incrby(self.key, self.lease_size)
+                self._next = self._end - self.lease_size
+                self.leases += 1
+            allocated = self._next
+            self._next += 1
+        if allocated >= self.space:
+            raise OverflowError("The short code counter ran out of codes")
+        return allocated
+
+    def encode(self, allocated: int) -> str:
+        value = (allocated * self.multiplier + self.offset) % self.space
+        digits = []
+        for _ in range(self.length):
+            value, digit = divmod(value, len(BASE62))
+            digits.append(BASE62[digit])
+        return "".join(reversed(digits))
+
+    def next_code(self) -> str:
+        return self.encode(self.next_id())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"leases": self.leases, "lease_size": self.lease_size, "remaining_in_lease": self._end - self._next}
+
+
+range_allocator = RangeAllocator(
+    redis_client,
+    ID_COUNTER_KEY,
+    lease_size=ID_LEASE_SIZE,
+    scramble=ID_SCRAMBLE,
+    multiplier=ID_SCRAMBLE_MULTIPLIER,
+    offset=ID_SCRAMBLE_OFFSET,
+)
+
+
+def newID() -> str:
+    """Next short URL from the configured allocator."""
+    if ID_ALLOCATOR == "range":
+        return range_allocator.next_code()
+    return randomID()
+
+
+def ids_are_unique() -> bool:
+    """True if the configured allocator never hands out a code twice, so new codes need no filter check."""
+    return ID_ALLOCATOR == "range"
@@ -0,0 +1,43 @@
+from typing import Callable, Dict
+
+from app.service.redis_client import redis_client
+
+# channel name -> callback receiving the invalidated key
+_handlers: Dict[str, Callable[[str], None]] = {}
+_listener = None
+
+
+def register_handler(channel: str, handler: Callable[[str], None]) -> None:
+    """Call handler with the key of every invalidation published on channel."""
+    _handlers[channel] = handler
+
+
+def publish(channel: str, key: str) -> None:
+    """Tell every worker (including this one) to drop its local copy of key."""
+    redis_client.publish(channel, key)
+
+
+def queue_publish(pipe, channel: str, key: str) -> None:
+    """Add a publish to a pipeline, for invalidating many keys in one round trip."""
+    pipe.publish(channel, key)
+
+
+def start_listener() -> None:
+    """Subscribe to all registered channels in a background thread."""
+    global _listener
+    if _listener is not None or not _handlers:
+        return
+
+    def dispatch(handler):
+        return lambda message: handler(message["data"].decode("utf-8"))
+
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(**{channel: dispatch(handler) for channel, handler in _handlers.items()})
+    _listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+
+def stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
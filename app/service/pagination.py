@@ -0,0 +1,39 @@
+import os
+import json
+import base64
+from typing import Iterable, Optional
+from dotenv import load_dotenv
+load_dotenv()
+
+# items per page when the client doesn't ask for a size, and the most it may ask for
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", 100))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 1000))
+
+
+def encode_cursor(last_evaluated_key: Optional[dict]) -> Optional[str]:
+    """Turn a DynamoDB last_evaluated_key into an opaque cursor, None once there are no more pages."""
+    if not last_evaluated_key:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: Optional[str], key_attributes: Optional[Iterable[str]] = None) -> Optional[dict]:
+    """Inverse of encode_cursor. Raises ValueError for a cursor we didn't hand out.
+
+    With key_attributes, the cursor must hold exactly those string key attributes,
+    so a crafted cursor never reaches DynamoDB as ExclusiveStartKey.
+    """
+    if not cursor:
+        return None
+    try:
+        last_evaluated_key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(last_evaluated_key, dict):
+        raise ValueError("Invalid cursor")
+    if key_attributes is not None and not (
+        set(last_evaluated_key) == set(key_attributes)
+        and all(isinstance(value, dict) and list(value) == ["S"] and isinstance(value["S"], str) for value in last_evaluated_key.values())
+    ):
+        raise ValueError("Invalid cursor")
+    return last_evaluated_key
@@ -1,4 +1,28 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import bcrypt
+from dotenv import load_dotenv
+load_dotenv()
+
+# bcrypt releases the GIL, so a dedicated thread pool is enough to keep hashing off the request threadpool
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 2))
+# hashes queued or running before new ones are turned away
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", 64))
+# seconds a caller waits for its hash, queueing included
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", 5))
+
+
+class PasswordHashingBusy(Exception):
+    """The hashing pool is full or didn't get to the request in time."""
+
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="pwhash")
+_lock = threading.Lock()
+_stats = {"in_flight": 0, "completed": 0, "rejected": 0, "timeouts": 0, "wait_seconds": 0.0, "run_seconds": 0.0, "max_wait_seconds": 0.0}
+
 
 def hash_password(password: str) -> str:
     # Generate a salt and hash the password using bcrypt
@@ -9,4 +33,65 @@ def hash_password(password: str) -> str:
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     # Verify the plain password against the hashed password
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
\ No newline at end of file
+    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+def _timed(fn, submitted: float, *args):
+    started = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        finished = time.perf_counter()
+        with _lock:
+            _stats["completed"] += 1
+            _stats["wait_seconds"] += started - submitted
+            _stats["run_seconds"] += finished - started
+            _stats["max_wait_seconds"] = max(_stats["max_wait_seconds"], started - submitted)
+
+
+def _release(_future) -> None:
+    with _lock:
+        _stats["in_flight"] -= 1
+
+
+async def _run(fn, *args):
+    with _lock:
+        if _stats["in_flight"] >= PASSWORD_HASH_QUEUE_LIMIT:
+            _stats["rejected"] += 1
+            raise PasswordHashingBusy()
+        _stats["in_flight"] += 1
+    future = _executor.submit(_timed, fn, time.perf_counter(), *args)
+    # a slot is only freed once the work is really done, even if the caller gave up on it
+    future.add_done_callback(_release)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), PASSWORD_HASH_TIMEOUT)
+    except asyncio.TimeoutError:
+        with _lock:
+            _stats["timeouts"] += 1
+        raise PasswordHashingBusy()
+
+
+async def ahash_password(password: str) -> str:
+    """hash_password on the hashing pool. Raises PasswordHashingBusy when it is overloaded."""
+    return await _run(hash_password, password)
+
+
+async def averify_password(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the hashing pool. Raises PasswordHashingBusy when it is overloaded."""
+    return await _run(verify_password, plain_password, hashed_password)
+
+
+def stats() -> dict:
+    with _lock:
+        completed = _stats["completed"]
+        return {
+            "workers": PASSWORD_HASH_WORKERS,
+            "queue_limit": PASSWORD_HASH_QUEUE_LIMIT,
+            "in_flight": _stats["in_flight"],
+            "completed": completed,
+            "rejected": _stats["rejected"],
+            "timeouts": _stats["timeouts"],
+            "avg_wait_ms": _stats["wait_seconds"] / completed * 1000 if completed else 0.0,
+            "avg_run_ms": _stats["run_seconds"] / completed * 1000 if completed else 0.0,
+            "max_wait_ms": _stats["max_wait_seconds"] * 1000,
+        }
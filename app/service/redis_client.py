@@ -1,10 +1,103 @@
 import os
 import redis
+import redis.asyncio
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
+from redis.asyncio.retry import Retry as AsyncRetry
 from dotenv import load_dotenv
+
+from app.service.circuit_breaker import CircuitBreaker
 load_dotenv()
 
 
 redis_server = os.getenv("REDIS_SERVER")
 redis_password = os.getenv("REDIS_PASSWORD")
+# connect to a Redis Cluster through REDIS_SERVER as its startup node instead of a single node
+REDIS_CLUSTER = os.getenv("REDIS_CLUSTER", "false").lower() == "true"
+# connections per pool; once all are busy, callers wait up to REDIS_POOL_TIMEOUT seconds for a free one
+redis_max_connections = int(os.getenv("REDIS_MAX_CONNECTIONS", 100))
+redis_async_max_connections = int(os.getenv("REDIS_ASYNC_MAX_CONNECTIONS", 100))
+redis_pool_timeout = float(os.getenv("REDIS_POOL_TIMEOUT", 1))
+# seconds before a stalled connect or command fails instead of hanging the request
+redis_connect_timeout = float(os.getenv("REDIS_CONNECT_TIMEOUT", 1))
+redis_socket_timeout = float(os.getenv("REDIS_SOCKET_TIMEOUT", 1))
+# idle connections are pinged before reuse once they have been idle this many seconds
+redis_health_check_interval = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+# connection errors and timeouts are retried with exponential backoff between base and cap seconds
+redis_retries = int(os.getenv("REDIS_RETRIES", 2))
+redis_backoff_base = float(os.getenv("REDIS_BACKOFF_BASE", 0.008))
+redis_backoff_cap = float(os.getenv("REDIS_BACKOFF_CAP", 0.512))
+# consecutive failures that open the breaker, and seconds until it lets a probe through
+REDIS_BREAKER_FAILURE_THRESHOLD = int(os.getenv("REDIS_BREAKER_FAILURE_THRESHOLD", 5))
+REDIS_BREAKER_RESET_TIMEOUT = float(os.getenv("REDIS_BREAKER_RESET_TIMEOUT", 10))
+
+connection_kwargs = {
+    "host": redis_server,
+    "port": 6379,
+    "password": redis_password,
+    "socket_connect_timeout": redis_connect_timeout,
+    "socket_timeout": redis_socket_timeout,
+}
+
+if REDIS_CLUSTER:
+    # cluster clients keep a pool per node and follow slot moves on their own
+    redis_pool = async_redis_pool = None
+    redis_client = redis.RedisCluster(
+        max_connections=redis_max_connections,
+        retry=Retry(ExponentialBackoff(cap=redis_backoff_cap, base=redis_backoff_base), redis_retries),
+        **connection_kwargs,
+    )
+    # async client used by the event-loop handlers on the redirect and lookup hot path
+    async_redis_client = redis.asyncio.RedisCluster(
+        max_connections=redis_async_max_connections,
+        health_check_interval=redis_health_check_interval,
+        retry=AsyncRetry(ExponentialBackoff(cap=redis_backoff_cap, base=redis_backoff_base), redis_retries),
+        **connection_kwargs,
+    )
+else:
+    redis_pool = redis.BlockingConnectionPool(
+        max_connections=redis_max_connections,
+        timeout=redis_pool_timeout,
+        db=0,
+        health_check_interval=redis_health_check_interval,
+        retry=Retry(ExponentialBackoff(cap=redis_backoff_cap, base=redis_backoff_base), redis_retries),
+        **connection_kwargs,
+    )
+    redis_client = redis.StrictRedis(connection_pool=redis_pool)
+
+    # async client used by the event-loop handlers on the redirect and lookup hot path
+    async_redis_pool = redis.asyncio.BlockingConnectionPool(
+        max_connections=redis_async_max_connections,
+        timeout=redis_pool_timeout,
+        db=0,
+        health_check_interval=redis_health_check_interval,
+        retry=AsyncRetry(ExponentialBackoff(cap=redis_backoff_cap, base=redis_backoff_base), redis_retries),
+        **connection_kwargs,
+    )
+    async_redis_client = redis.asyncio.StrictRedis(connection_pool=async_redis_pool)
+
+# trips when Redis keeps failing, so the hot path goes straight to the database instead of waiting on it
+redis_breaker = CircuitBreaker(
+    "redis",
+    failure_threshold=REDIS_BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=REDIS_BREAKER_RESET_TIMEOUT,
+)
+
 
-redis_client = redis.StrictRedis(host=redis_server, port=6379, db=0, password=redis_password) 
\ No newline at end of file
+def pool_stats() -> dict:
+    """Connection usage of the sync and async pools of this worker."""
+    if REDIS_CLUSTER:
+        return {"cluster_nodes": len(redis_client.get_nodes()), "max_connections_per_node": redis_max_connections}
+    idle = sum(1 for connection in list(redis_pool.pool.queue) if connection is not None)
+    return {
+        "sync": {
+            "max_connections": redis_pool.max_connections,
+            "created": len(redis_pool._connections),
+            "in_use": len(redis_pool._connections) - idle,
+        },
+        "async": {
+            "max_connections": async_redis_pool.max_connections,
+            "created": len(async_redis_pool._available_connections) + len(async_redis_pool._in_use_connections),
+            "in_use": len(async_redis_pool._in_use_connections),
+        },
+    }
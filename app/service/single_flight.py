@@ -0,0 +1,143 @@
+import os
+import asyncio
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+from dotenv import load_dotenv
+from redis.exceptions import RedisError
+
+from app.service.redis_client import async_redis_client, redis_breaker
+from app.service.circuit_breaker import CircuitBreaker
+from app.service import cache_keys
+load_dotenv()
+
+# also coalesce across workers with a short Redis lock
+SINGLE_FLIGHT_REDIS_LOCK = os.getenv("SINGLE_FLIGHT_REDIS_LOCK", "false").lower() == "true"
+SINGLE_FLIGHT_LOCK_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_LOCK_TIMEOUT", 2))
+# how long a worker that lost the lock polls the cache before fetching itself
+SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT", 0.2))
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", 0.02))
+
+
+class _LockUnavailable(Exception):
+    """Redis failed or its breaker is open, so there is no lock to coordinate on."""
+
+
+class SingleFlight:
+    """Coalesce concurrent fetches of the same key into one in-flight fetch per worker.
+
+    The first caller for a key runs the fetch, later callers await its result. With a
+    Redis client, the fetching worker also takes a short lock so workers that lose
+    the race poll `peek` (normally the cache the winner fills) instead of fetching too.
+    The lock calls go through `breaker`: while Redis is unhealthy, callers fetch without the lock.
+    """
+
+    def __init__(self, name: str, redis_client=None, lock_timeout: float = 2, wait_timeout: float = 0.2, poll_interval: float = 0.02,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.redis_client = redis_client
+        self.breaker = breaker
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.fetches = 0
+        self.coalesced = 0
+        self.lock_waits = 0
+        self.lock_wait_hits = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fetch: Callable[[], Awaitable[Any]], peek: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+        """Return fetch() for key, sharing one call among all concurrent callers."""
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # the fetch runs in a task of its own, so a cancelled first caller
+            # (e.g. a client that disconnected) doesn't cancel it for the others
+            task = asyncio.ensure_future(self._fetch_once(key, fetch, peek))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        # shield so a cancelled caller only stops waiting
+        return await asyncio.shield(task)
+
+    def _finished(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # every caller may have gone, don't warn that nobody retrieved the exception
+            task.exception()
+
+    async def _fetch_once(self, key: str, fetch, peek):
+        if self.redis_client is None:
+            self.fetches += 1
+            return await fetch()
+
+        lock_key = cache_keys.lock_key(self.name, key)
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self._lock_call(lambda: self.redis_client.set(lock_key, token, nx=True, px=int(self.lock_timeout * 1000)))
+        except _LockUnavailable:
+            # the lock only saves database reads, never fail the request over it
+            self.fetches += 1
+            return await fetch()
+        if not acquired:
+            # another worker is fetching, give it a moment to fill the cache
+            self.lock_waits += 1
+            for _ in range(int(self.wait_timeout / self.poll_interval)):
+                await asyncio.sleep(self.poll_interval)
+                result = await peek() if peek else None
+                if result is not None:
+                    self.lock_wait_hits += 1
+                    return result
+            self.fetches += 1
+            return await fetch()
+
+        try:
+            self.fetches += 1
+            return await fetch()
+        finally:
+            # only release the lock if it is still ours
+            try:
+                if await self._lock_call(lambda: self.redis_client.get(lock_key)) == token.encode("utf-8"):
+                    await self._lock_call(lambda: self.redis_client.delete(lock_key))
+            except _LockUnavailable:
+                # it expires after lock_timeout on its own
+                pass
+
+    async def _lock_call(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Run a lock call through the breaker. Raises _LockUnavailable if Redis failed or the breaker is open."""
+        if self.breaker is not None and not self.breaker.allow():
+            raise _LockUnavailable()
+        try:
+            result = await call()
+        except RedisError as e:
+            if self.breaker is not None:
+                self.breaker.record_failure()
+            raise _LockUnavailable() from e
+        except BaseException:
+            # cancelled or failed on our side, says nothing about Redis
+            if self.breaker is not None:
+                self.breaker.release()
+            raise
+        if self.breaker is not None:
+            self.breaker.record_success()
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "fetches": self.fetches,
+            "coalesced": self.coalesced,
+            "lock_waits": self.lock_waits,
+            "lock_wait_hits": self.lock_wait_hits,
+            "in_flight": len(self._inflight),
+        }
+
+
+# database reads for short URLs missing from the cache
+url_fetches = SingleFlight(
+    "url-fetch",
+    redis_client=async_redis_client if SINGLE_FLIGHT_REDIS_LOCK else None,
+    lock_timeout=SINGLE_FLIGHT_LOCK_TIMEOUT,
+    wait_timeout=SINGLE_FLIGHT_WAIT_TIMEOUT,
+    poll_interval=SINGLE_FLIGHT_POLL_INTERVAL,
+    breaker=redis_breaker,
+)
@@ -0,0 +1,312 @@
+import os
+import time
+import zlib
+import random
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from redis.exceptions import RedisError
+
+from app.service.redis_client import redis_client, async_redis_client, redis_breaker, REDIS_CLUSTER
+from app.service.cache_keys import url_key, url_bucket_key
+from app.service.local_cache import LocalCache
+from app.service import invalidation, codec
+load_dotenv()
+
+expiration_time = int(os.getenv("CACHE_EXPIRE_TIME", 3600))
+# every TTL is stretched by a random share of up to this fraction so keys cached together don't expire together
+CACHE_TTL_JITTER = float(os.getenv("CACHE_TTL_JITTER", 0.1))
+# a Redis hit inside the last fraction of the TTL refreshes the key in the background
+CACHE_REFRESH_AHEAD = float(os.getenv("CACHE_REFRESH_AHEAD", 0.1))
+
+# in-process (L1) cache settings, checked before Redis on every lookup
+L1_CACHE_SIZE = int(os.getenv("L1_CACHE_SIZE", 10000))
+L1_CACHE_TTL = float(os.getenv("L1_CACHE_TTL", 30))
+# negative cache of short URLs the database just reported as missing
+NEGATIVE_CACHE_SIZE = int(os.getenv("NEGATIVE_CACHE_SIZE", 100000))
+NEGATIVE_CACHE_TTL = float(os.getenv("NEGATIVE_CACHE_TTL", 60))
+URL_INVALIDATION_CHANNEL = os.getenv("URL_INVALIDATION_CHANNEL", "url-invalidations")
+
+# "keys" caches every mapping under its own key, "buckets" groups them into small hashes, which
+# Redis stores as compact listpacks and so saves most of the per-key overhead
+CACHE_LAYOUT = os.getenv("CACHE_LAYOUT", "keys")
+# keep buckets under hash-max-listpack-entries (128 by default): about cached links / 100
+CACHE_BUCKETS = int(os.getenv("CACHE_BUCKETS", 65536))
+# "true" expires each mapping on its own with HEXPIRE (Redis 7.4+), "false" rotates every bucket through
+# generations of one TTL instead (see _generation), "auto" picks HEXPIRE when the server supports it
+CACHE_BUCKET_FIELD_TTL = os.getenv("CACHE_BUCKET_FIELD_TTL", "auto").lower()
+
+url_l1_cache = LocalCache(maxsize=L1_CACHE_SIZE, ttl=L1_CACHE_TTL)
+url_negative_cache = LocalCache(maxsize=NEGATIVE_CACHE_SIZE, ttl=NEGATIVE_CACHE_TTL)
+
+# background refreshes are kept referenced until they finish
+_refresh_tasks = set()
+# whether buckets use HEXPIRE, settled by detect_bucket_field_ttl() in "auto" mode
+_bucket_field_ttl = CACHE_BUCKET_FIELD_TTL == "true"
+
+
+def cache_ttl() -> int:
+    """TTL in seconds for a new cache entry, with random jitter added."""
+    return expiration_time + random.randint(0, int(expiration_time * CACHE_TTL_JITTER))
+
+
+def detect_bucket_field_ttl() -> bool:
+    """Settle whether buckets use HEXPIRE, from the server version in "auto" mode. Runs once at startup."""
+    global _bucket_field_ttl
+    if CACHE_LAYOUT != "buckets" or CACHE_BUCKET_FIELD_TTL != "auto":
+        return _bucket_field_ttl
+    try:
+        info = redis_client.info("server")
+        # a cluster client answers for every node, all of them must support it
+        versions = [info["redis_version"]] if "redis_version" in info else [node["redis_version"] for node in info.values()]
+        _bucket_field_ttl = min(tuple(int(part) for part in version.split(".")[:2]) for version in versions) >= (7, 4)
+    except (RedisError, KeyError, ValueError) as e:
+        print(f"Checking Redis for HEXPIRE failed, cache buckets expire by generation: {e}")
+    return _bucket_field_ttl
+
+
+def _bucket(short_url: str) -> int:
+    return zlib.crc32(short_url.encode("utf-8")) % CACHE_BUCKETS
+
+
+def _generation(bucket: int) -> Tuple[int, float]:
+    """Current generation of a bucket and the seconds until it ends.
+
+    Without HEXPIRE a bucket can only expire as a whole. Each bucket is therefore kept as
+    one hash per generation of expiration_time seconds: writes go to the current one, reads
+    check it and the previous one, and each generation's hash expires when the next one
+    ends. A mapping stays cached for one to two TTLs and hot ones are refreshed into the
+    current generation, so memory follows the working set instead of every link ever cached.
+    """
+    # each bucket is offset, so generations don't all end at the same moment
+    shifted = time.time() + bucket * expiration_time / CACHE_BUCKETS
+    return int(shifted // expiration_time), expiration_time - shifted % expiration_time
+
+
+def bucket_key(short_url: str) -> str:
+    """Hash that new writes of short_url go to in the "buckets" layout."""
+    bucket = _bucket(short_url)
+    if _bucket_field_ttl:
+        return url_bucket_key(bucket)
+    return url_bucket_key(bucket, _generation(bucket)[0])
+
+
+def _bucket_keys(short_url: str) -> List[str]:
+    """Every hash short_url may be cached in, newest first."""
+    bucket = _bucket(short_url)
+    if _bucket_field_ttl:
+        return [url_bucket_key(bucket)]
+    generation = _generation(bucket)[0]
+    return [url_bucket_key(bucket, generation), url_bucket_key(bucket, generation - 1)]
+
+
+def _queue_read(pipe, short_url: str) -> None:
+    """Add the two reads for a cached value and its remaining TTL to a pipeline, see _read_result."""
+    if CACHE_LAYOUT != "buckets":
+        pipe.get(url_key(short_url))
+        pipe.ttl(url_key(short_url))
+    elif _bucket_field_ttl:
+        pipe.hget(url_bucket_key(_bucket(short_url)), short_url)
+        pipe.execute_command("HTTL", url_bucket_key(_bucket(short_url)), "FIELDS", 1, short_url)
+    else:
+        for key in _bucket_keys(short_url):
+            pipe.hget(key, short_url)
+
+
+def _read_result(first: Any, second: Any) -> Tuple[Optional[bytes], int]:
+    """Cached value and remaining TTL from the replies of _queue_read."""
+    if CACHE_LAYOUT != "buckets":
+        return first, second
+    if _bucket_field_ttl:
+        # HTTL answers per field
+        return first, second[0] if isinstance(second, list) else second
+    # found in the current generation it has a while to go, in the previous one it is about to expire
+    if isinstance(first, bytes) and first:
+        return first, -1
+    if isinstance(second, bytes) and second:
+        return second, 0
+    return None, -2
+
+
+def _queue_delete(pipe, short_url: str) -> None:
+    if CACHE_LAYOUT != "buckets":
+        pipe.delete(url_key(short_url))
+        return
+    for key in _bucket_keys(short_url):
+        pipe.hdel(key, short_url)
+
+
+async def _guarded(call: Callable[[], Awaitable], fallback: Any = None) -> Any:
+    """Run a Redis call on the hot path through the breaker, fallback if Redis fails or the breaker is open.
+
+    The callers treat the fallback as a cache miss, so requests go to the database
+    while Redis is unhealthy instead of waiting on it.
+    """
+    if not redis_breaker.allow():
+        return fallback
+    try:
+        result = await call()
+    except RedisError:
+        redis_breaker.record_failure()
+        return fallback
+    except BaseException:
+        # cancelled or failed on our side, says nothing about Redis
+        redis_breaker.release()
+        raise
+    redis_breaker.record_success()
+    return result
+
+
+async def aget_long_url(short_url: str, refresh: Optional[Callable[[], Awaitable]] = None) -> Optional[str]:
+    """Return the cached long URL for short_url from L1 or Redis, or None on a miss.
+
+    If refresh is given and the Redis entry is about to expire, refresh() is started
+    in the background so hot keys are reloaded before they drop out of the cache.
+    """
+    long_url = url_l1_cache.get(short_url)
+    if long_url is not None:
+        return long_url
+
+    pipe = async_redis_client.pipeline(transaction=False)
+    _queue_read(pipe, short_url)
+    # the fallback reads as a miss in every layout, the second reply is a TTL in some and a value in others
+    cached, ttl = _read_result(*await _guarded(pipe.execute, fallback=(None, None)))
+    if not cached:
+        return None
+    if refresh is not None and 0 <= ttl < expiration_time * CACHE_REFRESH_AHEAD:
+        task = asyncio.ensure_future(refresh())
+        _refresh_tasks.add(task)
+        task.add_done_callback(_refresh_tasks.discard)
+    long_url = codec.decode_long_url(cached)
+    url_l1_cache.set(short_url, long_url)
+    return long_url
+
+
+async def aget_long_urls(short_urls: List[str]) -> Dict[str, str]:
+    """Bulk version of aget_long_url, the cached long URLs among short_urls from L1 and a single MGET."""
+    long_urls, misses = {}, []
+    for short_url in short_urls:
+        long_url = url_l1_cache.get(short_url)
+        if long_url is not None:
+            long_urls[short_url] = long_url
+        else:
+            misses.append(short_url)
+    if not misses:
+        return long_urls
+
+    if CACHE_LAYOUT == "buckets":
+        # the fields are spread over many buckets, their reads go out in a single pipeline
+        pipe = async_redis_client.pipeline(transaction=False)
+        for short_url in misses:
+            _queue_read(pipe, short_url)
+        replies = await _guarded(pipe.execute, fallback=[None] * 2 * len(misses))
+        cached_values = [_read_result(first, second)[0] for first, second in zip(replies[::2], replies[1::2])]
+    else:
+        keys = [url_key(short_url) for short_url in misses]
+        # the keys hash to different slots, a cluster client has to split the MGET up per node
+        mget = async_redis_client.mget_nonatomic if REDIS_CLUSTER else async_redis_client.mget
+        cached_values = await _guarded(lambda: mget(keys), fallback=[None] * len(misses))
+    for short_url, cached in zip(misses, cached_values):
+        if cached:
+            long_urls[short_url] = codec.decode_long_url(cached)
+            url_l1_cache.set(short_url, long_urls[short_url])
+    return long_urls
+
+
+def is_known_missing(short_url: str) -> bool:
+    """True if the database recently reported short_url as missing."""
+    return url_negative_cache.get(short_url) is not None
+
+
+def mark_missing(short_url: str) -> None:
+    """Remember that short_url is not in the database so repeated lookups skip it."""
+    url_negative_cache.set(short_url, True)
+
+
+def cache_long_url(short_url: str, long_url: str) -> None:
+    """Cache a mapping that was just read from the database."""
+    pipe = redis_client.pipeline(transaction=False)
+    queue_long_url(pipe, short_url, long_url)
+    pipe.execute()
+    url_l1_cache.set(short_url, long_url)
+
+
+async def acache_long_url(short_url: str, long_url: str) -> None:
+    """Async version of cache_long_url for handlers running on the event loop."""
+    if CACHE_LAYOUT == "buckets":
+        pipe = async_redis_client.pipeline(transaction=False)
+        queue_long_url(pipe, short_url, long_url)
+        await _guarded(pipe.execute)
+    else:
+        await _guarded(lambda: async_redis_client.setex(url_key(short_url), cache_ttl(), codec.encode_long_url(long_url)))
+    url_l1_cache.set(short_url, long_url)
+
+
+async def acache_long_urls(mappings: Dict[str, str]) -> None:
+    """Bulk version of acache_long_url, all writes go out in one pipeline."""
+    pipe = async_redis_client.pipeline(transaction=False)
+    for short_url, long_url in mappings.items():
+        queue_long_url(pipe, short_url, long_url)
+        url_l1_cache.set(short_url, long_url)
+    await _guarded(pipe.execute)
+
+
+def queue_long_url(pipe, short_url: str, long_url: str) -> None:
+    """Add the Redis write for a mapping to a pipeline, for loading many mappings at once."""
+    if CACHE_LAYOUT != "buckets":
+        pipe.setex(url_key(short_url), cache_ttl(), codec.encode_long_url(long_url))
+        return
+    key = bucket_key(short_url)
+    pipe.hset(key, short_url, codec.encode_long_url(long_url))
+    if _bucket_field_ttl:
+        pipe.execute_command("HEXPIRE", key, cache_ttl(), "FIELDS", 1, short_url)
+    else:
+        # the generation's hash lives until the next generation ends, the same for every write to it
+        pipe.expire(key, int(_generation(_bucket(short_url))[1]) + expiration_time + 1)
+
+
+def set_long_url(short_url: str, long_url: str) -> None:
+    """Cache a mapping that was just created and tell other workers about it."""
+    url_negative_cache.delete(short_url)
+    cache_long_url(short_url, long_url)
+    invalidation.publish(URL_INVALIDATION_CHANNEL, short_url)
+
+
+def set_long_urls(mappings: Dict[str, str]) -> None:
+    """Bulk version of set_long_url, the writes and invalidations all go out in one pipeline."""
+    pipe = redis_client.pipeline(transaction=False)
+    for short_url, long_url in mappings.items():
+        url_negative_cache.delete(short_url)
+        queue_long_url(pipe, short_url, long_url)
+        invalidation.queue_publish(pipe, URL_INVALIDATION_CHANNEL, short_url)
+        url_l1_cache.set(short_url, long_url)
+    pipe.execute()
+
+
+def evict_long_url(short_url: str) -> None:
+    """Remove a mapping from Redis and from the L1 cache of every worker."""
+    pipe = redis_client.pipeline(transaction=False)
+    _queue_delete(pipe, short_url)
+    pipe.execute()
+    url_l1_cache.delete(short_url)
+    invalidation.publish(URL_INVALIDATION_CHANNEL, short_url)
+
+
+def evict_long_urls(short_urls: List[str]) -> None:
+    """Bulk version of evict_long_url, the deletes and invalidations all go out in one pipeline."""
+    pipe = redis_client.pipeline(transaction=False)
+    for short_url in short_urls:
+        # one command per mapping, the keys hash to different cluster slots
+        _queue_delete(pipe, short_url)
+        url_l1_cache.delete(short_url)
+        invalidation.queue_publish(pipe, URL_INVALIDATION_CHANNEL, short_url)
+    pipe.execute()
+
+
+def drop_local(short_url: str) -> None:
+    """Forget everything this worker knows about short_url."""
+    url_l1_cache.delete(short_url)
+    url_negative_cache.delete(short_url)
+
+
+invalidation.register_handler(URL_INVALIDATION_CHANNEL, drop_local)
@@ -0,0 +1,94 @@
+import os
+from typing import List, Optional, Tuple
+from dotenv import load_dotenv
+from pynamodb.exceptions import UpdateError
+from redis.exceptions import WatchError
+
+from app.models.database import Urls, Users
+from app.service.redis_client import redis_client
+from app.service import user_cache, cache_keys
+load_dotenv()
+
+# quota checks count the creator index once, then creates and deletes move the cached count
+URL_COUNT_CACHE_TTL = int(os.getenv("URL_COUNT_CACHE_TTL", 300))
+
+
+def _count_key(email: str) -> str:
+    return cache_keys.url_count_key(email)
+
+
+def list_cache_key(email: str) -> str:
+    """Key of the cached first page of the user's URL list."""
+    return cache_keys.url_list_key(email)
+
+
+def count_user_urls(email: str) -> int:
+    """Number of URL pairs created by the user."""
+    cached = redis_client.get(_count_key(email))
+    if cached is not None:
+        return int(cached)
+    count = Urls.creator_index.count(email)
+    redis_client.setex(_count_key(email), URL_COUNT_CACHE_TTL, count)
+    return count
+
+
+def list_user_urls(email: str, limit: int, last_evaluated_key: Optional[dict] = None) -> Tuple[List[dict], Optional[dict]]:
+    """One page of the user's URL pairs and the key to continue from, None on the last page."""
+    results = Urls.creator_index.query(email, limit=limit, last_evaluated_key=last_evaluated_key)
+    urls = [{"short_url": url_pair.short_url, "long_url": url_pair.long_url} for url_pair in results]
+    return urls, results.last_evaluated_key
+
+
+def adjust_user_urls(email: str, delta: int) -> None:
+    """Move the cached URL count of a user by delta after they created or deleted URLs, and drop their cached URL list.
+
+    Only a cached count is moved. A missing one stays missing, so the next quota check counts the index again.
+    """
+    key = _count_key(email)
+    with redis_client.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(key)
+                if pipe.exists(key):
+                    pipe.multi()
+                    pipe.incrby(key, delta)
+                    pipe.execute()
+                else:
+                    pipe.unwatch()
+                break
+            except WatchError:
+                # another create or delete moved the count first, or it expired
+                continue
+    redis_client.delete(list_cache_key(email))
+
+
+def invalidate_user_urls(email: str) -> None:
+    """Drop the cached URL count and URL list of a user, for changes that are not single creates or deletes."""
+    redis_client.delete(_count_key(email), list_cache_key(email))
+
+
+def migrate_user_urls() -> dict:
+    """Backfill `creator_email` on URL pairs from the legacy `Users.urls` lists, then drop the lists.
+
+    Ownership is read from the creator index, so the app keeps serving while this runs.
+    A pair that already has a creator is left alone, and a user is only done once their
+    list is removed, so an interrupted migration can simply be run again.
+    """
+    users = backfilled = 0
+    for user in Users.scan(filter_condition=Users.urls.exists()):
+        for short_url, _ in user.urls or []:
+            try:
+                Urls(short_url=short_url).update(
+                    actions=[Urls.creator_email.set(user.email)],
+                    condition=Urls.short_url.exists() & (Urls.creator_email.does_not_exist() | (Urls.creator_email == "")),
+                )
+                backfilled += 1
+            except UpdateError as e:
+                # deleted since, or already owned
+                if e.cause_response_code != "ConditionalCheckFailedException":
+                    raise
+        user.update(actions=[Users.urls.remove()])
+        user_cache.invalidate_user(user.email)
+        invalidate_user_urls(user.email)
+        users += 1
+    return {"users": users, "urls_backfilled": backfilled}
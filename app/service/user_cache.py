@@ -0,0 +1,78 @@
+import os
+from typing import Optional
+from dotenv import load_dotenv
+from pynamodb.exceptions import DoesNotExist
+
+from app.models.database import Users
+from app.service.redis_client import redis_client
+from app.service.cache_keys import user_key
+from app.service.local_cache import LocalCache
+from app.service import invalidation, codec
+load_dotenv()
+
+# authenticated user records are cached briefly in process and a little longer in Redis
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 30))
+USER_REDIS_CACHE_TTL = int(os.getenv("USER_REDIS_CACHE_TTL", 300))
+USER_INVALIDATION_CHANNEL = os.getenv("USER_INVALIDATION_CHANNEL", "user-invalidations")
+
+user_l1_cache = LocalCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+redis_stats = {"hits": 0, "misses": 0}
+
+
+def _cacheable(user: Users) -> dict:
+    # the cache is readable by more than the users table, keep password hashes out of it
+    data = user.to_simple_dict()
+    data.pop("password_hash", None)
+    return data
+
+
+def _from_cached(data: dict) -> Users:
+    # every caller gets its own instance, but it lacks the password hash: treat it as read-only,
+    # save() would fail on the missing attribute, writes go through update() with explicit actions
+    user = Users()
+    user.from_simple_dict(data)
+    return user
+
+
+def get_user(email: str) -> Optional[Users]:
+    """Return the user with this email from the process cache, Redis, or the database.
+
+    The returned record has no password hash, read the user from the database to check or change it.
+    """
+    data = user_l1_cache.get(email)
+    if data is not None:
+        return _from_cached(data)
+
+    cached = redis_client.get(user_key(email))
+    if cached:
+        redis_stats["hits"] += 1
+        data = codec.decode_object(cached)
+        # entries cached by older versions still carry it
+        data.pop("password_hash", None)
+        user_l1_cache.set(email, data)
+        return _from_cached(data)
+    redis_stats["misses"] += 1
+
+    try:
+        user = Users.get(email)
+    except DoesNotExist:
+        return None
+    data = _cacheable(user)
+    redis_client.setex(user_key(email), USER_REDIS_CACHE_TTL, codec.encode_object(data))
+    user_l1_cache.set(email, data)
+    return _from_cached(data)
+
+
+def invalidate_user(email: str) -> None:
+    """Drop every cached copy of a user after their record was saved."""
+    redis_client.delete(user_key(email))
+    user_l1_cache.delete(email)
+    invalidation.publish(USER_INVALIDATION_CHANNEL, email)
+
+
+def stats() -> dict:
+    return {**user_l1_cache.stats(), "redis_hits": redis_stats["hits"], "redis_misses": redis_stats["misses"]}
+
+
+invalidation.register_handler(USER_INVALIDATION_CHANNEL, user_l1_cache.delete)
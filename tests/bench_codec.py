@@ -0,0 +1,140 @@
+"""Benchmark of the cache value formats and layouts.
+
+Measures the Redis memory a million cached links take in the plain and compact
+formats, each with one key per link and with the hash-bucketed layout, and what
+encoding and decoding one long URL costs on the redirect path.
+The links are synthetic, a mix of short ones and long ones with tracking parameters.
+Memory is the growth of used_memory (INFO memory) while the links are loaded, so run
+it against a scratch Redis server nothing else writes to. The keys it writes are
+deleted again after each measurement:
+
+    python tests/bench_codec.py --host localhost --links 20000
+"""
+import os
+import sys
+DIR = os.path.dirname(os.path.dirname(__file__))  # The repo root directory
+sys.path.append(DIR)  # Temporarily add the repo root to sys.path so the 'src' module can be imported
+
+import time
+import random
+import string
+import argparse
+import redis
+from app.service import codec, url_cache
+from app.service.cache_keys import url_key
+
+DOMAINS = ["www.amazon.com", "www.youtube.com", "news.example.org", "blog.example.io", "shop.example.net"]
+PATHS = ["/dp/", "/watch?v=", "/article/", "/blog/2026/", "/product/item/"]
+TRACKING = [
+    "utm_source=newsletter&utm_medium=email&utm_campaign=",
+    "utm_source=facebook&utm_medium=social&utm_campaign=",
+    "utm_source=twitter&utm_medium=social&fbclid=",
+    "gclid=",
+    "ref=share&ref_src=twsrc%5Etfw&s=20&t=",
+]
+
+
+def random_token(length: int) -> str:
+    return "".join(random.choices(string.ascii_letters + string.digits, k=length))
+
+
+def make_links(count: int):
+    rng_state = random.getstate()
+    random.seed(42)
+    links = []
+    for _ in range(count):
+        url = "https://" + random.choice(DOMAINS) + random.choice(PATHS) + random_token(random.randint(6, 24))
+        if random.random() < 0.7:
+            separator = "&" if "?" in url else "?"
+            url += separator + random.choice(TRACKING) + random_token(random.randint(8, 40))
+        links.append((random_token(11), url))
+    random.setstate(rng_state)
+    return links
+
+
+def used_memory(client) -> int:
+    return client.info("memory")["used_memory"]
+
+
+def load(client, links, layout: str, field_ttl: bool = False, copies: int = 1) -> set:
+    """Cache links the way the app does in a layout, returns the keys written.
+
+    copies=2 also writes every bucketed link to the previous generation, the most
+    generation buckets can hold while a hot link is refreshed into the current one.
+    """
+    url_cache.CACHE_LAYOUT = layout
+    url_cache._bucket_field_ttl = field_ttl
+    keys = set()
+    for start in range(0, len(links), 1000):
+        pipe = client.pipeline(transaction=False)
+        for short_url, long_url in links[start:start + 1000]:
+            url_cache.queue_long_url(pipe, short_url, long_url)
+            if layout != "buckets":
+                keys.add(url_key(short_url))
+                continue
+            keys.add(url_cache.bucket_key(short_url))
+            if copies == 2:
+                previous = url_cache._bucket_keys(short_url)[1]
+                pipe.hset(previous, short_url, codec.encode_long_url(long_url))
+                pipe.expire(previous, url_cache.expiration_time)
+                keys.add(previous)
+        pipe.execute()
+    return keys
+
+
+def measure_memory(client, links, **kwargs) -> float:
+    """Growth of used_memory in bytes per link while loading links, see load."""
+    before = used_memory(client)
+    keys = load(client, links, **kwargs)
+    grown = used_memory(client) - before
+    keys = list(keys)
+    for start in range(0, len(keys), 1000):
+        client.delete(*keys[start:start + 1000])
+    return grown / len(links)
+
+
+def measure(value_format, links, client, hexpire):
+    encoded = [codec.encode_long_url(long_url, value_format) for _, long_url in links]
+    values = [value if isinstance(value, bytes) else value.encode("utf-8") for value in encoded]
+
+    start = time.perf_counter()
+    for _, long_url in links:
+        codec.encode_long_url(long_url, value_format)
+    encode_us = (time.perf_counter() - start) / len(links) * 1e6
+
+    start = time.perf_counter()
+    for value in values:
+        codec.decode_long_url(value)
+    decode_us = (time.perf_counter() - start) / len(links) * 1e6
+
+    value_bytes = sum(len(value) for value in values) / len(links)
+    print(f"{value_format:<8} {value_bytes:>8.1f} B/value {encode_us:>8.2f} us encode {decode_us:>8.2f} us decode")
+    layouts = [
+        ("keys", {"layout": "keys"}),
+        ("buckets, one generation", {"layout": "buckets"}),
+        ("buckets, two generations", {"layout": "buckets", "copies": 2}),
+    ]
+    if hexpire:
+        layouts.append(("buckets, HEXPIRE", {"layout": "buckets", "field_ttl": True}))
+    for name, kwargs in layouts:
+        print(f"  {name:<26} {measure_memory(client, links, **kwargs) * 1e6 / 2**20:>10.1f} MiB/1M links")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--links", type=int, default=20000)
+    parser.add_argument("--host", default=os.getenv("REDIS_SERVER", "localhost"))
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--db", type=int, default=15)
+    args = parser.parse_args()
+
+    client = redis.StrictRedis(host=args.host, port=args.port, db=args.db, password=os.getenv("REDIS_PASSWORD"))
+    version = tuple(int(part) for part in client.info("server")["redis_version"].split(".")[:2])
+    # about 100 links per bucket, as the README recommends, so buckets stay listpacks
+    url_cache.CACHE_BUCKETS = max(1, args.links // 100)
+
+    links = make_links(args.links)
+    print(f"{args.links} links, {sum(len(long_url) for _, long_url in links) / len(links):.1f} bytes per long URL on average")
+    for value_format in ["plain", "compact"]:
+        codec.CACHE_VALUE_FORMAT = value_format
+        measure(value_format, links, client, hexpire=version >= (7, 4))
@@ -0,0 +1,51 @@
+"""Throughput benchmark for the redirect endpoint.
+
+Fires CONCURRENCY simultaneous /redirect requests at a running server and reports
+requests per second and latency percentiles. Run it against a build with the old
+threadpool handlers and against the current one to compare:
+
+    python tests/bench_redirect.py http://localhost:8000 Soijwf09wf0i --concurrency 2000 --requests 50000
+"""
+import time
+import asyncio
+import argparse
+import httpx
+
+
+async def worker(client, shorturl, remaining, latencies, errors):
+    while remaining:
+        remaining.pop()
+        start = time.perf_counter()
+        try:
+            response = await client.get(f"/redirect/{shorturl}", follow_redirects=False)
+            if response.status_code != 307:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(server_url, shorturl, concurrency, total_requests):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    remaining = list(range(total_requests))
+    latencies, errors = [], []
+    async with httpx.AsyncClient(base_url=server_url, limits=limits, timeout=30) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client, shorturl, remaining, latencies, errors) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"requests:    {len(latencies)} ({len(errors)} errors) with concurrency {concurrency}")
+    print(f"throughput:  {len(latencies) / elapsed:.0f} req/s")
+    print(f"latency p50: {latencies[len(latencies) // 2] * 1000:.1f} ms")
+    print(f"latency p99: {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("server_url")
+    parser.add_argument("shorturl")
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(run(args.server_url, args.shorturl, args.concurrency, args.requests))
@@ -1,10 +1,17 @@
+import os
+import time
 import random
 from locust import HttpUser, task, between
 from requests.exceptions import RequestException
 
+# refresh a little before the server's ACCESS_TOKEN_EXPIRE_MINUTES runs out
+TOKEN_REFRESH_SECONDS = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30)) * 60 - 60
+
 class WebsiteUser(HttpUser):
     wait_time = between(3, 6)
     jwt_token = None
+    refresh_token = None
+    token_issued_at = 0
     short_urls = ["Soijwf09wf0i", "zxmVzqvYj893_i7", "adofijwef98w"]
 
     def on_start(self):
@@ -18,10 +25,25 @@ class WebsiteUser(HttpUser):
         try:
             response = self.client.post("/login", data=form_data)
             response.raise_for_status()  # Raise exception for non-2xx responses
-            self.jwt_token = response.json().get("access_token")
+            self.store_tokens(response.json())
         except RequestException as e:
             self.log_error("Login failed", e)
 
+    def refresh(self):
+        # a refresh is an HMAC check and a Redis delete, a login is a bcrypt verification
+        try:
+            response = self.client.post("/token/refresh", json={"refresh_token": self.refresh_token})
+            response.raise_for_status()  # Raise exception for non-2xx responses
+            self.store_tokens(response.json())
+        except RequestException as e:
+            self.log_error("Token refresh failed", e)
+            self.login()
+
+    def store_tokens(self, tokens):
+        self.jwt_token = tokens.get("access_token")
+        self.refresh_token = tokens.get("refresh_token")
+        self.token_issued_at = time.time()
+
     @task(5)
     def load_list_my_urls(self):
         try:
@@ -40,6 +62,8 @@ class WebsiteUser(HttpUser):
             new_password_data = {"password": "Password2"}
             response = self.client.patch("/change_password", json=new_password_data, headers=headers)
             response.raise_for_status()  # Raise exception for non-2xx responses
+            # changing the password revokes the refresh token
+            self.refresh_token = None
         except RequestException as e:
             self.log_error("Failed to change password", e)
 
@@ -64,7 +88,12 @@ class WebsiteUser(HttpUser):
     def ensure_jwt_token(self):
         if not self.jwt_token:
             self.log_error("JWT token not available")
-            self.login()  # Retry login if token is missing or expired
+            self.login()  # Retry login if token is missing
+        elif time.time() - self.token_issued_at > TOKEN_REFRESH_SECONDS:
+            if self.refresh_token:
+                self.refresh()
+            else:
+                self.login()
 
     def log_error(self, message, exception=None):
         if exception:
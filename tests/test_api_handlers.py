@@ -6,16 +6,27 @@ DIR = os.path.dirname(os.path.dirname(__file__))  # The repo root directory
 sys.path.append(DIR)  # Temporarily add the repo root to sys.path so the 'src' module can be imported
 
 
+import asyncio
+import gzip
+import json
+import tempfile
 import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
 import boto3
 from moto import mock_aws
-from fastapi import HTTPException
+from fastapi import BackgroundTasks, HTTPException
 
-from app.api import url_handlers, admin_handlers, user_handlers
+from app.api import url_handlers, admin_handlers, user_handlers, api_handlers
 from app.models.schemas import longURL, shortURL, Email, Password
 from app.service.pwhashing import hash_password
-from app.auth.auth import authenticate_user
+from app.auth import auth
+from app.auth.auth import authenticate_user, create_access_token, get_current_user, get_current_claims
 from app.models import schemas
+from app.service import url_cache, access_tracker, user_cache, url_ownership
+from app.service.bloom_filter import shortcode_filter
+from app.service.idgenerator import range_allocator
+from app.service import cache_population, export, code_pool, cache_keys
+from app.service.pagination import encode_cursor
 
 @mock_aws
 class TestAPI(unittest.TestCase):
@@ -78,11 +89,25 @@ class TestAPI(unittest.TestCase):
                 batch.put_item(Item=data)
         
         # Store the original Redis client get method
-        self.redis_client_get_original = url_handlers.redis_client.get
+        self.redis_client_get_original = url_cache.redis_client.get
         # Mock Redis client methods for cache bypass
-        url_handlers.redis_client.get = lambda key: None  # Simulate cache miss for all keys
-        self.redis_client_exists_original = url_handlers.redis_client.exists
-        url_handlers.redis_client.exists = lambda key: None
+        url_cache.redis_client.get = lambda key: None  # Simulate cache miss for all keys
+        self.redis_client_exists_original = url_cache.redis_client.exists
+        url_cache.redis_client.exists = lambda key: None
+        # Mock the async Redis client used by the redirect and lookup handlers
+        self.async_redis_client_pipeline_original = url_cache.async_redis_client.pipeline
+        self.async_redis_client_setex_original = url_cache.async_redis_client.setex
+        self.async_redis_client_mget_original = url_cache.async_redis_client.mget
+        # GET and TTL are pipelined together, simulate a cache miss for all keys
+        self.async_redis_pipeline = MagicMock()
+        self.async_redis_pipeline.execute = AsyncMock(return_value=[None, -2])
+        url_cache.async_redis_client.pipeline = MagicMock(return_value=self.async_redis_pipeline)
+        url_cache.async_redis_client.setex = AsyncMock(return_value=True)
+        url_cache.async_redis_client.mget = AsyncMock(side_effect=lambda keys: [None] * len(keys))
+        # Start every test with an empty in-process cache
+        url_cache.url_l1_cache.clear()
+        url_cache.url_negative_cache.clear()
+        user_cache.user_l1_cache.clear()
         
         # create dummy regular and admin user credentials        
         self.regular_user = self.simulate_login("regularuser@gmail.com","Password1")
@@ -90,12 +115,17 @@ class TestAPI(unittest.TestCase):
         
         
     def tearDown(self) -> None:
+        # write out hits recorded by this test before its tables go away
+        access_tracker.flush()
         # tear down the mock table
         self.urltable.delete()
         self.usertable.delete()
         self.dynamodb = None
-        url_handlers.redis_client.get = self.redis_client_get_original
-        url_handlers.redis_client.exists = self.redis_client_exists_original
+        url_cache.redis_client.get = self.redis_client_get_original
+        url_cache.redis_client.exists = self.redis_client_exists_original
+        url_cache.async_redis_client.pipeline = self.async_redis_client_pipeline_original
+        url_cache.async_redis_client.setex = self.async_redis_client_setex_original
+        url_cache.async_redis_client.mget = self.async_redis_client_mget_original
                
         
     def test_table_exists(self):
@@ -109,7 +139,7 @@ class TestAPI(unittest.TestCase):
         
     def simulate_login(self, email, password):
         # Simulate the authentication process
-        user = authenticate_user(email, password)
+        user = asyncio.run(authenticate_user(email, password))
         if not user:
             raise ValueError("Invalid credentials")
         return user
@@ -124,13 +154,13 @@ class TestUserAPI(TestAPI):
         test_exist_email = Email(email="regularuser@gmail.com")
         
         # Positive test valid email and password are entered
-        result = user_handlers.create_user(user_email=test_valid_email, user_password=test_valid_password)
+        result = asyncio.run(user_handlers.create_user(user_email=test_valid_email, user_password=test_valid_password))
         self.assertIsInstance(result, dict)
         self.assertIn('created successfully', result["message"])
         
         # Negative test with an email that already exist
         with self.assertRaises(HTTPException) as error:
-            user_handlers.create_user(user_email=test_exist_email, user_password=test_valid_password)
+            asyncio.run(user_handlers.create_user(user_email=test_exist_email, user_password=test_valid_password))
         self.assertEqual(error.exception.status_code, 400)
         self.assertEqual(error.exception.detail, f"Email of {test_exist_email.email} already exist, try another one.")
         
@@ -154,7 +184,31 @@ class TestUserAPI(TestAPI):
                         "long_url": "http://example2.com",
                     }
                 ]
-        self.assertEqual(user_handlers.list_my_urls(current_user=self.regular_user), expected_result)
+        page = user_handlers.list_my_urls(current_user=self.regular_user)
+        self.assertCountEqual(page["urls"], expected_result)
+        self.assertIsNone(page["next_cursor"])
+        
+        # Positive test following the cursor one URL at a time
+        first = user_handlers.list_my_urls(limit=1, current_user=self.regular_user)
+        second = user_handlers.list_my_urls(limit=1, cursor=first["next_cursor"], current_user=self.regular_user)
+        self.assertCountEqual(first["urls"] + second["urls"], expected_result)
+        
+        # Negative tests with an out of range limit and a made up cursor
+        with self.assertRaises(HTTPException) as error:
+            user_handlers.list_my_urls(limit=0, current_user=self.regular_user)
+        self.assertEqual(error.exception.status_code, 400)
+        with self.assertRaises(HTTPException) as error:
+            user_handlers.list_my_urls(cursor="not-a-cursor", current_user=self.regular_user)
+        self.assertEqual(error.exception.status_code, 400)
+        self.assertEqual(error.exception.detail, "Invalid cursor.")
+        
+        # Negative tests with well-formed cursors of the wrong shape or of another user
+        for last_evaluated_key in [{"short_url": {"S": "short_url_1"}},
+                                   {"creator_email": {"S": self.regular_user.email}, "short_url": {"N": "1"}},
+                                   {"creator_email": {"S": self.admin_user.email}, "short_url": {"S": "short_url_3"}}]:
+            with self.assertRaises(HTTPException) as error:
+                user_handlers.list_my_urls(cursor=encode_cursor(last_evaluated_key), current_user=self.regular_user)
+            self.assertEqual(error.exception.status_code, 400)
         
         
     def test_change_password(self):
@@ -162,13 +216,96 @@ class TestUserAPI(TestAPI):
         
         # Negative test with invalid user, access denied
         with self.assertRaises(HTTPException) as error:
-            user_handlers.change_password(password=valid_new_password,  current_user=None)
+            asyncio.run(user_handlers.change_password(password=valid_new_password,  current_user=None))
         self.assertEqual(error.exception.status_code, 401)
         self.assertEqual(error.exception.detail, "Authentication required to access this endpoint.")
     
 
         # Positive test with valid user and valid password
-        self.assertEqual(user_handlers.change_password(password=valid_new_password, current_user=self.regular_user), {"message": "Password changed successfully"})    
+        self.assertEqual(asyncio.run(user_handlers.change_password(password=valid_new_password, current_user=self.regular_user)), {"message": "Password changed successfully"})    
+        
+        
+    def test_refresh_token(self):
+        form = MagicMock(username=self.regular_user.email, password="Password1")
+        tokens = asyncio.run(user_handlers.login_for_access_token(form_data=form))
+        
+        # A refresh token is no access token
+        with self.assertRaises(HTTPException) as error:
+            asyncio.run(get_current_user(tokens["refresh_token"]))
+        self.assertEqual(error.exception.status_code, 401)
+        
+        # Refreshing checks no password and rotates the refresh token
+        with patch('app.service.pwhashing.verify_password') as mock_verify:
+            refreshed = user_handlers.refresh_access_token(schemas.refreshToken(refresh_token=tokens["refresh_token"]))
+            mock_verify.assert_not_called()
+        self.assertEqual(asyncio.run(get_current_user(refreshed["access_token"])).email, self.regular_user.email)
+        self.assertNotEqual(refreshed["refresh_token"], tokens["refresh_token"])
+        
+        # Every refresh token works once
+        for token in [tokens["refresh_token"], tokens["access_token"], "not a token"]:
+            with self.assertRaises(HTTPException) as error:
+                user_handlers.refresh_access_token(schemas.refreshToken(refresh_token=token))
+            self.assertEqual(error.exception.status_code, 401)
+            self.assertEqual(error.exception.detail, "Invalid refresh token")
+        
+        # Changing the password revokes the remaining refresh tokens
+        asyncio.run(user_handlers.change_password(password=schemas.Password(password="Password3"), current_user=self.regular_user))
+        with self.assertRaises(HTTPException):
+            user_handlers.refresh_access_token(schemas.refreshToken(refresh_token=refreshed["refresh_token"]))
+        
+        
+    @patch('app.auth.auth.TOKEN_CLAIMS', True)
+    def test_token_claims(self):
+        # The async client is bound to another event loop, token versions are read through the sync one
+        auth.redis_client.delete(cache_keys.token_version_key(self.regular_user.email))
+        fake_async_redis = MagicMock()
+        fake_async_redis.get = AsyncMock(side_effect=lambda key: self.redis_client_get_original(key))
+        fake_async_redis.set = AsyncMock(side_effect=auth.redis_client.set)
+        with patch.object(auth, 'async_redis_client', fake_async_redis):
+            form = MagicMock(username=self.regular_user.email, password="Password1")
+            tokens = asyncio.run(user_handlers.login_for_access_token(form_data=form))
+            claims = asyncio.run(get_current_claims(tokens["access_token"]))
+            self.assertEqual((claims.email, claims.is_admin, claims.url_limit), (self.regular_user.email, False, 2))
+            
+            # Once the token version is cached, claims need no user read
+            with patch('app.auth.auth.user_cache.get_user') as mock_get_user:
+                self.assertEqual(asyncio.run(get_current_claims(tokens["access_token"])).url_limit, 2)
+                mock_get_user.assert_not_called()
+            
+            # Updating the limit outdates the token, a refresh picks up the new limit
+            admin_handlers.update_url_limit(user_email=schemas.Email(email=self.regular_user.email), new_limit=3, current_user=self.admin_user)
+            for check in [get_current_claims, get_current_user]:
+                with self.assertRaises(HTTPException) as error:
+                    asyncio.run(check(tokens["access_token"]))
+                self.assertEqual(error.exception.status_code, 401)
+            refreshed = user_handlers.refresh_access_token(schemas.refreshToken(refresh_token=tokens["refresh_token"]))
+            self.assertEqual(asyncio.run(get_current_claims(refreshed["access_token"])).url_limit, 3)
+            
+            # A late publish of an older version doesn't bring outdated tokens back
+            auth.set_token_version(self.regular_user.email, 0)
+            self.assertEqual(asyncio.run(auth.get_token_version(self.regular_user.email)), 1)
+            
+            # Tokens without claims still work
+            legacy_token = create_access_token(data={"sub": self.regular_user.email})
+            self.assertEqual(asyncio.run(get_current_claims(legacy_token)).url_limit, 3)
+        
+        
+    def test_get_current_user_is_cached(self):
+        token = create_access_token(data={"sub": self.regular_user.email})
+        
+        # Only the first request reads the user from the database
+        with patch('app.service.user_cache.Users.get', wraps=user_handlers.Users.get) as mock_get:
+            self.assertEqual(asyncio.run(get_current_user(token)).email, self.regular_user.email)
+            self.assertEqual(asyncio.run(get_current_user(token)).urls, self.regular_user.urls)
+            self.assertEqual(mock_get.call_count, 1)
+            
+            # Saving the user invalidates the cached record
+            asyncio.run(user_handlers.change_password(password=schemas.Password(password="Password3"), current_user=self.regular_user))
+            cached_user = asyncio.run(get_current_user(token))
+            self.assertEqual(mock_get.call_count, 2)
+        # password hashes stay out of the cache
+        self.assertIsNone(cached_user.password_hash)
+        self.assertEqual(user_handlers.Users.get(self.regular_user.email).password_hash, self.regular_user.password_hash)
         
         
 @mock_aws
@@ -182,12 +319,39 @@ class TestAdminAPI(TestAPI):
         self.assertEqual(error.exception.status_code, 403)
         
         # Positive test with Admin user, return all urls
-        expected_result = {
-            ("short_url_1", "http://example1.com", "regularuser@gmail.com"),
-            ("short_url_2", "http://example2.com", "regularuser@gmail.com"),
-            ("short_url_3", "http://example3.com", "adminuser@gmail.com")
-        }
-        self.assertEqual(admin_handlers.get_all_urls(current_user=self.admin_user), expected_result)
+        expected_result = [
+            {"short_url": "short_url_1", "long_url": "http://example1.com", "creator_email": "regularuser@gmail.com"},
+            {"short_url": "short_url_2", "long_url": "http://example2.com", "creator_email": "regularuser@gmail.com"},
+            {"short_url": "short_url_3", "long_url": "http://example3.com", "creator_email": "adminuser@gmail.com"}
+        ]
+        page = admin_handlers.get_all_urls(current_user=self.admin_user)
+        self.assertCountEqual(page["urls"], expected_result)
+        self.assertIsNone(page["next_cursor"])
+        
+        # Positive test following the cursor two pairs at a time
+        first = admin_handlers.get_all_urls(limit=2, current_user=self.admin_user)
+        second = admin_handlers.get_all_urls(limit=2, cursor=first["next_cursor"], current_user=self.admin_user)
+        self.assertEqual(len(first["urls"]), 2)
+        self.assertCountEqual(first["urls"] + second["urls"], expected_result)
+        
+        # Positive test streaming newline-delimited JSON
+        response = admin_handlers.get_all_urls(stream=True, current_user=self.admin_user)
+        self.assertEqual(response.media_type, "application/x-ndjson")
+        
+        async def read_body():
+            return [json.loads(line) async for line in response.body_iterator]
+        self.assertCountEqual(asyncio.run(read_body()), expected_result)
+        
+        # Negative test with a made up cursor
+        with self.assertRaises(HTTPException) as error:
+            admin_handlers.get_all_urls(cursor="bm90LWEta2V5", current_user=self.admin_user)
+        self.assertEqual(error.exception.status_code, 400)
+        
+        # Negative test with a well-formed cursor of the wrong shape, streaming or not
+        for stream in [False, True]:
+            with self.assertRaises(HTTPException) as error:
+                admin_handlers.get_all_urls(cursor=encode_cursor({"short_url": {"S": "short_url_1"}, "extra": {"S": "x"}}), stream=stream, current_user=self.admin_user)
+            self.assertEqual(error.exception.status_code, 400)
 
 
     def test_update_url_limit(self):
@@ -222,6 +386,71 @@ class TestAdminAPI(TestAPI):
         self.assertEqual(admin_handlers.update_url_limit(user_email=admin_user_email, new_limit=valid_url_limit, current_user=self.admin_user), {"message": f"URL limit updated successfully for user {admin_user_email}."})    
 
 
+    def test_rebuild_shortcode_filter(self):
+        # Negative test with regular user, access not allowed
+        with self.assertRaises(HTTPException) as error:
+            admin_handlers.rebuild_shortcode_filter(background_tasks=BackgroundTasks(), current_user=self.regular_user)
+        self.assertEqual(error.exception.status_code, 403)
+
+        # Positive test with Admin user, every short URL in the table ends up in the filter
+        shortcode_filter.clear()
+        background_tasks = BackgroundTasks()
+        self.assertEqual(admin_handlers.rebuild_shortcode_filter(background_tasks=background_tasks, current_user=self.admin_user), {"message": "Short code filter rebuild started."})
+        asyncio.run(background_tasks())
+        self.assertEqual(shortcode_filter.might_contain_many(["short_url_1", "short_url_2", "short_url_3"]), [True, True, True])
+        self.assertEqual(shortcode_filter.stats()["items"], 3)
+
+        # a code added while the rebuild scans survives the swap
+        def scan():
+            yield "short_url_1"
+            shortcode_filter.add("added_during_scan")
+            yield "short_url_2"
+        shortcode_filter.rebuild(scan())
+        self.assertEqual(shortcode_filter.might_contain_many(["short_url_1", "added_during_scan"]), [True, True])
+        self.assertEqual(url_cache.redis_client.ttl(shortcode_filter.rebuild_key), -2)
+        self.assertEqual(url_cache.redis_client.llen(shortcode_filter.rebuild_log_key), 0)
+
+
+    def test_migrate_url_ownership(self):
+        # Negative test with regular user, access not allowed
+        with self.assertRaises(HTTPException) as error:
+            admin_handlers.migrate_url_ownership(background_tasks=BackgroundTasks(), current_user=self.regular_user)
+        self.assertEqual(error.exception.status_code, 403)
+        
+        # A pair created before ownership moved to the index, only listed on the user record
+        url_handlers.Urls(short_url="legacy_url", long_url="http://legacy.com").save()
+        self.usertable.update_item(
+            Key={"email": "adminuser@gmail.com"},
+            UpdateExpression="SET urls = list_append(urls, :url)",
+            ExpressionAttributeValues={":url": [["legacy_url", "http://legacy.com"]]},
+        )
+        
+        # Positive test with Admin user
+        background_tasks = BackgroundTasks()
+        self.assertEqual(admin_handlers.migrate_url_ownership(background_tasks=background_tasks, current_user=self.admin_user), {"message": "URL ownership migration started."})
+        asyncio.run(background_tasks())
+        self.assertEqual(url_handlers.Urls.get("legacy_url").creator_email, "adminuser@gmail.com")
+        self.assertIsNone(user_handlers.Users.get("adminuser@gmail.com").urls)
+        self.assertIn({"short_url": "legacy_url", "long_url": "http://legacy.com"}, user_handlers.list_my_urls(current_user=self.admin_user)["urls"])
+        
+        # Running it again finds nothing left to migrate
+        self.assertEqual(url_ownership.migrate_user_urls(), {"users": 0, "urls_backfilled": 0})
+        
+        
+    def test_get_metrics(self):
+        # Negative test with regular user, access not allowed
+        with self.assertRaises(HTTPException) as error:
+            admin_handlers.get_metrics(current_user=self.regular_user)
+        self.assertEqual(error.exception.status_code, 403)
+
+        # Positive test with Admin user, L1 cache counters are reported
+        asyncio.run(url_handlers.lookupLongUrl('short_url_1'))
+        asyncio.run(url_handlers.lookupLongUrl('short_url_1'))
+        metrics = admin_handlers.get_metrics(current_user=self.admin_user)
+        self.assertGreaterEqual(metrics["url_l1_cache"]["hits"], 1)
+        self.assertEqual(metrics["url_l1_cache"]["size"], 1)
+
+
 @mock_aws
 class TestUrlAPI(TestAPI):
     
@@ -256,6 +485,7 @@ class TestUrlAPI(TestAPI):
         # Positive test for a valid response (valid long URL, valid non existing short URL, valid user with urls under limit)
         Pos_response = { 'short_url' : validshortUrl.short_Url, 'long_url' : str(longUrlwoHttp.url) }
         self.assertEqual(url_handlers.to_shorten(long_url=longUrlwoHttp, short_url=validshortUrl, current_user=self.admin_user), Pos_response)
+        self.assertTrue(shortcode_filter.might_contain(validshortUrl.short_Url))
         
         # Positive test for a valid response (valid long URL, none short URL, valid user with urls under limit)
         result = url_handlers.to_shorten(long_url=longUrlwoHttp, current_user=self.admin_user)
@@ -263,6 +493,93 @@ class TestUrlAPI(TestAPI):
         self.assertIn('short_url', result)
         
 
+    def test_to_shorten_with_leased_ids(self):
+        longUrl = longURL(url='http://www.testing.com')
+        
+        with patch('app.service.idgenerator.ID_ALLOCATOR', 'range'):
+            first = url_handlers.to_shorten(long_url=longUrl, current_user=self.admin_user)["short_url"]
+            self.assertEqual(len(first), 10)
+            
+            # A custom short URL took the next leased code, so the handler moves on to the one after it
+            taken = range_allocator.encode(range_allocator._next)
+            url_handlers.to_shorten(long_url=longUrl, short_url=shortURL(short_Url=taken), current_user=self.admin_user)
+            second = url_handlers.to_shorten(long_url=longUrl, current_user=self.admin_user)["short_url"]
+            self.assertNotIn(second, (first, taken))
+            self.assertEqual(url_handlers.Urls.get(taken).long_url, "http://www.testing.com/")
+        
+        
+    def test_to_shorten_with_code_pool(self):
+        longUrl = longURL(url='http://www.testing.com')
+        url_cache.redis_client.delete(code_pool.CODE_POOL_KEY)
+        self.addCleanup(url_cache.redis_client.delete, code_pool.CODE_POOL_KEY)
+        
+        stats = code_pool.stats()
+        
+        with patch('app.service.idgenerator.ID_ALLOCATOR', 'pool'):
+            # An empty pool falls back to generating the code inline
+            self.assertEqual(len(url_handlers.to_shorten(long_url=longUrl, current_user=self.admin_user)["short_url"]), 15)
+            self.assertEqual(code_pool.stats()["ran_dry"], stats["ran_dry"] + 1)
+            
+            # The refiller only adds codes that are not in the database, and handlers take them from the pool
+            with patch.object(code_pool, 'CODE_POOL_HIGH_WATERMARK', 3), patch('app.service.idgenerator.randomID', side_effect=['short_url_1', 'pooled_url_1', 'pooled_url_2', 'pooled_url_3']):
+                self.assertEqual(code_pool.refill(force=True), 3)
+            self.assertEqual(url_cache.redis_client.smembers(code_pool.CODE_POOL_KEY), {b'pooled_url_1', b'pooled_url_2', b'pooled_url_3'})
+            self.assertEqual(url_cache.redis_client.ttl(code_pool.CODE_POOL_LOCK_KEY), -2)
+            self.assertEqual(code_pool.stats()["collisions"], stats["collisions"] + 1)
+            self.assertIn(url_handlers.to_shorten(long_url=longUrl, current_user=self.admin_user)["short_url"], {'pooled_url_1', 'pooled_url_2', 'pooled_url_3'})
+            self.assertEqual(url_cache.redis_client.scard(code_pool.CODE_POOL_KEY), 2)
+        
+    def test_code_pool_lock_is_released_only_by_its_holder(self):
+        self.addCleanup(url_cache.redis_client.delete, code_pool.CODE_POOL_LOCK_KEY)
+        token = code_pool._acquire_lock()
+        # the refill outlived the lock and another worker took it over
+        url_cache.redis_client.set(code_pool.CODE_POOL_LOCK_KEY, "other-worker")
+        code_pool._release_lock(token)
+        self.assertEqual(self.redis_client_get_original(code_pool.CODE_POOL_LOCK_KEY), b"other-worker")
+        
+        
+    def test_shorten_urls(self):
+        items = [
+            schemas.shortenItem(long_url=longURL(url='http://www.testing1.com'), short_url=shortURL(short_Url='98uwefowiefs')),
+            schemas.shortenItem(long_url=longURL(url='http://www.testing2.com'), short_url=shortURL(short_Url='short_url_1')),
+            schemas.shortenItem(long_url=longURL(url='http://www.testing3.com'), short_url=shortURL(short_Url='98uwefowiefs')),
+            schemas.shortenItem(long_url=longURL(url='http://www.testing4.com')),
+        ]
+        
+        # Negative test with invalid user, access denied
+        with self.assertRaises(HTTPException) as error:
+            url_handlers.shorten_urls(items=items, current_user=None)
+        self.assertEqual(error.exception.status_code, 401)
+        
+        # Negative test with a batch that doesn't fit the user's URL limit
+        with self.assertRaises(HTTPException) as error:
+            url_handlers.shorten_urls(items=items, current_user=self.regular_user)
+        self.assertEqual(error.exception.status_code, 400)
+        self.assertEqual(error.exception.detail, f"Creating 4 short urls would exceed the maximum URL limit of {self.regular_user.url_limit} short urls.")
+        
+        # Positive test, every item gets its own result in request order
+        results = url_handlers.shorten_urls(items=items, current_user=self.admin_user)["results"]
+        self.assertEqual(results[0], {"short_url": "98uwefowiefs", "long_url": "http://www.testing1.com/", "error": None})
+        self.assertEqual(results[1]["error"], "Short URL short_url_1 already exists, please try another one.")
+        self.assertEqual(results[2]["error"], "Short URL 98uwefowiefs is requested more than once.")
+        self.assertIsNone(results[3]["error"])
+        
+        # The created pairs are stored, cached and owned by the user
+        generated = results[3]["short_url"]
+        self.assertEqual(url_handlers.Urls.get(generated).creator_email, self.admin_user.email)
+        self.assertEqual(url_handlers.Urls.get("short_url_1").long_url, "http://example1.com")
+        self.assertEqual(self.redis_client_get_original(cache_keys.url_key(generated)), b"http://www.testing4.com/")
+        self.assertTrue(all(shortcode_filter.might_contain_many(["98uwefowiefs", generated])))
+        self.assertEqual(url_ownership.count_user_urls(self.admin_user.email), 3)
+        
+        # A generated code the filter missed is taken, the existing pair is kept and another code is generated
+        with patch('app.api.url_handlers._unseen_short_urls', return_value=["short_url_2"]):
+            results = url_handlers.shorten_urls(items=items[3:], current_user=self.admin_user)["results"]
+        self.assertNotEqual(results[0]["short_url"], "short_url_2")
+        self.assertIsNone(results[0]["error"])
+        self.assertEqual(url_handlers.Urls.get("short_url_2").long_url, "http://example2.com")
+        
+
     def test_delete_url(self):
         # dummy variables for testing
         selfownUrl = shortURL(short_Url='short_url_1')
@@ -292,36 +609,303 @@ class TestUrlAPI(TestAPI):
         self.assertEqual(response, { "message": f"Short URL '{selfownUrl.short_Url}' deleted successfully." })
 
 
+    def test_delete_urls(self):
+        short_urls = [shortURL(short_Url='short_url_1'), shortURL(short_Url='short_url_3'), shortURL(short_Url='NotexistingURL'), shortURL(short_Url='short_url_1')]
+        
+        # Negative test with invalid user, access denied
+        with self.assertRaises(HTTPException) as error:
+            url_handlers.delete_urls(short_urls=short_urls, current_user=None)
+        self.assertEqual(error.exception.status_code, 401)
+        
+        # Positive test, only the user's own short URL is deleted and every distinct short URL gets a result
+        url_cache.url_l1_cache.set('short_url_1', "http://example1.com")
+        results = url_handlers.delete_urls(short_urls=short_urls, current_user=self.regular_user)["results"]
+        self.assertEqual(results, [
+            {"short_url": "short_url_1", "error": None},
+            {"short_url": "short_url_3", "error": "Short URL 'short_url_3' not found or does not belong to the current user."},
+            {"short_url": "NotexistingURL", "error": "Short URL 'NotexistingURL' not found or does not belong to the current user."},
+        ])
+        self.assertEqual(url_handlers.Urls.count('short_url_1'), 0)
+        self.assertEqual(url_handlers.Urls.count('short_url_3'), 1)
+        self.assertIsNone(url_cache.url_l1_cache.get('short_url_1'))
+        self.assertEqual(url_ownership.count_user_urls(self.regular_user.email), 1)
+
+
+    def test_url_count_follows_creates_and_deletes(self):
+        url_ownership.redis_client.delete(cache_keys.url_count_key(self.admin_user.email))
+        with patch.object(url_ownership.redis_client, "get", self.redis_client_get_original):
+            # the first quota check counts the index, later ones read the cached count
+            self.assertEqual(url_ownership.count_user_urls(self.admin_user.email), 1)
+            with patch.object(url_handlers.Urls.creator_index, "count") as count:
+                url_handlers.to_shorten(long_url=longURL(url='http://www.testing1.com'), current_user=self.admin_user, short_url=shortURL(short_Url='countedCode1'))
+                self.assertEqual(url_ownership.count_user_urls(self.admin_user.email), 2)
+                url_handlers.delete_url(short_url=shortURL(short_Url='short_url_3'), current_user=self.admin_user)
+                self.assertEqual(url_ownership.count_user_urls(self.admin_user.email), 1)
+            count.assert_not_called()
+
+
     def test_getLongUrl(self):
-        NotexistshortURL = 'Notexist'
+        NotexistshortURL = 'NotexistingURL'
+        InvalidshortURL = 'Notexist'
         existshortURL = 'short_url_1'
         
         # Positive test for a successful redirect
-        response = url_handlers.getLongUrl(existshortURL)
+        response = asyncio.run(url_handlers.getLongUrl(existshortURL))
         self.assertEqual(response.status_code, 307) 
         
         # Negative test with non existing short URL for redirect
         with self.assertRaises(HTTPException) as error:
-            url_handlers.getLongUrl(NotexistshortURL)
+            asyncio.run(url_handlers.getLongUrl(NotexistshortURL))
         self.assertEqual(error.exception.status_code, 400)
         self.assertEqual(error.exception.detail, f"Short URL of {NotexistshortURL} doesn't exist.")    
+        
+        # Negative test with a short URL that can't exist, rejected before any cache or database read
+        with patch('app.api.url_handlers.Urls.query') as mock_query, patch.object(url_cache, 'aget_long_url') as mock_cache:
+            for shorturl in [InvalidshortURL, 'x' * 2000, 'short_url_1/../x']:
+                with self.assertRaises(HTTPException) as error:
+                    asyncio.run(url_handlers.getLongUrl(shorturl))
+                self.assertEqual(error.exception.status_code, 404)
+                with self.assertRaises(HTTPException) as error:
+                    asyncio.run(url_handlers.lookupLongUrl(shorturl))
+                self.assertEqual(error.exception.status_code, 404)
+            mock_query.assert_not_called()
+            mock_cache.assert_not_called()
+        self.assertFalse(url_cache.is_known_missing(InvalidshortURL))
 
     def test_lookupLongUrl(self):
-        NotexistshortURL = 'Notexist'
+        NotexistshortURL = 'NotexistingURL'
         existshortURL = 'short_url_1'
         
         # Positive test for a successful redirect
         pos_response = {
             "long_url": "http://example1.com"
         }
-        self.assertEqual(url_handlers.lookupLongUrl(existshortURL), pos_response) 
+        self.assertEqual(asyncio.run(url_handlers.lookupLongUrl(existshortURL)), pos_response) 
         
         # Negative test with non existing short URL for redirect
         with self.assertRaises(HTTPException) as error:
-            url_handlers.getLongUrl(NotexistshortURL)
+            asyncio.run(url_handlers.getLongUrl(NotexistshortURL))
         self.assertEqual(error.exception.status_code, 400)
         self.assertEqual(error.exception.detail, f"Short URL of {NotexistshortURL} doesn't exist.")   
 
 
+    def test_lookup_long_urls(self):
+        short_urls = ['short_url_1', 'short_url_2', 'NotexistingURL', 'short_url_1', 'Notexist', 'x' * 3000]
+        
+        # Negative test with too many short URLs
+        with self.assertRaises(HTTPException) as error:
+            asyncio.run(url_handlers.lookup_long_urls(['short_url_1'] * (url_handlers.BULK_MAX_ITEMS + 1)))
+        self.assertEqual(error.exception.status_code, 400)
+        
+        # Positive test, every distinct short URL is mapped, misses take one MGET and one batch read
+        expected = {"long_urls": {'short_url_1': "http://example1.com", 'short_url_2': "http://example2.com", 'NotexistingURL': None, 'Notexist': None, 'x' * 3000: None}}
+        with patch.object(url_handlers.Urls, 'batch_get', wraps=url_handlers.Urls.batch_get) as mock_batch_get, patch.object(access_tracker, 'record_hit') as mock_record_hit:
+            self.assertEqual(asyncio.run(url_handlers.lookup_long_urls(short_urls)), expected)
+            self.assertEqual(mock_batch_get.call_count, 1)
+            # bulk lookups aren't clicks
+            mock_record_hit.assert_not_called()
+            # codes that can't exist reach neither Redis nor the database
+            url_cache.async_redis_client.mget.assert_awaited_once_with(['url:{short_url_1}', 'url:{short_url_2}', 'url:{NotexistingURL}'])
+            self.assertEqual(sorted(mock_batch_get.call_args[0][0]), ['NotexistingURL', 'short_url_1', 'short_url_2'])
+            self.assertFalse(url_cache.is_known_missing('Notexist'))
+            # the found pairs are written back in one pipeline
+            self.assertEqual(self.async_redis_pipeline.setex.call_count, 2)
+            self.async_redis_pipeline.execute.assert_awaited_once()
+            
+            # A repeated lookup is served from the process cache and the negative cache
+            self.assertEqual(asyncio.run(url_handlers.lookup_long_urls(short_urls)), expected)
+            self.assertEqual(mock_batch_get.call_count, 1)
+        
+        
+    def test_get_url_clicks(self):
+        # Negative test with valid user but a short URL created by another user
+        with self.assertRaises(HTTPException) as error:
+            url_handlers.get_url_clicks(short_url='short_url_3', current_user=self.regular_user)
+        self.assertEqual(error.exception.status_code, 404)
+        
+        # Buffered hits are counted before and after they are flushed to the database, lookups aren't clicks
+        asyncio.run(url_handlers.getLongUrl('short_url_1'))
+        asyncio.run(url_handlers.getLongUrl('short_url_1'))
+        asyncio.run(url_handlers.lookupLongUrl('short_url_1'))
+        self.assertEqual(url_handlers.get_url_clicks(short_url='short_url_1', current_user=self.regular_user), {"short_url": "short_url_1", "clicks": 2})
+        access_tracker.flush()
+        self.assertEqual(url_handlers.Urls.get('short_url_1').clicks, 2)
+        
+        # Admins can read the clicks of any short URL
+        self.assertEqual(url_handlers.get_url_clicks(short_url='short_url_1', current_user=self.admin_user), {"short_url": "short_url_1", "clicks": 2})
+
+    def test_concurrent_misses_share_one_query(self):
+        # Ten concurrent redirects for an uncached short URL read the database once
+        async def redirect_many():
+            return await asyncio.gather(*(url_handlers.getLongUrl('short_url_2') for _ in range(10)))
+        
+        with patch('app.api.url_handlers.Urls.query', wraps=url_handlers.Urls.query) as mock_query:
+            responses = asyncio.run(redirect_many())
+        self.assertTrue(all(response.status_code == 307 for response in responses))
+        self.assertEqual(mock_query.call_count, 1)
+
+    def test_refresh_ahead(self):
+        # A Redis hit far from expiry is served without touching the database
+        self.async_redis_pipeline.execute.return_value = [b"http://example1.com", url_cache.expiration_time]
+        with patch('app.api.url_handlers.Urls.query') as mock_query:
+            self.assertEqual(asyncio.run(url_handlers.lookupLongUrl('short_url_1')), {"long_url": "http://example1.com"})
+            mock_query.assert_not_called()
+        
+        # A hit inside the refresh window is served from the cache and reloaded in the background
+        url_cache.url_l1_cache.clear()
+        self.async_redis_pipeline.execute.return_value = [b"http://example1.com", 1]
+        async def lookup_and_wait_for_refresh():
+            response = await url_handlers.lookupLongUrl('short_url_1')
+            await asyncio.gather(*url_cache._refresh_tasks)
+            return response
+        self.assertEqual(asyncio.run(lookup_and_wait_for_refresh()), {"long_url": "http://example1.com"})
+        url_cache.async_redis_client.setex.assert_called_once()
+        # The refreshed entry gets a jittered TTL no shorter than the base one
+        short_url, ttl, long_url = url_cache.async_redis_client.setex.call_args[0]
+        self.assertEqual((short_url, long_url), ('url:{short_url_1}', 'http://example1.com'))
+        self.assertGreaterEqual(ttl, url_cache.expiration_time)
+
+    def test_negative_cache(self):
+        missingshortURL = 'missingCode01'
+        
+        # First lookup of a missing short URL reads the database
+        with self.assertRaises(HTTPException):
+            asyncio.run(url_handlers.getLongUrl(missingshortURL))
+        
+        # Repeated lookups are rejected without another database read
+        with patch('app.api.url_handlers.Urls.query') as mock_query:
+            with self.assertRaises(HTTPException) as error:
+                asyncio.run(url_handlers.lookupLongUrl(missingshortURL))
+            mock_query.assert_not_called()
+        self.assertEqual(error.exception.status_code, 400)
+        
+        # Creating the short URL invalidates the negative entry
+        url_handlers.to_shorten(long_url=longURL(url='http://www.testing.com'), short_url=shortURL(short_Url=missingshortURL), current_user=self.admin_user)
+        self.assertEqual(asyncio.run(url_handlers.lookupLongUrl(missingshortURL)), {"long_url": "http://www.testing.com/"})
+
+
+@mock_aws
+class TestCachePopulation(TestAPI):
+
+    def setUp(self):
+        super().setUp()
+        self.redis_client = url_cache.redis_client
+        self.redis_client.delete(cache_population.WARMUP_PROGRESS_KEY, cache_population.WARMUP_LOCK_KEY, *[cache_keys.url_key(short_url) for short_url in ["short_url_1", "short_url_2", "short_url_3"]])
+        self.redis_client.delete(*self.redis_client.keys(f"{access_tracker.POPULARITY_KEY_PREFIX}:*") or ["none"])
+
+    def test_populate_cache_from_database(self):
+        # Every url pair gets cached and the warm-up reports itself complete
+        self.assertTrue(cache_population.populate_cache_from_database(self.redis_client, url_handlers.Urls, segments=2, batch_size=1))
+        self.assertEqual(self.redis_client_get_original(cache_keys.url_key("short_url_3")), b"http://example3.com")
+        status = cache_population.warmup_status(self.redis_client)
+        self.assertEqual((status["state"], status["segments"], status["segments_done"]), ("complete", 2, 2))
+        # moto ignores scan segments, so every segment loads the whole mock table
+        self.assertEqual(status["items_loaded"], 6)
+
+    def test_populate_cache_resumes_from_checkpoint(self):
+        # A finished segment from an interrupted run is not scanned again
+        self.redis_client.hset(cache_population.WARMUP_PROGRESS_KEY, mapping={"state": "running", "segment:0/1": "done"})
+        cache_population.populate_cache_from_database(self.redis_client, url_handlers.Urls, segments=1)
+        self.assertIsNone(self.redis_client_get_original(cache_keys.url_key("short_url_1")))
+        self.assertEqual(cache_population.warmup_status(self.redis_client)["state"], "complete")
+
+    def test_populate_cache_from_popular_urls(self):
+        # short_url_2 is accessed more often than short_url_1, short_url_3 is never accessed
+        for shorturl in ['short_url_1', 'short_url_2', 'short_url_2']:
+            asyncio.run(url_handlers.getLongUrl(shorturl))
+        access_tracker.flush()
+        self.assertEqual(access_tracker.top_short_urls(2), [('short_url_2', 2.0), ('short_url_1', 1.0)])
+        
+        # Only the top link is loaded when top_n is 1
+        self.assertEqual(cache_population.populate_cache_from_popular_urls(self.redis_client, url_handlers.Urls, top_n=1), 1)
+        self.assertEqual(self.redis_client_get_original(cache_keys.url_key("short_url_2")), b"http://example2.com")
+        self.assertIsNone(self.redis_client_get_original(cache_keys.url_key("short_url_1")))
+        
+        # A memory budget too small for any link loads nothing
+        self.assertEqual(cache_population.populate_cache_from_popular_urls(self.redis_client, url_handlers.Urls, memory_budget=10), 0)
+
+    def test_populate_cache_skips_when_locked(self):
+        # Another worker holds the lock, so this one leaves the warm-up to it
+        self.redis_client.set(cache_population.WARMUP_LOCK_KEY, 1)
+        self.assertFalse(cache_population.populate_cache_from_database(self.redis_client, url_handlers.Urls))
+        self.assertEqual(cache_population.warmup_status(self.redis_client)["state"], "not_started")
+
+    def test_warmup_lock_is_released_only_by_its_holder(self):
+        token = cache_population._acquire_lock(self.redis_client)
+        # the lock timed out and another worker took it over
+        self.redis_client.set(cache_population.WARMUP_LOCK_KEY, "other-worker")
+        cache_population._release_lock(self.redis_client, token)
+        self.assertEqual(self.redis_client_get_original(cache_population.WARMUP_LOCK_KEY), b"other-worker")
+
+    def test_ready_while_warming_up(self):
+        # workers take traffic before the warm-up has run, it is only reported
+        self.assertEqual(api_handlers.readiness(), {"ready": True, "cache_warmup": cache_population.warmup_status(self.redis_client)})
+        self.redis_client.hset(cache_population.WARMUP_PROGRESS_KEY, "state", "running")
+        self.assertTrue(api_handlers.readiness()["ready"])
+        self.assertEqual(api_handlers.readiness()["cache_warmup"]["state"], "running")
+
+
+
+@mock_aws
+class TestExport(TestAPI):
+
+    def setUp(self):
+        super().setUp()
+        output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(output_dir.cleanup)
+        self.output_dir = output_dir.name
+
+    def read_rows(self, manifest):
+        rows = []
+        for shard in manifest["shards"]:
+            with gzip.open(os.path.join(self.output_dir, shard["file"]), "rt") as f:
+                rows += [json.loads(line) for line in f]
+        return rows
+
+    def test_export_urls(self):
+        manifest = export.export_urls(url_handlers.Urls, self.output_dir, segments=1, page_size=2)
+        self.assertEqual(manifest["state"], "complete")
+        self.assertEqual(manifest["rows"], 3)
+        self.assertCountEqual([row["short_url"] for row in self.read_rows(manifest)], ["short_url_1", "short_url_2", "short_url_3"])
+
+        # A different segment count can't reuse the directory
+        with self.assertRaises(ValueError):
+            export.export_urls(url_handlers.Urls, self.output_dir, segments=2)
+
+    def test_export_urls_resumes_from_checkpoint(self):
+        scan = url_handlers.Urls.scan
+
+        class Interrupted(Exception):
+            pass
+
+        class InterruptedScan:
+            # hands out two rows, then fails like a crashed export
+            def __init__(self, **kwargs):
+                self.results = scan(**kwargs)
+
+            @property
+            def last_evaluated_key(self):
+                return self.results.last_evaluated_key
+
+            def __iter__(self):
+                for count, url_pair in enumerate(self.results):
+                    if count == 2:
+                        raise Interrupted()
+                    yield url_pair
+
+        with patch.object(url_handlers.Urls, "scan", side_effect=InterruptedScan):
+            with self.assertRaises(Interrupted):
+                export.export_urls(url_handlers.Urls, self.output_dir, segments=1, page_size=1)
+        manifest = export._load_manifest(self.output_dir)
+        self.assertEqual(manifest["shards"][0]["rows"], 2)
+
+        # Bytes written after the last checkpoint are dropped on resume
+        with open(os.path.join(self.output_dir, manifest["shards"][0]["file"]), "ab") as f:
+            f.write(b"partial page")
+        manifest = export.export_urls(url_handlers.Urls, self.output_dir, segments=1, page_size=1)
+        self.assertEqual(manifest["rows"], 3)
+        self.assertCountEqual([row["short_url"] for row in self.read_rows(manifest)], ["short_url_1", "short_url_2", "short_url_3"])
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,355 @@
+import os
+import sys
+DIR = os.path.dirname(os.path.dirname(__file__))  # The repo root directory
+sys.path.append(DIR)  # Temporarily add the repo root to sys.path so the 'src' module can be imported
+
+import time
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+import redis.asyncio
+from redis.exceptions import ConnectionError
+from app.service.local_cache import LocalCache
+from app.service.single_flight import SingleFlight
+from app.service.circuit_breaker import CircuitBreaker
+from app.service import url_cache, cache_keys, codec
+
+
+class TestLocalCache(unittest.TestCase):
+
+    def test_get_and_set(self):
+        cache = LocalCache(maxsize=2, ttl=60)
+
+        # miss before the key is set, hit afterwards
+        self.assertIsNone(cache.get("short_url_1"))
+        cache.set("short_url_1", "http://example1.com")
+        self.assertEqual(cache.get("short_url_1"), "http://example1.com")
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = LocalCache(maxsize=2, ttl=60)
+        cache.set("short_url_1", "http://example1.com")
+        cache.set("short_url_2", "http://example2.com")
+
+        # touching the first key makes the second one the eviction candidate
+        cache.get("short_url_1")
+        cache.set("short_url_3", "http://example3.com")
+        self.assertEqual(cache.get("short_url_1"), "http://example1.com")
+        self.assertIsNone(cache.get("short_url_2"))
+        self.assertEqual(cache.stats()["size"], 2)
+
+    def test_entries_expire(self):
+        cache = LocalCache(maxsize=2, ttl=0.01)
+        cache.set("short_url_1", "http://example1.com")
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("short_url_1"))
+
+    def test_delete(self):
+        cache = LocalCache(maxsize=2, ttl=60)
+        cache.set("short_url_1", "http://example1.com")
+        cache.delete("short_url_1")
+        self.assertIsNone(cache.get("short_url_1"))
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls_share_one_fetch(self):
+        single_flight = SingleFlight("test")
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "http://example1.com"
+
+        async def run():
+            return await asyncio.gather(*(single_flight.do("short_url_1", fetch) for _ in range(10)))
+
+        self.assertEqual(asyncio.run(run()), ["http://example1.com"] * 10)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(single_flight.stats()["coalesced"], 9)
+        self.assertEqual(single_flight.stats()["in_flight"], 0)
+
+    def test_errors_reach_every_caller(self):
+        single_flight = SingleFlight("test")
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise ValueError("database unavailable")
+
+        async def run():
+            return await asyncio.gather(*(single_flight.do("short_url_1", fetch) for _ in range(3)), return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    def test_cancelled_caller_leaves_the_fetch_running(self):
+        single_flight = SingleFlight("test")
+
+        async def fetch():
+            await asyncio.sleep(0.02)
+            return "http://example1.com"
+
+        async def run():
+            first = asyncio.ensure_future(single_flight.do("short_url_1", fetch))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(single_flight.do("short_url_1", fetch))
+            await asyncio.sleep(0)
+            # the client of the first request disconnects
+            first.cancel()
+            return await second
+
+        self.assertEqual(asyncio.run(run()), "http://example1.com")
+        self.assertEqual(single_flight.stats()["in_flight"], 0)
+
+    def test_fetches_without_the_lock_while_redis_fails(self):
+        redis_client = AsyncMock()
+        redis_client.set.side_effect = ConnectionError("Redis is down")
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+        single_flight = SingleFlight("test", redis_client=redis_client, breaker=breaker)
+        fetch = AsyncMock(return_value="from database")
+
+        # the first failure opens the breaker, the second request doesn't try Redis at all
+        self.assertEqual(asyncio.run(single_flight.do("short_url_1", fetch)), "from database")
+        self.assertEqual(asyncio.run(single_flight.do("short_url_1", fetch)), "from database")
+        self.assertEqual(redis_client.set.call_count, 1)
+        self.assertEqual(fetch.await_count, 2)
+
+    def test_waits_for_worker_holding_the_lock(self):
+        # another worker holds the lock and fills the cache while this one polls it
+        redis_client = AsyncMock()
+        redis_client.set.return_value = False
+        single_flight = SingleFlight("test", redis_client=redis_client, wait_timeout=0.05, poll_interval=0.01)
+        fetch = AsyncMock(return_value="from database")
+        peek = AsyncMock(side_effect=[None, "from cache"])
+
+        self.assertEqual(asyncio.run(single_flight.do("short_url_1", fetch, peek=peek)), "from cache")
+        fetch.assert_not_called()
+        self.assertEqual(single_flight.stats()["lock_wait_hits"], 1)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+
+        # a second failure in a row opens it
+        breaker.record_failure()
+        self.assertEqual(breaker.stats()["state"], CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.stats()["rejected"], 1)
+
+    def test_single_probe_after_reset_timeout(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+
+        # one probe goes through, a failed probe opens it again
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.stats()["state"], CircuitBreaker.OPEN)
+        self.assertEqual(breaker.stats()["opened"], 2)
+
+        # a successful probe closes it
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.stats()["state"], CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_cancelled_probe_leaves_the_breaker_half_open(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+
+        async def cancelled():
+            raise asyncio.CancelledError()
+
+        # the probe's client disconnects: the breaker neither closes nor keeps waiting on that probe
+        with patch.object(url_cache, "redis_breaker", breaker):
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(url_cache._guarded(cancelled))
+        self.assertEqual(breaker.stats()["state"], CircuitBreaker.HALF_OPEN)
+        single_flight = SingleFlight("test", redis_client=AsyncMock(), breaker=breaker)
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(single_flight._lock_call(cancelled))
+        self.assertEqual(breaker.stats()["state"], CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+
+    def test_url_cache_falls_back_while_redis_fails(self):
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+        pipe = MagicMock()
+        pipe.execute = AsyncMock(side_effect=ConnectionError("Redis is down"))
+        with patch.object(url_cache, "redis_breaker", breaker), \
+                patch.object(url_cache.async_redis_client, "pipeline", return_value=pipe):
+            # failures read as cache misses, so the caller goes to the database
+            for _ in range(3):
+                self.assertIsNone(asyncio.run(url_cache.aget_long_url("short_url_404")))
+        # the open breaker kept the third lookup away from Redis
+        self.assertEqual(pipe.execute.call_count, 2)
+        self.assertEqual(breaker.stats()["state"], CircuitBreaker.OPEN)
+
+
+class TestCacheKeys(unittest.TestCase):
+
+    def setUp(self):
+        self.redis_client = url_cache.redis_client
+        self.legacy = ["shortcode-counter", "shortcode-pool", "shortcode-filter:meta", "shortcode-filter:0", "shortcode-pool:lock",
+                       "user:legacy@example.com", "refresh-token:jti1", "legacy@example.com", "legacyCode01", "unrelated:key"]
+        self.migrated = [cache_keys.ID_COUNTER_KEY, cache_keys.CODE_POOL_KEY, f"{cache_keys.SHORTCODE_FILTER_NAME}:meta", f"{cache_keys.SHORTCODE_FILTER_NAME}:0",
+                         cache_keys.user_key("legacy@example.com"), cache_keys.refresh_token_key("legacy@example.com", "jti1"), cache_keys.url_key("legacyCode01")]
+        self.redis_client.delete(*self.legacy, *self.migrated)
+        self.addCleanup(self.redis_client.delete, *self.legacy, *self.migrated)
+
+    def test_keys_of_a_user_share_a_hash_tag(self):
+        email = "someone@example.com"
+        keys = [cache_keys.user_key(email), cache_keys.url_count_key(email), cache_keys.url_list_key(email), cache_keys.refresh_token_key(email, "jti")]
+        self.assertEqual({key[key.index("{"):key.index("}") + 1] for key in keys}, {"{someone@example.com}"})
+        self.assertEqual(cache_keys.url_key("abcdefghij"), "url:{abcdefghij}")
+
+    def test_migrate_legacy_state(self):
+        # the app already leased a block under the new name
+        self.redis_client.set("shortcode-counter", 5000)
+        self.redis_client.set(cache_keys.ID_COUNTER_KEY, 1000)
+        self.redis_client.sadd("shortcode-pool", "pooledCode01")
+        self.redis_client.hset("shortcode-filter:meta", "count", 1)
+        self.redis_client.set("shortcode-filter:0", "bits")
+
+        self.assertEqual(cache_keys.migrate_legacy_state(self.redis_client), 4)
+        # old workers keep leasing from the legacy counter, the new one stays clear of their IDs
+        self.assertEqual(int(self.redis_client.get(cache_keys.ID_COUNTER_KEY)), 5000 + cache_keys.LEGACY_COUNTER_HEADROOM)
+        self.assertEqual(self.redis_client.get("shortcode-counter"), b"5000")
+        self.assertEqual(self.redis_client.smembers(cache_keys.CODE_POOL_KEY), {b"pooledCode01"})
+        self.assertEqual(self.redis_client.get(f"{cache_keys.SHORTCODE_FILTER_NAME}:0"), b"bits")
+        self.assertEqual(self.redis_client.exists("shortcode-pool", "shortcode-filter:meta", "shortcode-filter:0"), 0)
+        # nothing left to do the second time
+        self.assertEqual(cache_keys.migrate_legacy_state(self.redis_client), 0)
+
+    def test_migrate_legacy_state_merges_into_existing_keys(self):
+        # an old worker added to the legacy pool and filter after a new worker had moved them
+        self.redis_client.sadd(cache_keys.CODE_POOL_KEY, "pooledCode01")
+        self.redis_client.sadd("shortcode-pool", "pooledCode02")
+        self.redis_client.set(f"{cache_keys.SHORTCODE_FILTER_NAME}:0", b"\x01")
+        self.redis_client.set("shortcode-filter:0", b"\x02")
+
+        cache_keys.migrate_legacy_state(self.redis_client)
+        self.assertEqual(self.redis_client.smembers(cache_keys.CODE_POOL_KEY), {b"pooledCode01", b"pooledCode02"})
+        self.assertEqual(self.redis_client.get(f"{cache_keys.SHORTCODE_FILTER_NAME}:0"), b"\x03")
+        self.assertEqual(self.redis_client.exists("shortcode-pool", "shortcode-filter:0"), 0)
+
+    def test_migrate_legacy_keys(self):
+        self.redis_client.setex("user:legacy@example.com", 300, "{}")
+        self.redis_client.set("refresh-token:jti1", "legacy@example.com")
+        self.redis_client.set("legacyCode01", "http://example.com")
+        self.redis_client.set("legacy@example.com", "[]")
+        self.redis_client.set("shortcode-pool:lock", 1)
+        self.redis_client.set("unrelated:key", 1)
+
+        # the Redis server is shared with other tests, count only what this test wrote
+        counts = cache_keys.migrate_legacy_keys(self.redis_client)
+        self.assertGreaterEqual(counts["moved"], 3)
+        self.assertGreaterEqual(counts["dropped"], 2)
+        # values and TTLs survive the move
+        self.assertEqual(self.redis_client.get(cache_keys.url_key("legacyCode01")), b"http://example.com")
+        self.assertGreater(self.redis_client.ttl(cache_keys.user_key("legacy@example.com")), 0)
+        self.assertEqual(self.redis_client.get(cache_keys.refresh_token_key("legacy@example.com", "jti1")), b"legacy@example.com")
+        self.assertEqual(self.redis_client.exists("legacyCode01", "legacy@example.com", "shortcode-pool:lock", "user:legacy@example.com"), 0)
+        # keys it doesn't know are left alone
+        self.assertEqual(self.redis_client.get("unrelated:key"), b"1")
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class TestCodec(unittest.TestCase):
+
+    def test_long_url_round_trip(self):
+        long_url = "https://www.example.com/article/2026/some-story?utm_source=newsletter&utm_medium=email&utm_campaign=fall"
+        encoded = codec.encode_long_url(long_url, "compact")
+        self.assertEqual(encoded[0], codec.ZLIB_URL_DICT_V1)
+        self.assertLess(len(encoded), len(long_url))
+        self.assertEqual(codec.decode_long_url(encoded), long_url)
+        # short URLs aren't worth compressing
+        self.assertEqual(codec.encode_long_url("http://a.io", "compact"), b"http://a.io")
+
+    def test_object_round_trip(self):
+        page = {"urls": [{"short_url": "abcdefghij", "long_url": "http://example.com"}], "next_token": None}
+        encoded = codec.encode_object(page, "compact")
+        self.assertEqual(encoded[0], codec.MSGPACK)
+        self.assertEqual(codec.decode_object(encoded), page)
+
+    def test_reads_plain_values(self):
+        # values written by older versions, or with CACHE_VALUE_FORMAT=plain
+        self.assertEqual(codec.encode_long_url("http://example.com", "plain"), "http://example.com")
+        self.assertEqual(codec.decode_long_url(b"http://example.com"), "http://example.com")
+        self.assertEqual(codec.decode_object(codec.encode_object({"email": "a@b.c"}, "plain").encode("utf-8")), {"email": "a@b.c"})
+
+
+@patch.object(url_cache, "CACHE_LAYOUT", "buckets")
+class TestBucketLayout(unittest.TestCase):
+
+    def setUp(self):
+        self.redis_client = url_cache.redis_client
+        self.short_urls = ["bucketCode01", "bucketCode02"]
+        self.buckets = {key for short_url in self.short_urls for key in url_cache._bucket_keys(short_url)}
+        self.redis_client.delete(*self.buckets)
+        self.addCleanup(self.redis_client.delete, *self.buckets)
+        self.addCleanup(lambda: [url_cache.drop_local(short_url) for short_url in self.short_urls])
+
+    def test_mappings_share_bucket_hashes(self):
+        url_cache.set_long_urls({"bucketCode01": "http://example.com/1", "bucketCode02": "http://example.com/2"})
+        bucket = url_cache.bucket_key("bucketCode01")
+        self.assertEqual(self.redis_client.hget(bucket, "bucketCode01"), b"http://example.com/1")
+        self.assertGreater(self.redis_client.ttl(bucket), 0)
+        self.assertFalse(self.redis_client.exists(cache_keys.url_key("bucketCode01")))
+
+        url_cache.evict_long_url("bucketCode01")
+        self.assertIsNone(self.redis_client.hget(bucket, "bucketCode01"))
+
+    def test_lookups_read_buckets(self):
+        url_cache.cache_long_url("bucketCode01", "http://example.com/1")
+        url_cache.cache_long_url("bucketCode02", "http://example.com/2")
+
+        async def lookup():
+            # a client of its own, the shared one is bound to the event loop of another test
+            with patch.object(url_cache, "async_redis_client", redis.asyncio.StrictRedis(host=os.getenv("REDIS_SERVER"))):
+                for short_url in self.short_urls:
+                    url_cache.drop_local(short_url)
+                return await url_cache.aget_long_url("bucketCode01"), await url_cache.aget_long_urls(self.short_urls + ["bucketCode03"])
+
+        long_url, long_urls = asyncio.run(lookup())
+        self.assertEqual(long_url, "http://example.com/1")
+        self.assertEqual(long_urls, {"bucketCode01": "http://example.com/1", "bucketCode02": "http://example.com/2"})
+
+    def test_previous_generation_is_refreshed(self):
+        # without HEXPIRE, mappings cached a generation ago are still read, and refreshed into the current one
+        current, previous = url_cache._bucket_keys("bucketCode01")
+        self.redis_client.hset(previous, "bucketCode01", "http://example.com/1")
+        self.assertNotEqual(current, previous)
+        refresh = AsyncMock()
+
+        async def lookup():
+            with patch.object(url_cache, "async_redis_client", redis.asyncio.StrictRedis(host=os.getenv("REDIS_SERVER"))):
+                long_url = await url_cache.aget_long_url("bucketCode01", refresh=refresh)
+                await asyncio.gather(*url_cache._refresh_tasks)
+                return long_url
+
+        self.assertEqual(asyncio.run(lookup()), "http://example.com/1")
+        refresh.assert_awaited_once()
+        # the current generation's hash expires when the next generation ends
+        url_cache.cache_long_url("bucketCode01", "http://example.com/1")
+        self.assertGreater(self.redis_client.ttl(current), url_cache.expiration_time)
+
+    def test_open_breaker_reads_as_a_miss(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        with patch.object(url_cache, "redis_breaker", breaker), patch.object(url_cache, "_bucket_field_ttl", False):
+            self.assertIsNone(asyncio.run(url_cache.aget_long_url("bucketCode01")))
+            self.assertEqual(asyncio.run(url_cache.aget_long_urls(self.short_urls)), {})
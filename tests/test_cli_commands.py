@@ -5,13 +5,14 @@ DIR = os.path.dirname(os.path.dirname(__file__))  # The repo root directory
 # print(DIR)  # In case you want to take a look at it...
 sys.path.append(DIR)  # Temporarily add the repo root to sys.path so the 'src' module can be imported
 
+import tempfile
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import ANY, patch, MagicMock
 
-from app.commands.auth_commands import login
-from app.commands.admin_commands import list_all_urls, update_url_limit
-from app.commands.user_commands import list_my_urls, shorten_url, create_user, change_password, delete_url
-from app.commands.url_commands import lookup_url
+from app.commands.auth_commands import login, refresh
+from app.commands.admin_commands import list_all_urls, update_url_limit, rebuild_shortcode_filter, migrate_url_ownership, migrate_cache_keys, export_urls
+from app.commands.user_commands import list_my_urls, shorten_url, create_user, change_password, delete_url, url_clicks, shorten_urls, delete_urls
+from app.commands.url_commands import lookup_url, lookup_urls
 
 class TestAuthCLI(unittest.TestCase):
     
@@ -44,6 +45,23 @@ class TestAuthCLI(unittest.TestCase):
 
         # Check if the error message is echoed
         mock_echo.assert_called_once_with("Error: Invalid credentials")
+
+    @patch('app.commands.auth_commands.typer.echo')
+    @patch('app.commands.auth_commands.requests.post')
+    def test_refresh_successful(self, mock_post, mock_echo):
+        # Mock successful response from the requests.post method
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"access_token": "new_access_token", "refresh_token": "new_refresh_token"}
+        mock_post.return_value = mock_response
+
+        # Call the refresh function with a refresh token
+        refresh("mocked_refresh_token")
+
+        # Check if both new tokens are echoed
+        mock_post.assert_called_once_with(ANY, json={"refresh_token": "mocked_refresh_token"})
+        mock_echo.assert_any_call("Access token: new_access_token")
+        mock_echo.assert_any_call("Refresh token: new_refresh_token")
         
         
 class TestAdminCLIs(unittest.TestCase):
@@ -99,7 +117,10 @@ class TestAdminCLIs(unittest.TestCase):
         # Mock successful response from the requests.get method
         mock_response = MagicMock()
         mock_response.status_code = 200
-        mock_response.json.return_value = [("short_url_1", "long_url_1", "user1@test.com"), ("short_url_2",  "long_url_2", "user2@test.com")]
+        mock_response.iter_lines.return_value = [
+            b'{"short_url": "short_url_1", "long_url": "long_url_1", "creator_email": "user1@test.com"}',
+            b'{"short_url": "short_url_2", "long_url": "long_url_2", "creator_email": "user2@test.com"}',
+        ]
         mock_get.return_value = mock_response
 
         # Call the list_all_urls function with valid token
@@ -125,6 +146,60 @@ class TestAdminCLIs(unittest.TestCase):
         # Check if the error message is echoed
         mock_echo.assert_called_once_with("Error: Unauthorized")
 
+    @patch('app.commands.admin_commands.typer.echo')
+    @patch('app.commands.admin_commands.requests.post')
+    def test_rebuild_shortcode_filter_successful(self, mock_post, mock_echo):
+        # Mock successful response from the requests.post method
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_post.return_value = mock_response
+
+        # Call the rebuild_shortcode_filter function with valid token
+        rebuild_shortcode_filter("mocked_access_token")
+
+        # Check if the success message is echoed
+        mock_echo.assert_called_once_with("Short code filter rebuild started.")
+
+    @patch('app.commands.admin_commands.typer.echo')
+    @patch('app.commands.admin_commands.requests.post')
+    def test_migrate_url_ownership_successful(self, mock_post, mock_echo):
+        # Mock successful response from the requests.post method
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_post.return_value = mock_response
+
+        # Call the migrate_url_ownership function with valid token
+        migrate_url_ownership("mocked_access_token")
+
+        # Check if the success message is echoed
+        mock_echo.assert_called_once_with("URL ownership migration started.")
+
+    @patch('app.commands.admin_commands.typer.echo')
+    @patch('app.commands.admin_commands.requests.post')
+    def test_migrate_cache_keys_successful(self, mock_post, mock_echo):
+        # Mock successful response from the requests.post method
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_post.return_value = mock_response
+
+        # Call the migrate_cache_keys function with valid token
+        migrate_cache_keys("mocked_access_token")
+
+        # Check if the success message is echoed
+        mock_echo.assert_called_once_with("Cache key migration started.")
+
+    @patch('app.commands.admin_commands.typer.echo')
+    @patch('app.service.export.export_urls')
+    def test_export_urls_successful(self, mock_export, mock_echo):
+        # Mock a finished export with two shards
+        mock_export.return_value = {"rows": 3, "shards": [{}, {}]}
+
+        # Call the export_urls function with an output directory
+        export_urls("backup", segments=2)
+
+        # Check if the summary is echoed
+        mock_echo.assert_called_once_with("Exported 3 URLs to 2 shards in backup.")
+
 
 
 class TestUserCLIs(unittest.TestCase):
@@ -182,7 +257,7 @@ class TestUserCLIs(unittest.TestCase):
         # Mock successful response from the requests.get method
         mock_response = MagicMock()
         mock_response.status_code = 200
-        mock_response.json.return_value = ["url1", "url2"]  # Example URLs
+        mock_response.json.return_value = {"urls": ["url1", "url2"], "next_cursor": None}  # Example URLs
         mock_get.return_value = mock_response
 
         # Call the list_my_urls function with valid token
@@ -303,6 +378,33 @@ class TestUserCLIs(unittest.TestCase):
         # Check if the short URL is echoed
         mock_echo.assert_called_once_with("Short URL: mocked_short_url")
 
+
+    @patch('app.commands.user_commands.typer.echo')
+    @patch('app.commands.user_commands.requests.post')
+    def test_shorten_urls_successful(self, mock_post, mock_echo):
+        # Mock per-item results from the requests.post method
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"results": [
+            {"short_url": "generated_url_1", "long_url": "https://example1.com/", "error": None},
+            {"short_url": "short_url_1", "long_url": "https://example2.com/", "error": "Short URL short_url_1 already exists, please try another one."},
+        ]}
+        mock_post.return_value = mock_response
+
+        # Call the shorten_urls function with a file of two URLs, the second with a custom short URL
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("https://example1.com\nhttps://example2.com short_url_1\n")
+        self.addCleanup(os.remove, f.name)
+        shorten_urls(f.name, "mocked_access_token")
+
+        # Check if both items were sent in one request and every result is echoed
+        self.assertEqual(mock_post.call_args.kwargs["json"], [
+            {"long_url": {"url": "https://example1.com"}},
+            {"long_url": {"url": "https://example2.com"}, "short_url": {"short_Url": "short_url_1"}},
+        ])
+        mock_echo.assert_any_call("https://example1.com/ -> generated_url_1")
+        mock_echo.assert_any_call("Error for https://example2.com/: Short URL short_url_1 already exists, please try another one.")
+
         
     @patch('app.commands.user_commands.typer.echo')
     @patch('app.commands.user_commands.requests.post')
@@ -366,6 +468,29 @@ class TestUserCLIs(unittest.TestCase):
         # Check if the success message is echoed
         mock_echo.assert_called_once_with("Short URL deleted successfully.")
 
+    @patch("app.commands.user_commands.typer.echo")
+    @patch("app.commands.user_commands.requests.delete")
+    def test_delete_urls_successful(self, mock_delete, mock_echo):
+        # Mock per-item results from the requests.delete method
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"results": [
+            {"short_url": "short_url_1", "error": None},
+            {"short_url": "short_url_3", "error": "Short URL 'short_url_3' not found or does not belong to the current user."},
+        ]}
+        mock_delete.return_value = mock_response
+
+        # Call the delete_urls function with a file of two short URLs
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("short_url_1\nshort_url_3\n")
+        self.addCleanup(os.remove, f.name)
+        delete_urls(f.name, "mocked_access_token")
+
+        # Check if both were sent in one request and every result is echoed
+        self.assertEqual(mock_delete.call_args.kwargs["json"], [{"short_Url": "short_url_1"}, {"short_Url": "short_url_3"}])
+        mock_echo.assert_any_call("Short URL 'short_url_1' deleted successfully.")
+        mock_echo.assert_any_call("Error: Short URL 'short_url_3' not found or does not belong to the current user.")
+
     @patch("app.commands.user_commands.typer.echo")
     @patch("app.commands.user_commands.requests.delete")
     def test_delete_url_invalid_short_url(self, mock_delete, mock_echo):
@@ -410,6 +535,21 @@ class TestUserCLIs(unittest.TestCase):
 
         # Check if the error message is echoed
         mock_echo.assert_called_once_with("Error: Internal Server Error")  
+
+    @patch("app.commands.user_commands.typer.echo")
+    @patch("app.commands.user_commands.requests.get")
+    def test_url_clicks_successful(self, mock_get, mock_echo):
+        # Mock successful response from the requests.get method
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"short_url": "test_short_url", "clicks": 42}
+        mock_get.return_value = mock_response
+
+        # Call the url_clicks function
+        url_clicks("test_short_url", "valid_token")
+
+        # Check if the click count is echoed
+        mock_echo.assert_called_once_with("Clicks for test_short_url: 42")
     
     
 class TestUrlCLI(unittest.TestCase):
@@ -429,6 +569,23 @@ class TestUrlCLI(unittest.TestCase):
         # Check if the long URL is echoed
         mock_echo.assert_called_once_with("Long URL for test_short_url: https://example.com")
 
+    @patch('app.commands.url_commands.typer.echo')
+    @patch('app.commands.url_commands.requests.post')
+    def test_lookup_urls_successful(self, mock_post, mock_echo):
+        # Mock successful response from the requests.post method, one short URL doesn't exist
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"long_urls": {"test_short_url": "https://example.com", "not_found_url": None}}
+        mock_post.return_value = mock_response
+
+        # Call the lookup_urls function with two short URLs
+        lookup_urls(["test_short_url", "not_found_url"])
+
+        # Check if both short URLs are sent in one request and each result is echoed
+        self.assertEqual(mock_post.call_args.kwargs["json"], ["test_short_url", "not_found_url"])
+        mock_echo.assert_any_call("Long URL for test_short_url: https://example.com")
+        mock_echo.assert_any_call("Short URL 'not_found_url' doesn't exist.")
+
     @patch('app.commands.url_commands.typer.echo')
     @patch('app.commands.url_commands.requests.get')
     def test_lookup_url_invalid_short_url(self, mock_get, mock_echo):
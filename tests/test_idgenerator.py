@@ -0,0 +1,53 @@
+import os
+import sys
+DIR = os.path.dirname(os.path.dirname(__file__))  # The repo root directory
+sys.path.append(DIR)  # Temporarily add the repo root to sys.path so the 'src' module can be imported
+
+import unittest
+from unittest.mock import MagicMock
+from app.models.schemas import shortURL
+from app.service.idgenerator import RangeAllocator, randomID
+
+
+class TestRangeAllocator(unittest.TestCase):
+
+    def make_allocator(self, lease_size=10, **kwargs):
+        # a counter that behaves like Redis INCRBY
+        counter = {"value": 0}
+        def incrby(key, amount):
+            counter["value"] += amount
+            return counter["value"]
+        client = MagicMock()
+        client.incrby.side_effect = incrby
+        return RangeAllocator(client, "shortcode-counter", lease_size=lease_size, multiplier=52495732188953679, offset=361870285713957, **kwargs), client
+
+    def test_leases_one_block_at_a_time(self):
+        allocator, client = self.make_allocator(lease_size=10)
+
+        # ten IDs come out of the first lease, the eleventh takes a new one
+        self.assertEqual([allocator.next_id() for _ in range(11)], list(range(11)))
+        self.assertEqual(client.incrby.call_count, 2)
+        self.assertEqual(allocator.stats()["remaining_in_lease"], 9)
+
+    def test_codes_are_unique_and_valid(self):
+        allocator, _ = self.make_allocator(lease_size=100)
+        codes = [allocator.next_code() for _ in range(1000)]
+
+        # the scramble is a bijection, so distinct IDs give distinct codes
+        self.assertEqual(len(set(codes)), 1000)
+        for code in codes[:10]:
+            self.assertEqual(shortURL(short_Url=code).short_Url, code)
+        # random IDs are longer, so the two allocators never hand out the same code
+        self.assertNotEqual(len(codes[0]), len(randomID()))
+
+    def test_unscrambled_codes_count_up(self):
+        allocator, _ = self.make_allocator(scramble=False)
+        self.assertEqual([allocator.next_code() for _ in range(3)], ["0000000000", "0000000001", "0000000002"])
+
+    def test_rejects_multiplier_sharing_a_factor_with_62(self):
+        with self.assertRaises(ValueError):
+            RangeAllocator(MagicMock(), "shortcode-counter", lease_size=10, multiplier=62)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import sys
+DIR = os.path.dirname(os.path.dirname(__file__))  # The repo root directory
+sys.path.append(DIR)  # Temporarily add the repo root to sys.path so the 'src' module can be imported
+
+import time
+import asyncio
+import unittest
+from unittest.mock import patch
+from app.service import pwhashing
+
+
+class TestPasswordHashingPool(unittest.TestCase):
+
+    def test_hash_and_verify_on_the_pool(self):
+        before = pwhashing.stats()["completed"]
+        hashed = asyncio.run(pwhashing.ahash_password("Password1"))
+
+        self.assertTrue(asyncio.run(pwhashing.averify_password("Password1", hashed)))
+        self.assertFalse(asyncio.run(pwhashing.averify_password("Password2", hashed)))
+        self.assertEqual(pwhashing.stats()["completed"], before + 3)
+        self.assertEqual(pwhashing.stats()["in_flight"], 0)
+
+    def test_rejects_when_the_queue_is_full(self):
+        before = pwhashing.stats()["rejected"]
+        with patch.object(pwhashing, "PASSWORD_HASH_QUEUE_LIMIT", 0):
+            with self.assertRaises(pwhashing.PasswordHashingBusy):
+                asyncio.run(pwhashing.ahash_password("Password1"))
+        self.assertEqual(pwhashing.stats()["rejected"], before + 1)
+
+    def test_times_out_slow_hashes(self):
+        before = pwhashing.stats()["timeouts"]
+        with patch.object(pwhashing, "PASSWORD_HASH_TIMEOUT", 0.01):
+            with self.assertRaises(pwhashing.PasswordHashingBusy):
+                asyncio.run(pwhashing._run(time.sleep, 0.2))
+        self.assertEqual(pwhashing.stats()["timeouts"], before + 1)
+
+        # the slot stays taken until the abandoned work really finishes
+        self.assertEqual(pwhashing.stats()["in_flight"], 1)
+        time.sleep(0.3)
+        self.assertEqual(pwhashing.stats()["in_flight"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
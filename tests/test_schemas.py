@@ -36,6 +36,10 @@ class TestAPI(unittest.TestCase):
         with self.assertRaises(ValueError):
             schemas.shortURL(short_Url=notallowcharUrl)
         
+        # the same rules without raising
+        self.assertTrue(schemas.is_short_url(valid_short))
+        self.assertFalse(any(schemas.is_short_url(s) for s in [tooshortUrl, toolongUrl, notallowcharUrl, valid_short + "\n"]))
+        
         
     def test_email(self):
         # error if not valid user email
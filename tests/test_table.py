@@ -18,6 +18,28 @@ def create_url_table(dynamodb=None):
                 'AttributeName': 'short_url',
                 'AttributeType': 'S'
             },
+            {
+                'AttributeName': 'creator_email',
+                'AttributeType': 'S'
+            },
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'creator_email-index',
+                'KeySchema': [
+                    {
+                        'AttributeName': 'creator_email',
+                        'KeyType': 'HASH'
+                    },
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                },
+                'ProvisionedThroughput': {
+                    'ReadCapacityUnits': 5,
+                    'WriteCapacityUnits': 5
+                }
+            },
         ],
         ProvisionedThroughput={
             'ReadCapacityUnits': 5,